@@ -1,8 +1,20 @@
 import argparse
+import json
 import threading
 from logger import Logger 
 from udpControl import UDP_Control
+from socketTuning import Socket_Tuning
+from lifecycle import Lifecycle
+from profiling import Profile_Control
 from tcpControl import TCP_Control
+from fanout import FanOut_Control
+from conformance import Conformance_Runner
+from vehicleState import Vehicle_State
+from deltaCodec import Delta_Decoder
+from uplink import Uplink_Control, Uplink_Queue
+from admission import Admission_Control
+from routing import Routing_Table, ROUTES_FILE
+from payloadSchema import SCHEMA_REGISTRY
 from packet import *
 
 
@@ -10,14 +22,6 @@ from packet import *
 SYSTEM = 'CCU-IVI-CONTROL'
 LOG_LEVEL = 'INFO'
 PROTOCOL = 'UDP'
-CCU_IP_ADDR = '127.0.0.1'
-CCU_PORT = 5001
-DIVI_IP_ADDR = '127.0.0.1'
-DIVI_PORT = 5002
-PIVI1_IP_ADDR = '127.0.0.1'
-PIVI1_PORT = 5003
-PIVI2_IP_ADDR = '127.0.0.1'
-PIVI2_PORT = 5004
 
 class CCU_IVI_Control:  
     def __init__(self, logger, mode, protocol, **kwargs):
@@ -27,42 +31,77 @@ class CCU_IVI_Control:
 
         operation = "Init"
 
+        # Every destination is resolved through the routing table
+        self.routing = kwargs.get('routing')
+        self.fanOut = FanOut_Control(SYSTEM, self.logger, self.routing, kwargs.get('multicast_group', False))
+
+        # Latest vehicle information, served from cache
+        self.vehicleState = Vehicle_State(self.logger)
+
+        # Delta-coded telemetry is rebuilt to full payloads before process_message
+        self.deltaDecoder = Delta_Decoder(self.logger, self.send_resync)
+
+        # A restarted CCU opens its stores only after the previous process has closed them
+        lifecycle = kwargs.get('lifecycle')
+        if lifecycle is not None:
+            for directory in (kwargs.get('traffic_store'), kwargs.get('uplink_dir')):
+                if directory:
+                    lifecycle.claim(directory)
+
+        # Decoded headers of every received packet, queried with trafficStore.py
+        self.trafficStore = None
+        if kwargs.get('traffic_store'):
+            from trafficStore import Traffic_Store     # NumPy only needed with a store
+            self.trafficStore = Traffic_Store(kwargs.get('traffic_store'), logger=self.logger)
+
+        # Cloud-bound messages are stored on disk and forwarded while the Cloud link is up
+        self.uplink = None
+        if kwargs.get('uplink_dir'):
+            self.uplink = Uplink_Control(SYSTEM, self.logger, self.routing, Uplink_Queue(self.logger, kwargs.get('uplink_dir')))
+
+        # Flush the stores when a restart or SIGTERM ends this process
+        if lifecycle is not None:
+            for store in (self.uplink, self.trafficStore):
+                if store is not None:
+                    lifecycle.on_exit(store.close)
+
         if self.mode == 0:
-            self.src_ip_addr = kwargs.get('src_ip_addr')
-            self.src_port = kwargs.get('src_port')
-            self.divi_ip_addr = kwargs.get('divi_ip_addr')
-            self.divi_port = kwargs.get('divi_port')
-            self.pivi1_ip_addr = kwargs.get('pivi1_ip_addr')
-            self.pivi1_port = kwargs.get('pivi1_port')
-            self.pivi2_ip_addr = kwargs.get('pivi2_ip_addr')
-            self.pivi2_port = kwargs.get('pivi2_port')
+            ccu_ip_addr, ccu_port = self.routing.resolve(SourceDestID.CCU.value)
+            self.src_ip_addr = kwargs.get('src_ip_addr') or ccu_ip_addr
+            self.src_port = int(kwargs.get('src_port') or ccu_port)
+
+            # Per-source/service token buckets checked before any decode or logging
+            admission = Admission_Control.load(kwargs.get('admission'), self.logger) if kwargs.get('admission') else None
 
             # Start TCP server thread
             if self.protocol == 'TCP':
                 self.tcpControl = TCP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
-                tcp_server_thread = threading.Thread(target=self.tcpControl.tcp_server, args=(self.process_message,))
+                self.tcpControl.lifecycle = kwargs.get('lifecycle')
+                self.tcpControl.admission = admission
+                tcp_server_thread = threading.Thread(target=self.tcpControl.tcp_server, args=(self.deltaDecoder.wrap(self.process_message),))
                 tcp_server_thread.start()
 
             # Start UDP server thread
             if self.protocol == 'UDP':
                 self.udpControl = UDP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
-                udp_server_thread = threading.Thread(target=self.udpControl.udp_server, args=(self.process_message,))
+                self.udpControl.socket_tuning = kwargs.get('socket_tuning')
+                self.udpControl.lifecycle = kwargs.get('lifecycle')
+                self.udpControl.admission = admission
+                udp_server_thread = threading.Thread(target=self.udpControl.udp_server, args=(self.deltaDecoder.wrap(self.process_message),))
                 udp_server_thread.start()
 
             self.logger.message("INFO", operation, f"Source IP Address: {self.src_ip_addr}")
             self.logger.message("INFO", operation, f"Source Port: {self.src_port}")
-            self.logger.message("INFO", operation, f"D-IVI IP Address: {self.divi_ip_addr}")
-            self.logger.message("INFO", operation, f"D-IVI Port: {self.divi_port}")
-            self.logger.message("INFO", operation, f"P-IVI1 IP Address: {self.pivi1_ip_addr}")
-            self.logger.message("INFO", operation, f"P-IVI1 Port: {self.pivi1_port}")
-            self.logger.message("INFO", operation, f"P-IVI2 IP Address: {self.pivi2_ip_addr}")
-            self.logger.message("INFO", operation, f"P-IVI2 Port: {self.pivi2_port}")
+            for dest in SourceDestID:
+                self.logger.message("INFO", operation, f"Route {dest}: {self.routing.resolve(dest.value)}")
 
         elif self.mode == 1 or self.mode == 2:
-            self.divi_ip_addr = kwargs.get('divi_ip_addr')
-            self.divi_port = kwargs.get('divi_port')
             self.source_id = kwargs.get('source_id')
             self.dest_id = kwargs.get('dest_id')
+            # --dest_ip_addr/--dest_port override the route of dest_id
+            dest_ip_addr, dest_port = self.routing.resolve(self.dest_id)
+            self.divi_ip_addr = kwargs.get('divi_ip_addr') or dest_ip_addr
+            self.divi_port = int(kwargs.get('divi_port') or dest_port)
             self.service_id = kwargs.get('service_id')
             self.message_type = kwargs.get('message_type')
             self.ift_id = kwargs.get('ift_id')
@@ -105,17 +144,78 @@ class CCU_IVI_Control:
         payload_data = unpacked_packet.payload_data
         operation = "process"
 
+        if self.trafficStore is not None:
+            self.trafficStore.append(received_data)
+
         # Log the received message
         self.logger.message("INFO", operation, f"SRC:{SourceDestID(source_id)}:DEST:{SourceDestID(dest_id)}:SID:{ServiceID(service_id)}")
 
         message_type_enum = SERVICE_MESSAGE_TYPE_MAP.get(ServiceID(service_id))
         self.logger.message("INFO", operation, f"message_type : {message_type_enum(message_type)}")
 
+        # Last vehicle information request: answer from the state cache
+        if service_id == ServiceID.VEHICLE_INFORMATION.value and \
+           message_type == VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION.value:
+            self.send_vehicle_state(source_id, payload_data)
+            return
+
         ift_type_enum = IFT_TYPE_MAP.get(IFTID(ift_id))
         self.logger.message("INFO", operation, f"service_ift_id : {IFTID(ift_id)}")
         self.logger.message("INFO", operation, f"service_ift_type : {ift_type_enum(ift_type)}")
         self.logger.message("INFO", operation, f"service_data_length : {data_length}")
         self.logger.message("INFO", operation, f"service_payload_data : {payload_data}")
+
+        # Typed record for IFT types with a payload schema
+        record = SCHEMA_REGISTRY.decode(ift_id, ift_type, payload_data)
+        if record is not None:
+            self.logger.message("INFO", operation, f"service_record : {record}")
+
+        # P-IVI seat acknowledging a group message
+        if source_id in (SourceDestID.P_IVI_1.value, SourceDestID.P_IVI_2.value) and \
+           message_type == P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_RESPONSE.value:
+            self.fanOut.ack(source_id, ift_id, ift_type)
+
+        # DMS warnings sent by the D-IVI must reach every P-IVI display at once: show them on the whole group
+        if source_id == SourceDestID.D_IVI.value and ift_id in (IFTID.IFT_12_03.value, IFTID.IFT_12_04.value) and \
+           ift_type == ift_type_enum.TYPE_0002.value:
+            self.send_group(SourceDestID.P_IVI_ALL.value, ServiceID.P_IVI_CONTROL.value,
+                            P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_REQUEST.value, ift_id, ift_type_enum.TYPE_0003.value, payload_data)
+
+        # Vehicle data reported by the D-IVI updates the state cache
+        if source_id == SourceDestID.D_IVI.value and service_id == ServiceID.D_IVI_CONTROL.value and data_length > 0:
+            version = self.vehicleState.update(ift_id, ift_type, payload_data)
+            self.logger.message("INFO", operation, f"vehicle state version : {version}")
+
+        # Store and forward to the Cloud
+        if dest_id == SourceDestID.CLOUD.value and self.uplink is not None:
+            seq = self.uplink.enqueue(received_data)
+            self.logger.message("INFO", operation, f"uplink seq : {seq}, queued : {self.uplink.queue.pending()}")
+
+    # Ask a telemetry sender for a keyframe: at the socket the frame came from, else at the route of the sender
+    def send_resync(self, dest_id, packet_data, reply_to=None):
+        if reply_to is None and self.protocol == 'UDP':
+            reply_to = getattr(self.udpControl.received, 'addr', None)
+        endpoint = reply_to or self.routing.resolve(dest_id)
+        if endpoint is not None:
+            UDP_Control.udp_client(self, *endpoint, packet_data)
+
+    # Send the cached vehicle state (or the delta since the requested version) to the requester
+    def send_vehicle_state(self, dest_id, request_payload):
+        packet = ProtocolPacket(SourceDestID.CCU.value, dest_id, ServiceID.VEHICLE_INFORMATION.value,
+                                VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION.value)
+        packet.add_payload_data(self.vehicleState.answer(request_payload))
+        endpoint = self.routing.resolve(dest_id)
+        if endpoint is None:
+            self.logger.message("WARNING", "state", f"No route to {dest_id}")
+            return
+        UDP_Control.udp_client(self, *endpoint, packet.pack())
+
+    # Send message to every seat of a fan-out group
+    def send_group(self, group_id, service_id, message_type, ift_id=0, ift_type=0, payload_data=None):
+        packet = ProtocolPacket(SourceDestID.CCU.value, group_id, service_id, message_type, ift_id, ift_type)
+        if payload_data:
+            packet.add_payload_data(payload_data)
+        self.fanOut.send_group(group_id, packet.pack())
     
     # Send message
     def send_message(self):
@@ -130,121 +230,49 @@ class CCU_IVI_Control:
         elif self.protocol == 'UDP':
             UDP_Control.udp_client(self, self.divi_ip_addr, self.divi_port, self.packet_data)
 
-    # Test mode
-    def test_mode(self):
-        # Packet Format
-            # 1)Source ID: 2)Dest ID: 3)Service ID: 4)Message Type: 5)IFT ID: 6)IFT Type: 7)Data Length: 8)Payload Data
-        # Service ID
-        for service_id in ServiceID:
-            # Vehicle Information 
-            self.logger.message("INFO", "SEND", f"=============================================================================")
-            self.logger.message("INFO", "SEND", f"Service ID: {service_id}")
-            self.logger.message("INFO", "SEND", f"=============================================================================")
-            if service_id == ServiceID.VEHICLE_INFORMATION:
-                # Source ID: CCU to D-IVI
-                source_id = SourceDestID.CCU.value
-                dest_id = SourceDestID.D_IVI.value
-                service_id = service_id.value
-                message_type = VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION.value
-                self.logger.message("INFO", "SEND", f"1) {VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION.label}")
-                self.logger.message("INFO", "SEND", f"source_id:{source_id}, dest_id:{dest_id}, service_id:{service_id}, message_type:{message_type}")
-
-                packet = ProtocolPacket(source_id, dest_id, service_id, message_type)
-                packet_data = packet.pack()
-                UDP_Control.udp_client(self, DIVI_IP_ADDR, DIVI_PORT, packet_data)
-                self.logger.message("INFO", "SEND", f"---------------------------------------------------------------------------------")
-            # D-IVI Control
-            elif service_id == ServiceID.D_IVI_CONTROL:
-                source_id = SourceDestID.CCU.value
-                dest_id = SourceDestID.D_IVI.value
-                service_id_val = service_id.value
-                message_type_enum = SERVICE_MESSAGE_TYPE_MAP.get(ServiceID(service_id))
-                message_type = message_type_enum(0).value
-                self.logger.message("INFO", "SEND", f"1) {message_type_enum(0).label}")
-                if service_id in SERVICE_IFT_ID_MAP:
-                    ift_id_list = SERVICE_IFT_ID_MAP[service_id]
-                    for ift_id in ift_id_list:
-                        ift_type_list = IFT_TYPE_MAP[IFTID(ift_id)]
-                        self.logger.message("INFO", "SEND", f"2) {IFTID(ift_id).label}")
-                        self.logger.message("INFO", "SEND", f"=============================================================================")
-
-                        for ift_type in ift_type_list:
-                            if (ift_id.value == 0x0001 and (ift_type.value == 0x0001 or ift_type.value == 0x0003 or ift_type.value == 0x0006)) or \
-                               (ift_id.value == 0x0002 and (ift_type.value == 0x0001)) or \
-                               (ift_id.value == 0x0003 and (ift_type.value == 0x0001 or ift_type.value == 0x0002 or ift_type.value == 0x0004)) or \
-                               (ift_id.value == 0x0004 and (ift_type.value == 0x0001 or ift_type.value == 0x0002 or ift_type.value == 0x0004)) or \
-                               (ift_id.value == 0x0005 and (ift_type.value == 0x0001)):
-                                # Send D-IVI Control Request
-                                self.logger.message("INFO", "SEND", f"3) {ift_type.label}")
-                                self.logger.message("INFO", "SEND", f"source_id:{source_id}, dest_id:{dest_id}, service_id:{service_id_val}, message_type:{message_type}, ift_id:{ift_id.value}, ift_type:{ift_type.value}")
-                                packet = ProtocolPacket(source_id, dest_id, service_id_val, message_type, ift_id.value, ift_type.value)
-                                packet_data = packet.pack()
-                                UDP_Control.udp_client(self, DIVI_IP_ADDR, DIVI_PORT, packet_data)
-                                self.logger.message("INFO", "SEND", f"---------------------------------------------------------------------------------")
-                            
-            # P-IVI Control
-            elif service_id == ServiceID.P_IVI_CONTROL:
-                source_id = SourceDestID.CCU.value
-                dest_id = SourceDestID.P_IVI_1.value
-                service_id_val = service_id.value
-                message_type_enum = SERVICE_MESSAGE_TYPE_MAP.get(ServiceID(service_id))
-                message_type = message_type_enum(0).value
-                self.logger.message("INFO", "SEND", f"1) {message_type_enum(0).label}")
-                if service_id in SERVICE_IFT_ID_MAP:
-                    ift_id_list = SERVICE_IFT_ID_MAP[service_id]
-                    for ift_id in ift_id_list:
-                        ift_type_list = IFT_TYPE_MAP[IFTID(ift_id)]
-                        self.logger.message("INFO", "SEND", f"2) {IFTID(ift_id).label}")
-                        self.logger.message("INFO", "SEND", f"=============================================================================")
-
-                        for ift_type in ift_type_list:
-                            # Send D-IVI Control Request
-                            self.logger.message("INFO", "SEND", f"3) {ift_type.label}")
-                            self.logger.message("INFO", "SEND", f"source_id:{source_id}, dest_id:{dest_id}, service_id:{service_id_val}, message_type:{message_type}, ift_id:{ift_id.value}, ift_type:{ift_type.value}")
-                            packet = ProtocolPacket(source_id, dest_id, service_id_val, message_type, ift_id.value, ift_type.value)
-                            packet_data = packet.pack()
-                            UDP_Control.udp_client(self, PIVI1_IP_ADDR, PIVI1_PORT, packet_data)
-                            self.logger.message("INFO", "SEND", f"---------------------------------------------------------------------------------")
-           
-            # OTT Control
-            elif service_id == ServiceID.OTT_CONTROL:
-                source_id = SourceDestID.CCU.value
-                dest_id = SourceDestID.CLOUD.value
-                service_id = service_id.value
-                message_type_enum = SERVICE_MESSAGE_TYPE_MAP.get(ServiceID(service_id))
-                message_type = OTT_LOGIN_MESSAGE_TYPES.OTT_LOGIN_REQUEST.value
-                self.logger.message("INFO", "SEND", f"1) {OTT_LOGIN_MESSAGE_TYPES.OTT_LOGIN_REQUEST.label}")
-                #print(f"source_id:{source_id}, dest_id:{dest_id}, service_id:{service_id}, message_type:{message_type}")
-
-            # Blockchain Authentication
-            elif service_id == ServiceID.BLOCKCHAIN_AUTHENTICATION:
-                # Source ID: CCU to Cloud
-                source_id = SourceDestID.CCU.value
-                dest_id = SourceDestID.CLOUD.value
-                service_id = service_id.value
-                message_type = BLOCKCHAIN_MESSAGE_TYPES.BLOCKCHAIN_AUTHENTICATION_REQUEST.value
-                self.logger.message("INFO", "SEND", f"1) {BLOCKCHAIN_MESSAGE_TYPES.BLOCKCHAIN_AUTHENTICATION_REQUEST.label}")
-                #print(f"source_id:{source_id}, dest_id:{dest_id}, service_id:{service_id}, message_type:{message_type}")
+    # Test mode: conformance and throughput sweep over every valid request
+    def test_mode(self, concurrency=8, timeout=1.0, iterations=1):
+        runner = Conformance_Runner(SYSTEM, self.logger, self.routing, concurrency, timeout, iterations)
+        return runner.run()
 
 def main(args):
     # Set logger
-    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop, log_file=args.log_file, max_bytes=args.log_max_bytes)
+    if args.log_policy:
+        logger.load_policies(args.log_policy)
     logger.message("INFO", "Start", f"{SYSTEM} Control Service")
 
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    routing.install_sighup()
+
+    # Typed payload: encode the JSON record with the schema of the IFT type
+    if getattr(args, 'send_record', None):
+        args.send_data = SCHEMA_REGISTRY.encode(args.ift_id, args.ift_type, json.loads(args.send_record))
+
     if args.mode == 0:
+        # SIGUSR2: restart into a successor that takes over the server socket; SIGTERM: drain and exit
+        lifecycle = Lifecycle(SYSTEM, logger)
+        lifecycle.install()
+        # SIGUSR1 or profiling.py --pid: stage spans, cProfile and tracemalloc switched on in the running role
+        profiling = Profile_Control(SYSTEM, logger)
+        profiling.install(args.profile)
+        lifecycle.on_exit(profiling.close)
         ccuIviControl = CCU_IVI_Control(logger, args.mode, args.protocol,
                     src_ip_addr=args.src_ip_addr, src_port=args.src_port,
-                        divi_ip_addr=args.divi_ip_addr, divi_port=args.divi_port,
-                            pivi1_ip_addr=args.pivi1_ip_addr, pivi1_port=args.pivi1_port,
-                                pivi2_ip_addr=args.pivi2_ip_addr, pivi2_port=args.pivi2_port)
+                        routing=routing, multicast_group=args.multicast_group, uplink_dir=args.uplink_dir, traffic_store=args.traffic_store,
+                            admission=args.admission, socket_tuning=Socket_Tuning(args.rcvbuf, args.sndbuf, args.busy_poll, logger=logger), lifecycle=lifecycle)
+        # Sockets are bound (or adopted from the previous process): let it drain and exit
+        lifecycle.ready()
     elif args.mode == 1 or args.mode == 2:
         ccuIviControl = CCU_IVI_Control(logger, args.mode, args.protocol,
                     divi_ip_addr=args.dest_ip_addr, divi_port=args.dest_port,
                         source_id=args.source_id, dest_id=args.dest_id,
                             service_id=args.service_id, message_type=args.message_type,
-                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data)
+                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data,
+                                    routing=routing, multicast_group=args.multicast_group)
         if args.mode == 2:
-            ccuIviControl.test_mode()
+            ccuIviControl.test_mode(args.concurrency, args.timeout, args.iterations)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='CCU IVI Control Service')
@@ -252,29 +280,41 @@ if __name__ == "__main__":
     parser.add_argument('--protocol', default=PROTOCOL, choices=['UDP', 'TCP'], help='Protocol (TCP or UDP)')
     parser.add_argument('--debug_level', default=LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
     parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML), reloaded on SIGHUP')
+    parser.add_argument('--log_file', default=None, help='Log file, rotated at --log_max_bytes with gzipped backups (default: console only)')
+    parser.add_argument('--log_max_bytes', default=64 << 20, type=int, help='Log file rotation size in bytes (0: never)')
+    parser.add_argument('--log_policy', default=None, help='Per-operation sampling/rate limit/truncation (YAML, e.g. logging.yaml; default: log everything)')
+    parser.add_argument('--multicast_group', action='store_true', help='Fan out P-IVI group messages to the group multicast address instead of batched unicast')
 
     args, _ = parser.parse_known_args()
     if args.mode == 0:
-        parser.add_argument('--src_ip_addr', default=CCU_IP_ADDR, help='Src IP Address')
-        parser.add_argument('--src_port', default=CCU_PORT, help='Src Port')
-        parser.add_argument('--divi_ip_addr', default=CCU_IP_ADDR, help='D-IVI IP Address')
-        parser.add_argument('--divi_port', default=CCU_PORT, help='D-IVI Port')
-        parser.add_argument('--pivi1_ip_addr', default=PIVI1_IP_ADDR, help='P-IVI IP Address')
-        parser.add_argument('--pivi1_port', default=PIVI1_PORT, help='P-IVI1 Port')
-        parser.add_argument('--pivi2_ip_addr', default=PIVI2_IP_ADDR, help='P-IVI IP Address')
-        parser.add_argument('--pivi2_port', default=PIVI2_PORT, help='P-IVI2 Port') 
+        parser.add_argument('--src_ip_addr', default=None, help='Src IP Address (default: CCU route)')
+        parser.add_argument('--src_port', default=None, help='Src Port (default: CCU route)')
+        parser.add_argument('--uplink_dir', default=None, help='Store-and-forward queue directory for Cloud-bound messages (default: off)')
+        parser.add_argument('--traffic_store', default=None, help='Columnar store directory for received packet headers (default: off)')
+        parser.add_argument('--admission', default=None, help='Admission classes (YAML, e.g. admission.yaml) for received packets (default: off)')
+        parser.add_argument('--rcvbuf', default=None, type=int, help='SO_RCVBUF of the server socket in bytes (default: kernel)')
+        parser.add_argument('--sndbuf', default=None, type=int, help='SO_SNDBUF in bytes (default: kernel)')
+        parser.add_argument('--busy_poll', default=None, type=int, help='SO_BUSY_POLL in microseconds (default: off)')
+        parser.add_argument('--profile', default=[], type=lambda value: value.split(','),
+                            help='Profilers on at start: stages,cprofile,tracemalloc (default: off, toggled with SIGUSR1)')
     elif args.mode == 1 or args.mode == 2:
-        parser.add_argument('--dest_ip_addr', default=CCU_IP_ADDR, help='Dest IP Address')
-        parser.add_argument('--dest_port', default=CCU_PORT, help='Dest Port')
+        parser.add_argument('--dest_ip_addr', default=None, help='Dest IP Address (default: route of dest_id)')
+        parser.add_argument('--dest_port', default=None, help='Dest Port (default: route of dest_id)')
         parser.add_argument('--source_id', default=0x00, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Source ID')
         parser.add_argument('--dest_id', default=0x00, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Destination ID')
         parser.add_argument('--service_id', default=0x0001, choices=[service.value for service in ServiceID], help='Service ID')
-        parser.add_argument('--message_type', default=0x0000, help='Message Type')
-        parser.add_argument('--ift_id', default=0x0001, help='IFT ID')
-        parser.add_argument('--ift_type', default=0x0001, help='IFT Type')
+        parser.add_argument('--message_type', default=0x0000, type=lambda value: int(value, 0), help='Message Type')
+        parser.add_argument('--ift_id', default=0x0001, type=lambda value: int(value, 0), help='IFT ID')
+        parser.add_argument('--ift_type', default=0x0001, type=lambda value: int(value, 0), help='IFT Type')
         parser.add_argument('--send_data', default="", help='Payload Data')
+        parser.add_argument('--send_record', default=None, help='Payload as a JSON record, encoded with the schema of ift_id/ift_type')
+    if args.mode == 2:
+        parser.add_argument('--concurrency', default=8, type=int, help='Test mode: requests in flight at once')
+        parser.add_argument('--timeout', default=1.0, type=float, help='Test mode: seconds to wait for each response')
+        parser.add_argument('--iterations', default=1, type=int, help='Test mode: passes over the request matrix')
 
     args = parser.parse_args()
     main(args)
 
-# python3 CCU-IVI-Control.py  --divi_ip_addr='192.168.10.103' --pivi_ip_addr='192.168.10.103'
\ No newline at end of file
+# python3 CCU-IVI-Control.py --routes=routes.yaml
\ No newline at end of file
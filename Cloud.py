@@ -0,0 +1,543 @@
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from logger import Logger
+from routing import Routing_Table, ROUTES_FILE
+from socketTuning import Socket_Tuning
+from deltaCodec import Delta_Decoder
+from udpControl import UDP_Control
+from uplink import BATCH_MAGIC, ACK_MAGIC, ACK, unpack_batch, pack_batch
+from packet import *
+
+# Global variables
+SYSTEM = 'CLOUD'
+LOG_LEVEL = 'INFO'
+PROTOCOL = 'UDP'
+
+HEADER_LEN = 12
+SESSION_TIMEOUT = 300.0     # seconds without traffic before a vehicle session is dropped
+SINK_BATCH = 2048           # packets per handoff to the sink
+SINK_INTERVAL = 0.1         # seconds before a partial batch is handed off
+STATS_INTERVAL = 10.0       # seconds between ingest stats log lines
+
+
+class Vehicle_Session:
+    # one per connected vehicle; __slots__ keeps the per-vehicle cost small with thousands connected
+    __slots__ = ('vehicle', 'first_seen', 'last_seen', 'packets', 'bytes', 'last_seq', 'queued_seq', 'failures', 'decoder')
+
+    def __init__(self, vehicle, now):
+        self.vehicle = vehicle
+        self.first_seen = now
+        self.last_seen = now
+        self.packets = 0
+        self.bytes = 0
+        self.last_seq = 0       # highest uplink seq written by the sink, the position acked to the vehicle
+        self.queued_seq = 0     # highest uplink seq handed to the sink (at-least-once batches are deduplicated)
+        self.failures = 0       # failed sink writes; batches queued before the last one are not acked
+        self.decoder = None     # Delta_Decoder of a role sending straight to the Cloud
+
+
+# Sinks: write(records) gets [(vehicle, received time, ProtocolPacket), ...] off the event loop ================================================
+class Null_Sink:
+    def __init__(self, arg=None):
+        self.count = 0
+
+    def write(self, records):
+        self.count += len(records)
+
+    def close(self):
+        pass
+
+
+class JSONL_Sink:
+    def __init__(self, path='cloud-ingest.jsonl'):
+        self.file = open(path, 'a')
+
+    def write(self, records):
+        lines = [json.dumps({'vehicle': str(vehicle), 'time': received, 'source_id': packet.source_id,
+                             'dest_id': packet.dest_id, 'service_id': packet.service_id,
+                             'message_type': packet.message_type, 'ift_id': packet.ift_id, 'ift_type': packet.ift_type,
+                             'payload': packet.payload_data.hex()}) for vehicle, received, packet in records]
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Counter_Sink:
+    # shared counter across worker processes (benchmark)
+    def __init__(self, counter):
+        self.counter = counter
+
+    def write(self, records):
+        with self.counter.get_lock():
+            self.counter.value += len(records)
+
+    def close(self):
+        pass
+
+
+SINK_MAP = {'null': Null_Sink, 'jsonl': JSONL_Sink}
+
+
+def load_sink(spec):
+    """'null', 'jsonl[:path]' or 'module:Class[:arg]' for a custom sink."""
+    name, _, arg = spec.partition(':')
+    if name in SINK_MAP:
+        return SINK_MAP[name](arg) if arg else SINK_MAP[name]()
+    class_name, _, arg = arg.partition(':')
+    sink_class = getattr(importlib.import_module(name), class_name)
+    return sink_class(arg) if arg else sink_class()
+
+
+class Cloud_Datagram_Protocol(asyncio.DatagramProtocol):
+    def __init__(self, control):
+        self.control = control
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.control.ingest_datagram(data, addr, self.transport)
+
+
+class Cloud_Control:
+    def __init__(self, logger, mode, protocol, **kwargs):
+        self.logger = logger
+        self.mode = mode
+        self.protocol = protocol
+
+        operation = "Init"
+
+        # Every destination is resolved through the routing table
+        self.routing = kwargs.get('routing')
+        src_ip_addr, src_port = self.routing.resolve(SourceDestID.CLOUD.value)
+        self.src_ip_addr = kwargs.get('src_ip_addr') or src_ip_addr
+        self.src_port = int(kwargs.get('src_port') or src_port)
+        self.reuse_port = kwargs.get('reuse_port', False)
+        # asyncio reads with recvfrom, so kernel drops are polled from /proc/net/udp
+        self.socket_tuning = kwargs.get('socket_tuning') or Socket_Tuning(rcvbuf=1 << 23, rxq_ovfl=False, logger=self.logger)
+        self.sock = None
+        self.sink = kwargs.get('sink') or Null_Sink()
+        # Encrypted payloads (payloadCrypto) are opened on the sink thread, off the event loop
+        self.crypto = None
+        if kwargs.get('crypto_key'):
+            from payloadCrypto import Packet_Crypto, load_key     # cryptography only needed with a key
+            self.crypto = Packet_Crypto(load_key(kwargs.get('crypto_key')), logger=self.logger)
+        # Passenger Top-K content (IFT_23_02 TYPE_0004) counted from the media usage reports on the sink thread
+        self.media_topk = None
+        if kwargs.get('media_topk'):
+            from mediaTopK import Media_TopK, MAX_PASSENGERS
+            self.media_topk = Media_TopK(kwargs.get('media_topk'), max_passengers=kwargs.get('media_passengers') or MAX_PASSENGERS,
+                                         logger=self.logger)
+        # Route deviation and delivery alerts (IFT_13_03 TYPE_0007) from the driving info positions, on the sink thread
+        self.route_monitor = None
+        if kwargs.get('delivery_route'):
+            from routeMonitor import Route, Route_Monitor, DEVIATION_M
+            route = Route.load(kwargs.get('delivery_route'), kwargs.get('route_deviation_m') or DEVIATION_M)
+            self.route_monitor = Route_Monitor(route, logger=self.logger)
+            self.logger.message("INFO", operation, f"Route: {route.size} segments, {route.along[-1]:.1f} km, {len(route.stops)} stops")
+        # Vehicle status history (IFT_13_05 TYPE_0008, IFT_13_06) in fixed-memory rings, mapped to files with a directory;
+        # sized for the fleet (history_vehicles) unless the slots are given
+        self.history = None
+        if kwargs.get('history_signals') or kwargs.get('history_vehicles'):
+            from timeSeriesStore import Time_Series_Store, signal_slots
+            history_signals = kwargs.get('history_signals') or signal_slots(kwargs.get('history_vehicles'))
+            self.history = Time_Series_Store(history_signals, kwargs.get('history_dir'), logger=self.logger)
+
+        # vehicle -> Vehicle_Session; a vehicle is its uplink queue epoch, or its IP and source ID for single packets
+        # (role senders use a new socket, so a new port, for every packet)
+        self.sessions = {}
+        self.batch = []
+        # Uplink batches in self.batch, acked only once the sink has written them: (transport, addr, session, last seq, failures)
+        self.acks = []
+        # Roles sending single packets delta code their telemetry (the CCU decodes before its uplink batches):
+        # id(packet) -> (Delta_Decoder, sender address) of the packets in the current batch, decoded on the sink
+        # thread after crypto; keyframe requests go back to the sender address
+        self.decoders = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)   # one writer keeps sink batches in order
+        self.stats = {'datagrams': 0, 'packets': 0, 'duplicates': 0, 'malformed': 0, 'handoffs': 0, 'expired': 0, 'kernel_drops': 0}
+
+        self.logger.message("INFO", operation, f"Source IP Address: {self.src_ip_addr}")
+        self.logger.message("INFO", operation, f"Source Port: {self.src_port}")
+
+        self.loop = None
+        self.stop_requested = False
+        self.ready = threading.Event()
+        if self.mode == 0 and kwargs.get('start', True):
+            server_thread = threading.Thread(target=self.run)
+            server_thread.start()
+
+    # Set Server ==================================================================================================================================
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        if self.stop_requested:
+            self.stopped.set()
+        self.loop = asyncio.get_running_loop()
+        transport = None
+        server = None
+        if self.protocol == 'UDP':
+            sock = self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket_tuning.apply(sock)
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.src_ip_addr, self.src_port))
+            transport, _ = await self.loop.create_datagram_endpoint(lambda: Cloud_Datagram_Protocol(self), sock=sock)
+        elif self.protocol == 'TCP':
+            server = await asyncio.start_server(self.handle_stream, self.src_ip_addr, self.src_port,
+                                                reuse_port=self.reuse_port or None)
+        self.logger.message("INFO", "server", f"{SYSTEM}: {self.src_ip_addr}:{self.src_port} ({self.protocol}, pid {os.getpid()})")
+        self.ready.set()
+
+        housekeeping = asyncio.ensure_future(self.housekeeping())
+        await self.stopped.wait()
+        housekeeping.cancel()
+        if server is not None:
+            server.close()
+        self.handoff()
+        self.executor.shutdown(wait=True)
+        await asyncio.sleep(0)      # acks of the last handoffs, before the socket closes
+        if transport is not None:
+            transport.close()
+        self.sink.close()
+        if self.history is not None:
+            self.history.close()
+        if self.crypto is not None:
+            self.crypto.close()
+
+    def stop(self):
+        self.stop_requested = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def housekeeping(self):
+        last_stats = time.monotonic()
+        while True:
+            await asyncio.sleep(SINK_INTERVAL)
+            self.handoff()
+            now = time.monotonic()
+            if now - last_stats >= STATS_INTERVAL:
+                last_stats = now
+                self.expire_sessions(now)
+                if self.sock is not None:
+                    self.stats['kernel_drops'] = self.socket_tuning.poll_drops(self.sock)
+                self.logger.message("INFO", "ingest", f"vehicles: {len(self.sessions)}, " +
+                                    ", ".join(f"{name}: {count}" for name, count in self.stats.items()))
+
+    async def handle_stream(self, reader, writer):
+        # TCP: packets back to back, framed by the header's data length
+        address = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                header = await reader.readexactly(HEADER_LEN)
+                payload = await reader.readexactly(struct.unpack_from('!H', header, 10)[0])
+                self.ingest((address, header[0]), [header + payload], decode=header[0] != SourceDestID.CCU.value)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # Set Ingest ==================================================================================================================================
+    def ingest_datagram(self, data, addr, transport):
+        self.stats['datagrams'] += 1
+        if data[:4] == BATCH_MAGIC:
+            # uplink batch from a CCU: deliver new records once, ack the whole batch
+            try:
+                epoch, first_seq, records = unpack_batch(data)
+            except (ValueError, struct.error):
+                self.stats['malformed'] += 1
+                return
+            session = self.ingest((addr[0], epoch), records, first_seq)
+            self.acks.append((transport, addr, session, first_seq + len(records) - 1, session.failures))
+        else:
+            source_id = data[0] if data else 0
+            self.ingest((addr[0], source_id), [data], decode=source_id != SourceDestID.CCU.value, reply_to=addr)
+
+    def ingest(self, vehicle, records, first_seq=None, decode=False, reply_to=None):
+        now = time.monotonic()
+        session = self.sessions.get(vehicle)
+        if session is None:
+            session = self.sessions[vehicle] = Vehicle_Session(vehicle, now)
+        session.last_seen = now
+        if decode and session.decoder is None:
+            session.decoder = Delta_Decoder(self.logger, self.send_resync)
+
+        if first_seq is not None:
+            last_seq = first_seq + len(records) - 1
+            if first_seq <= session.queued_seq:
+                skip = min(session.queued_seq - first_seq + 1, len(records))
+                self.stats['duplicates'] += skip
+                records = records[skip:]
+            session.queued_seq = max(session.queued_seq, last_seq)
+
+        received = time.time_ns()
+        batch = self.batch
+        count = len(batch)
+        for packet_data in records:
+            if len(packet_data) < HEADER_LEN:
+                self.stats['malformed'] += 1
+                continue
+            packet = ProtocolPacket.unpack(packet_data)
+            batch.append((vehicle, received, packet))
+            if decode:
+                self.decoders[id(packet)] = (session.decoder, reply_to)
+            session.bytes += len(packet_data)
+        count = len(batch) - count
+        session.packets += count
+        self.stats['packets'] += count
+        if len(batch) >= SINK_BATCH:
+            self.handoff()
+        return session
+
+    def handoff(self):
+        if not self.batch and not self.acks:
+            return
+        batch, self.batch = self.batch, []
+        decoders, self.decoders = self.decoders, {}
+        acks, self.acks = self.acks, []
+        self.stats['handoffs'] += 1
+        future = self.executor.submit(self.write_batch, batch, decoders)
+        future.add_done_callback(lambda future: self.call_soon(self.written, future, acks))
+
+    def call_soon(self, callback, *args):
+        if self.loop is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass        # loop closed: the vehicle resends the unacked batches
+
+    def written(self, future, acks):
+        # on the event loop: ack the uplink batches of a handoff once the sink has them, in handoff order
+        failed = future.exception() is not None or not future.result()
+        if future.exception() is not None:
+            self.logger.message("ERROR", "sink", f"Sink batch failed: {future.exception()}")
+        for transport, addr, session, last_seq, failures in acks:
+            if failed:
+                # the vehicle resends from its acked position; dedup restarts there
+                session.failures += 1
+                session.queued_seq = session.last_seq
+            elif failures == session.failures:
+                session.last_seq = max(session.last_seq, last_seq)
+                if not transport.is_closing():
+                    transport.sendto(ACK.pack(ACK_MAGIC, session.vehicle[1], session.last_seq), addr)
+            # else: queued behind a failed write, after the records that are missing; left unacked
+
+    def write_batch(self, batch, decoders=None):
+        if self.crypto is not None:
+            failed = self.crypto.open_packets([packet for _, _, packet in batch])
+            if failed:
+                # forged or wrong-key payloads never reach the sink
+                self.logger.message("WARNING", "crypto", f"Dropped {len(failed)} packets failing authentication")
+                failed = set(map(id, failed))
+                batch = [record for record in batch if id(record[2]) not in failed]
+        if decoders:
+            # full payloads rebuilt from delta frames; frames of a lost stream are dropped until its keyframe
+            batch = [record for record in batch if id(record[2]) not in decoders or self.decode_record(*decoders[id(record[2])], record)]
+        if self.media_topk is not None:
+            self.media_topk.add_packets([packet for _, _, packet in batch])
+        if self.route_monitor is not None:
+            self.route_monitor.add_packets(batch)
+        if self.history is not None:
+            self.history.add_packets(batch)
+        try:
+            self.sink.write(batch)
+        except Exception as e:
+            self.logger.message("ERROR", "sink", f"Sink write of {len(batch)} packets failed: {e}")
+            return False
+        return True
+
+    def decode_record(self, decoder, reply_to, record):
+        # one bad frame costs only its own packet, not the sink batch
+        try:
+            return decoder.decode(record[2], reply_to)
+        except Exception as e:
+            self.logger.message("WARNING", "delta", f"Dropped a frame from {record[0]}: {e}")
+            return False
+
+    def send_resync(self, dest_id, packet_data, reply_to=None):
+        # at the socket the frame came from, else at the route of the sender
+        endpoint = reply_to or self.routing.resolve(dest_id)
+        if endpoint is None:
+            self.logger.message("WARNING", "delta", f"No route to {dest_id}")
+            return
+        UDP_Control.udp_client(self, *endpoint, packet_data)
+
+    def expire_sessions(self, now):
+        expired = [vehicle for vehicle, session in self.sessions.items() if now - session.last_seen > SESSION_TIMEOUT]
+        for vehicle in expired:
+            del self.sessions[vehicle]
+        self.stats['expired'] += len(expired)
+
+
+# Multi-process ingest: one event loop per worker on a shared SO_REUSEPORT port ===================================================================
+def cloud_socket_tuning(args, logger):
+    return Socket_Tuning(args.rcvbuf, args.sndbuf, args.busy_poll, rxq_ovfl=False, logger=logger)
+
+
+def run_worker(args, sink=None):
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    routing = Routing_Table(logger, args.routes)
+    cloudControl = Cloud_Control(logger, 0, args.protocol, src_ip_addr=args.src_ip_addr, src_port=args.src_port,
+                                 routing=routing, reuse_port=args.workers > 1, sink=sink or load_sink(args.sink), start=False,
+                                 crypto_key=args.crypto_key, media_topk=args.media_topk, media_passengers=args.media_passengers, delivery_route=args.delivery_route, route_deviation_m=args.route_deviation_m,
+                                 history_vehicles=args.history_vehicles, history_signals=args.history_signals, history_dir=args.history_dir, socket_tuning=cloud_socket_tuning(args, logger))
+    cloudControl.run()
+
+
+# Benchmark: sustained packets/sec and memory per connected vehicle ==============================================================================
+def send_vehicles(endpoint, vehicles, count, batch_records, done, first_epoch=1):
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(vehicles)]
+    packet = ProtocolPacket(SourceDestID.CCU.value, SourceDestID.CLOUD.value, ServiceID.D_IVI_CONTROL.value, 0,
+                            IFTID.IFT_13_03.value, IFT_13_03_Type.TYPE_0002.value)
+    packet.add_payload_data(bytes(32))
+    packet_data = packet.pack()
+    seqs = [1] * vehicles
+    sent = 0
+    index = 0
+    while sent < count:
+        vehicle = index % vehicles
+        if batch_records > 1:
+            data = pack_batch(first_epoch + vehicle, seqs[vehicle], [packet_data] * batch_records)
+            seqs[vehicle] += batch_records
+            sent += batch_records
+        else:
+            data = packet_data
+            sent += 1
+        socks[vehicle].sendto(data, endpoint)
+        index += 1
+        if index % 64 == 0:
+            time.sleep(0)   # let the receiver drain under loopback
+    for sock in socks:
+        sock.close()
+    done.value += sent
+
+
+def benchmark(args):
+    # memory per connected vehicle: session table growth
+    logger = Logger('CRITICAL', SYSTEM, args.protocol, log_console=False)
+    routing = Routing_Table(logger, args.routes)
+    control = Cloud_Control(logger, 1, args.protocol, routing=routing, start=False)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for vehicle in range(args.vehicles):
+        control.ingest(('10.0.%d.%d' % (vehicle // 256, vehicle % 256), SourceDestID.D_IVI.value), [])
+    per_vehicle = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename')) / args.vehicles
+    tracemalloc.stop()
+    print(f"memory: {per_vehicle:.0f} bytes per connected vehicle ({args.vehicles} sessions)")
+
+    # sustained ingest rate over loopback
+    endpoint = (args.src_ip_addr or '127.0.0.1', int(args.src_port or 0) or 15008)
+    args.src_ip_addr, args.src_port = endpoint
+    for batch_records in (1, 32):
+        counter = multiprocessing.Value('Q', 0)
+        sent = multiprocessing.Value('Q', 0)
+        workers = [multiprocessing.Process(target=run_worker, args=(args, Counter_Sink(counter)), daemon=True)
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.5)
+
+        # every sender process has its own vehicles, so its own uplink epochs
+        vehicles = max(args.vehicles // args.senders, 1)
+        senders = [multiprocessing.Process(target=send_vehicles, args=(endpoint, vehicles, args.benchmark // args.senders, batch_records,
+                                           sent, 1 + index * vehicles)) for index in range(args.senders)]
+        start_ns = time.perf_counter_ns()
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        send_s = (time.perf_counter_ns() - start_ns) / 1e9
+        # wait for the last handoffs
+        previous = -1
+        while counter.value != previous:
+            previous = counter.value
+            time.sleep(2 * SINK_INTERVAL)
+        elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9 - 2 * SINK_INTERVAL
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+        label = 'single packets' if batch_records == 1 else f'uplink batches of {batch_records}'
+        print(f"{label:<24} {args.workers} worker(s), {args.vehicles} vehicles: {counter.value / elapsed_s:,.0f} packets/s ingested, "
+              f"offered {sent.value / send_s:,.0f}/s, {counter.value}/{sent.value} delivered "
+              f"({1 - counter.value / max(sent.value, 1):.1%} dropped by the kernel)")
+    print(f"parent max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    # Set logger
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger.message("INFO", "Start", f"{SYSTEM} Ingest Service")
+
+    if args.workers > 1:
+        workers = [multiprocessing.Process(target=run_worker, args=(args,)) for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return
+
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    routing.install_sighup()
+
+    cloudControl = Cloud_Control(logger, 0, args.protocol, src_ip_addr=args.src_ip_addr, src_port=args.src_port,
+                                 routing=routing, sink=load_sink(args.sink), crypto_key=args.crypto_key, media_topk=args.media_topk, media_passengers=args.media_passengers,
+                                 delivery_route=args.delivery_route, route_deviation_m=args.route_deviation_m,
+                                 history_vehicles=args.history_vehicles, history_signals=args.history_signals, history_dir=args.history_dir, socket_tuning=cloud_socket_tuning(args, logger),
+                                 start=False)
+    # serve on the main thread: returning from main would start interpreter shutdown, after which the sink executor
+    # refuses new batches
+    cloudControl.run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"{SYSTEM} Ingest Service")
+    parser.add_argument('--protocol', default=PROTOCOL, choices=['UDP', 'TCP'], help='Protocol (TCP or UDP)')
+    parser.add_argument('--debug_level', default=LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+    parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML), reloaded on SIGHUP')
+    parser.add_argument('--src_ip_addr', default=None, help='Src IP Address (default: Cloud route)')
+    parser.add_argument('--src_port', default=None, help='Src Port (default: Cloud route)')
+    parser.add_argument('--workers', default=1, type=int, help='Ingest processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--sink', default='null', help="Sink: 'null', 'jsonl[:path]' or 'module:Class[:arg]'")
+    parser.add_argument('--rcvbuf', default=1 << 23, type=int, help='SO_RCVBUF of the ingest socket in bytes')
+    parser.add_argument('--sndbuf', default=None, type=int, help='SO_SNDBUF in bytes (default: kernel)')
+    parser.add_argument('--busy_poll', default=None, type=int, help='SO_BUSY_POLL in microseconds (default: off)')
+    parser.add_argument('--crypto_key', default=None, help='Master key file for opening encrypted payloads (default: off)')
+    parser.add_argument('--media_topk', default=0, type=int, help='Counters of the fleet-wide media usage Top-K summary (default: 0, off)')
+    parser.add_argument('--media_passengers', default=None, type=int,
+                        help='Passenger Top-K summaries kept, up to about 25 KB each (default: 2048)')
+    parser.add_argument('--delivery_route', default=None, help='Planned delivery route (CSV: latitude,longitude[,stop,deadline_ms]) for route deviation alerts (default: off)')
+    parser.add_argument('--route_deviation_m', default=None, type=float, help='Distance from the route that raises a deviation alert in m (default: 100)')
+    parser.add_argument('--history_vehicles', default=0, type=int,
+                        help='Vehicles the status history holds, 34 signal slots (about 8 MiB) each (default: 0, off)')
+    parser.add_argument('--history_signals', default=0, type=int, help='Signal slots of the vehicle status history (default: from --history_vehicles)')
+    parser.add_argument('--history_dir', default=None, help='Directory the history rings are mapped to (default: memory only)')
+    parser.add_argument('--benchmark', default=0, type=int, help='Measure sustained packets/sec with N packets and memory per vehicle')
+    parser.add_argument('--vehicles', default=1000, type=int, help='Benchmark: simulated vehicles')
+    parser.add_argument('--senders', default=2, type=int, help='Benchmark: sender processes')
+
+    args = parser.parse_args()
+    main(args)
+
+# python3 Cloud.py --routes=routes.yaml --sink jsonl:cloud-ingest.jsonl
+# python3 Cloud.py --benchmark 200000 --vehicles 1000 --workers 2
@@ -1,22 +1,23 @@
 import argparse
+import json
 import threading
+import time
 from logger import Logger 
 from udpControl import UDP_Control
+from socketTuning import Socket_Tuning
+from lifecycle import Lifecycle
+from profiling import Profile_Control
 from tcpControl import TCP_Control
+from routing import Routing_Table, ROUTES_FILE
+from deltaCodec import Delta_Encoder, delta_type
+from suppression import Send_Suppressor
+from payloadSchema import SCHEMA_REGISTRY
 from packet import *
 
 # Global variables
 SYSTEM = 'D-IVI'
 LOG_LEVEL = 'INFO'
 PROTOCOL = 'UDP'
-CCU_IP_ADDR = '127.0.0.1'
-CCU_PORT = 5001
-DIVI_IP_ADDR = '127.0.0.1'
-DIVI_PORT = 5002
-PIVI1_IP_ADDR = '127.0.0.1'
-PIVI1_PORT = 5003
-PIVI2_IP_ADDR = '127.0.0.1'
-PIVI2_PORT = 5004
 
 
 class D_IVI_Control:
@@ -27,26 +28,49 @@ class D_IVI_Control:
 
         operation = "Init"
 
+        # Every destination is resolved through the routing table
+        self.routing = kwargs.get('routing')
+        # Periodic telemetry (IFT_13_03/05/06) is delta coded: the mode 0 server keeps one encoder across
+        # --telemetry_interval sends and answers the keyframe requests the receivers send to its port.
+        # A mode 1 one-shot has no previous frame and sends the payload as is.
+        self.deltaEncoder = Delta_Encoder(self.logger)
+        # Repeated warnings: only state changes and keepalives are sent
+        keepalive = kwargs.get('suppress') or 0
+        self.suppressor = Send_Suppressor(self.logger, keepalive) if keepalive > 0 else None
+        # Cloud-bound payloads are encrypted with the key on the USB token
+        self.crypto = None
+        if kwargs.get('crypto_key'):
+            from payloadCrypto import Packet_Crypto, load_key     # cryptography only needed with a key
+            self.crypto = Packet_Crypto(load_key(kwargs.get('crypto_key')), logger=self.logger)
+
         if self.mode == 0:
-            self.src_ip_addr = kwargs.get('src_ip_addr')
-            self.src_port = kwargs.get('src_port')
+            src_ip_addr, src_port = self.routing.resolve(SourceDestID.D_IVI.value)
+            self.src_ip_addr = kwargs.get('src_ip_addr') or src_ip_addr
+            self.src_port = int(kwargs.get('src_port') or src_port)
             self.logger.message("INFO", operation, f"Source IP Address: {self.src_ip_addr}")
             self.logger.message("INFO", operation, f"Source Port: {self.src_port}")
 
             if self.protocol == 'TCP':
                 self.tcpControl = TCP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
+                self.tcpControl.lifecycle = kwargs.get('lifecycle')
                 tcp_server_thread = threading.Thread(target=self.tcpControl.tcp_server, args=(self.process_message,))
                 tcp_server_thread.start()
 
             if self.protocol == 'UDP':
                 self.udpControl = UDP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
+                self.udpControl.socket_tuning = kwargs.get('socket_tuning')
+                self.udpControl.lifecycle = kwargs.get('lifecycle')
+                self.udpControl.suppressor = self.suppressor
+                self.udpControl.crypto = self.crypto
                 udp_server_thread = threading.Thread(target=self.udpControl.udp_server, args=(self.process_message,))
                 udp_server_thread.start()
 
-        self.dest_ip_addr = kwargs.get('dest_ip_addr')
-        self.dest_port = kwargs.get('dest_port')
         self.source_id = kwargs.get('source_id')
         self.dest_id = kwargs.get('dest_id')
+        # --dest_ip_addr/--dest_port override the route of dest_id
+        dest_ip_addr, dest_port = self.routing.resolve(self.dest_id)
+        self.dest_ip_addr = kwargs.get('dest_ip_addr') or dest_ip_addr
+        self.dest_port = int(kwargs.get('dest_port') or dest_port)
         self.service_id = kwargs.get('service_id')
         self.message_type = kwargs.get('message_type')
         self.ift_id = kwargs.get('ift_id')
@@ -63,18 +87,52 @@ class D_IVI_Control:
         self.logger.message("INFO", operation, f"IFT Type: {self.ift_type}")
         self.logger.message("INFO", operation, f"Data length: {len(self.send_data)}")
         self.logger.message("INFO", operation, f"Send Data: {self.send_data}")
+
+        # Sends go out from this socket, so the receivers' keyframe requests come back to it (fleetSim: one per vehicle);
+        # default the server socket (mode 0) or a new socket per send (mode 1)
+        self.sock = kwargs.get('sock')
+
+        self.telemetry_interval = kwargs.get('telemetry_interval') or 0
+        if self.mode == 0 and self.telemetry_interval > 0:
+            telemetry_thread = threading.Thread(target=self.send_telemetry, daemon=True)
+            telemetry_thread.start()
     
-        if self.mode == 1:
+        # start=False: the caller sends with send_message (fleetSim)
+        if self.mode == 1 and kwargs.get('start', True):
             # create packet and send
             packet = ProtocolPacket(self.source_id, self.dest_id, self.service_id, \
-                                        self.message_type, self.ift_id, self.ift_type, len(self.send_data), self.send_data)
+                                        self.message_type, self.ift_id, self.ift_type)
+            packet.add_payload_data(self.send_data)
             self.packet_data = packet.pack()
 
             self.logger.message("INFO", "SEND", f"DEST:{self.dest_ip_addr}:{self.dest_port}-Packet:{self.packet_data}")    
             if self.protocol == 'TCP':
                 UDP_Control.tcp_client(self, self.dest_ip_addr, self.dest_port, self.packet_data)
             elif self.protocol == 'UDP':
-                UDP_Control.udp_client(self, self.dest_ip_addr, self.dest_port, self.packet_data)
+                # --send_count repeats the message once per millisecond, as DMS re-emits a warning every frame
+                for _ in range(max(kwargs.get('send_count') or 1, 1)):
+                    UDP_Control.udp_client(self, self.dest_ip_addr, self.dest_port, self.packet_data)
+                    if kwargs.get('send_count'):
+                        time.sleep(0.001)
+                if self.suppressor is not None:
+                    self.suppressor.report()
+
+    # Send the configured message every telemetry_interval seconds through the persistent delta encoder
+    def send_telemetry(self):
+        while True:
+            packet = ProtocolPacket(self.source_id, self.dest_id, self.service_id, \
+                                        self.message_type, self.ift_id, self.ift_type)
+            self.send_message(packet, self.send_data, telemetry=True)
+            time.sleep(self.telemetry_interval)
+
+    # Send packet with data to the configured destination; False if suppressed or not sent
+    def send_message(self, packet, data, telemetry=False):
+        # periodic sends are telemetry: IFT ID 0x0007 is the IFT_13_03 driving info, not IFT_13_02 driver info
+        self.deltaEncoder.add_payload_data(packet, data, delta_type(packet.ift_id, packet.ift_type) if telemetry else None)
+        sock = self.sock
+        if sock is None and self.mode == 0 and self.protocol == 'UDP':
+            sock = self.udpControl.sock
+        return UDP_Control.udp_client(self, self.dest_ip_addr, self.dest_port, packet.pack(), sock=sock)
 
     def process_message(self, received_data):
         # Unpacking the packet
@@ -90,6 +148,10 @@ class D_IVI_Control:
         payload_data = unpacked_packet.payload_data
         operation = "Parse"
 
+        # Receiver lost a telemetry stream: next frame is a keyframe
+        if self.deltaEncoder.handle_resync(unpacked_packet):
+            return
+
         # self.logger.message("INFO", operation, f"SRC:{source_id}-DES:{dest_id}", f"Service ID: {service_id}")
         # self.logger.message("INFO", operation, f"SRC:{source_id}-DES:{dest_id}", f"Message Type: {message_type}")
         # self.logger.message("INFO", operation, f"SRC:{source_id}-DES:{dest_id}", f"IFT ID: {ift_id}")
@@ -109,6 +171,11 @@ class D_IVI_Control:
         self.logger.message("INFO", operation, f"service_data_length : {data_length}")
         self.logger.message("INFO", operation, f"service_payload_data : {payload_data}")
 
+        # Typed record for IFT types with a payload schema
+        record = SCHEMA_REGISTRY.decode(ift_id, ift_type, payload_data)
+        if record is not None:
+            self.logger.message("INFO", operation, f"service_record : {record}")
+
 
         #process received message
         # 1. receive message from CCU
@@ -128,7 +195,11 @@ class D_IVI_Control:
                     self.logger.message("INFO", "SEND", f"Send P-IVI Control Response")
                     packet = ProtocolPacket(self.source_id, SourceDestID.CCU.value, service_id, message_type, ift_id, ift_type, data_length, payload_data)
                     self.packet_data = packet.pack()
-                    self.udpControl.udp_client(CCU_IP_ADDR, CCU_PORT, self.packet_data)
+                    endpoint = self.routing.resolve(SourceDestID.CCU.value)
+                    if endpoint is None:
+                        self.logger.message("WARNING", "SEND", f"No route to {SourceDestID.CCU.value}")
+                        return
+                    self.udpControl.udp_client(*endpoint, self.packet_data)
                     self.logger.message("INFO", "SEND", f"packet : b{self.packet_data}")
         else:
             print("Received Unknown Message")
@@ -143,20 +214,42 @@ class D_IVI_Control:
 def main(args):
 
     # Set logger
-    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop, log_file=args.log_file, max_bytes=args.log_max_bytes)
+    if args.log_policy:
+        logger.load_policies(args.log_policy)
     logger.message("INFO", "Start", f"{SYSTEM} Control Service")
 
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    routing.install_sighup()
+
+    # Typed payload: encode the JSON record with the schema of the IFT type
+    if getattr(args, 'send_record', None):
+        args.send_data = SCHEMA_REGISTRY.encode(args.ift_id, args.ift_type, json.loads(args.send_record))
+
     if args.mode == 0:
+        # SIGUSR2: restart into a successor that takes over the server socket; SIGTERM: drain and exit
+        lifecycle = Lifecycle(SYSTEM, logger)
+        lifecycle.install()
+        # SIGUSR1 or profiling.py --pid: stage spans, cProfile and tracemalloc switched on in the running role
+        profiling = Profile_Control(SYSTEM, logger)
+        profiling.install(args.profile)
+        lifecycle.on_exit(profiling.close)
         pIviControl = D_IVI_Control(logger, args.mode, args.protocol, src_ip_addr=args.src_ip_addr, src_port=args.src_port, \
                     dest_ip_addr=args.dest_ip_addr, dest_port=args.dest_port, source_id=args.source_id, dest_id=args.dest_id, \
                         service_id=args.service_id, message_type=args.message_type, ift_id=args.ift_id, ift_type=args.ift_type, \
-                            send_data=args.send_data)
+                            send_data=args.send_data, routing=routing, suppress=args.suppress, crypto_key=args.crypto_key, \
+                                socket_tuning=Socket_Tuning(args.rcvbuf, args.sndbuf, args.busy_poll, logger=logger), lifecycle=lifecycle, \
+                                    telemetry_interval=args.telemetry_interval)
+        # Sockets are bound (or adopted from the previous process): let it drain and exit
+        lifecycle.ready()
     elif args.mode == 1:
         pIviControl = D_IVI_Control(logger, args.mode, args.protocol, \
                     dest_ip_addr=args.dest_ip_addr, dest_port=args.dest_port, \
                         source_id=args.source_id, dest_id=args.dest_id, \
                             service_id=args.service_id, message_type=args.message_type,\
-                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data)
+                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data, routing=routing, \
+                                    send_count=args.send_count, suppress=args.suppress, crypto_key=args.crypto_key)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=f"{SYSTEM} Message Sender/Receiver")
@@ -164,21 +257,35 @@ if __name__ == "__main__":
     parser.add_argument('--protocol', default=PROTOCOL, help='Protocol (TCP or UDP)')
     parser.add_argument('--debug_level', default=LOG_LEVEL, help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
     parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML), reloaded on SIGHUP')
+    parser.add_argument('--log_file', default=None, help='Log file, rotated at --log_max_bytes with gzipped backups (default: console only)')
+    parser.add_argument('--log_max_bytes', default=64 << 20, type=int, help='Log file rotation size in bytes (0: never)')
+    parser.add_argument('--log_policy', default=None, help='Per-operation sampling/rate limit/truncation (YAML, e.g. logging.yaml; default: log everything)')
 
     args, _ = parser.parse_known_args()
     if args.mode == 0:
-        parser.add_argument('--src_ip_addr', default=DIVI_IP_ADDR, help='Src IP Address')
-        parser.add_argument('--src_port', default=DIVI_PORT, help='Src Port')
-    parser.add_argument('--dest_ip_addr', default=DIVI_IP_ADDR, help='Dest IP Address')
-    parser.add_argument('--dest_port', default=DIVI_PORT, help='Dest Port')    
+        parser.add_argument('--src_ip_addr', default=None, help='Src IP Address (default: D-IVI route)')
+        parser.add_argument('--src_port', default=None, help='Src Port (default: D-IVI route)')
+        parser.add_argument('--rcvbuf', default=None, type=int, help='SO_RCVBUF of the server socket in bytes (default: kernel)')
+        parser.add_argument('--sndbuf', default=None, type=int, help='SO_SNDBUF in bytes (default: kernel)')
+        parser.add_argument('--busy_poll', default=None, type=int, help='SO_BUSY_POLL in microseconds (default: off)')
+        parser.add_argument('--profile', default=[], type=lambda value: value.split(','),
+                            help='Profilers on at start: stages,cprofile,tracemalloc (default: off, toggled with SIGUSR1)')
+        parser.add_argument('--telemetry_interval', default=0, type=float,
+                            help='Send the configured message every N seconds, delta coded for telemetry IFT types (0: off)')
+    parser.add_argument('--dest_ip_addr', default=None, help='Dest IP Address (default: route of dest_id)')
+    parser.add_argument('--dest_port', default=None, help='Dest Port (default: route of dest_id)')
     parser.add_argument('--source_id', default=0x05, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Source ID')
     parser.add_argument('--dest_id', default=0x06, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Destination ID')
     parser.add_argument('--service_id', default=0x0002, choices=[service.value for service in ServiceID], help='Service ID')
-    parser.add_argument('--message_type', default=0x0000, help='Message Type')
-    parser.add_argument('--ift_id', default=0x0001, help='IFT ID')
-    parser.add_argument('--ift_type', default=0x0001, help='IFT Type')
+    parser.add_argument('--message_type', default=0x0000, type=lambda value: int(value, 0), help='Message Type')
+    parser.add_argument('--ift_id', default=0x0001, type=lambda value: int(value, 0), help='IFT ID')
+    parser.add_argument('--ift_type', default=0x0001, type=lambda value: int(value, 0), help='IFT Type')
     parser.add_argument('--send_data', default=b"1234567890", help='Payload Data')
+    parser.add_argument('--send_record', default=None, help='Payload as a JSON record, encoded with the schema of ift_id/ift_type')
     parser.add_argument('--send_count', type=int, default=0, help='perioc test sending')
+    parser.add_argument('--suppress', type=float, default=0, help='Suppress repeated DMS warnings, forwarding unchanged ones every N seconds (0: off)')
+    parser.add_argument('--crypto_key', default=None, help='Master key file (USB token) for encrypting Cloud-bound payloads (default: off)')
 
     # parser = argparse.ArgumentParser(description=f"{SYSTEM} TCP Message Sender/Receiver")
     # parser.add_argument('--protocol', default=PROTOCOL, help='Protocol (TCP or UDP)')
@@ -218,4 +325,5 @@ if __name__ == "__main__":
     
 # python3 D-IVI.py --dest_ip_addr='192.168.8.196' 
 # python3 D-IVI.py --dest_ip_addr='192.168.10.103' --test_sending=10
-# python3 D-IVI.py --test_sending=10
\ No newline at end of file
+# python3 D-IVI.py --test_sending=10
+# python3 D-IVI.py --ift_id 0x7 --ift_type 0x2 --telemetry_interval 0.1
\ No newline at end of file
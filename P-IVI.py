@@ -1,22 +1,21 @@
 import argparse
+import json
 import threading
 from logger import Logger 
 from udpControl import UDP_Control
+from socketTuning import Socket_Tuning
+from lifecycle import Lifecycle
+from profiling import Profile_Control
 from tcpControl import TCP_Control
+from routing import Routing_Table, ROUTES_FILE
+from payloadSchema import SCHEMA_REGISTRY
 from packet import *
 
 # Global variables
 SYSTEM = 'P-IVI'
 LOG_LEVEL = 'INFO'
 PROTOCOL = 'UDP'
-CCU_IP_ADDR = '127.0.0.1'
-CCU_PORT = 5001
-DIVI_IP_ADDR = '127.0.0.1'
-DIVI_PORT = 5002
-PIVI1_IP_ADDR = '127.0.0.1'
-PIVI1_PORT = 5003
-PIVI2_IP_ADDR = '127.0.0.1'
-PIVI2_PORT = 5004
+SEATS = {1: SourceDestID.P_IVI_1.value, 2: SourceDestID.P_IVI_2.value}
 
 class P_IVI_Control:
     def __init__(self, logger, mode, protocol, **kwargs):
@@ -26,26 +25,56 @@ class P_IVI_Control:
 
         operation = "Init"
 
+        # Every destination is resolved through the routing table
+        self.routing = kwargs.get('routing')
+        # Cloud-bound payloads are encrypted with the key on the USB token
+        self.crypto = None
+        if kwargs.get('crypto_key'):
+            from payloadCrypto import Packet_Crypto, load_key     # cryptography only needed with a key
+            self.crypto = Packet_Crypto(load_key(kwargs.get('crypto_key')), logger=self.logger)
+        # Nearest car wash / repair shop POIs for the vehicle position (IFT_12_05)
+        self.location = None
+        if kwargs.get('poi'):
+            from poiIndex import Location_Service     # NumPy only needed with a POI dataset
+            self.location = Location_Service.load(kwargs.get('poi'), max_km=kwargs.get('poi_radius_km'), logger=self.logger)
+
+        self.source_id = kwargs.get('source_id')
         if self.mode == 0:
-            self.src_ip_addr = kwargs.get('src_ip_addr')
-            self.src_port = kwargs.get('src_port')
+            # The seat is this display's SourceDestID: it binds the seat's route and answers (and acks group messages) as the seat
+            self.source_id = self.seat_id(kwargs.get('seat'), kwargs.get('src_ip_addr'), kwargs.get('src_port'))
+            src_ip_addr, src_port = self.routing.resolve(self.source_id)
+            self.src_ip_addr = kwargs.get('src_ip_addr') or src_ip_addr
+            self.src_port = int(kwargs.get('src_port') or src_port)
+            self.logger.message("INFO", operation, f"Seat: {SourceDestID(self.source_id)}")
             self.logger.message("INFO", operation, f"Source IP Address: {self.src_ip_addr}")
             self.logger.message("INFO", operation, f"Source Port: {self.src_port}")
 
             if self.protocol == 'TCP':
                 self.tcpControl = TCP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
+                self.tcpControl.lifecycle = kwargs.get('lifecycle')
                 tcp_server_thread = threading.Thread(target=self.tcpControl.tcp_server, args=(self.process_message,))
                 tcp_server_thread.start()
 
             if self.protocol == 'UDP':
                 self.udpControl = UDP_Control(SYSTEM, self.src_ip_addr, self.src_port, self.logger)
+                self.udpControl.socket_tuning = kwargs.get('socket_tuning')
+                self.udpControl.lifecycle = kwargs.get('lifecycle')
+                self.udpControl.crypto = self.crypto
                 udp_server_thread = threading.Thread(target=self.udpControl.udp_server, args=(self.process_message,))
                 udp_server_thread.start()
 
-        self.dest_ip_addr = kwargs.get('dest_ip_addr')
-        self.dest_port = kwargs.get('dest_port')
-        self.source_id = kwargs.get('source_id')
+                # Join the P-IVI fan-out group
+                if kwargs.get('multicast_group'):
+                    group_ip_addr, group_port = self.routing.group(SourceDestID.P_IVI_ALL.value)
+                    group_thread = threading.Thread(target=self.udpControl.udp_multicast_server,
+                                                    args=(group_ip_addr, group_port, self.process_message))
+                    group_thread.start()
+
         self.dest_id = kwargs.get('dest_id')
+        # --dest_ip_addr/--dest_port override the route of dest_id
+        dest_ip_addr, dest_port = self.routing.resolve(self.dest_id)
+        self.dest_ip_addr = kwargs.get('dest_ip_addr') or dest_ip_addr
+        self.dest_port = int(kwargs.get('dest_port') or dest_port)
         self.service_id = kwargs.get('service_id')
         self.message_type = kwargs.get('message_type')
         self.ift_id = kwargs.get('ift_id')
@@ -63,7 +92,11 @@ class P_IVI_Control:
         self.logger.message("INFO", operation, f"Data length: {len(self.send_data)}")
         self.logger.message("INFO", operation, f"Send Data: {self.send_data}")
     
-        if self.mode == 1:
+        # Sends go out from this socket (fleetSim: one per vehicle); default a new socket per send
+        self.sock = kwargs.get('sock')
+
+        # start=False: the caller sends with send_message (fleetSim)
+        if self.mode == 1 and kwargs.get('start', True):
             # create packet and send
             packet = ProtocolPacket(self.source_id, self.dest_id, self.service_id, \
                                         self.message_type, self.ift_id, self.ift_type, len(self.send_data), self.send_data)
@@ -75,6 +108,41 @@ class P_IVI_Control:
             elif self.protocol == 'UDP':
                 UDP_Control.udp_client(self, self.dest_ip_addr, self.dest_port, self.packet_data)
 
+    # Send packet with data to the configured destination; False if not sent
+    def send_message(self, packet, data):
+        packet.add_payload_data(data)
+        return UDP_Control.udp_client(self, self.dest_ip_addr, self.dest_port, packet.pack(), sock=self.sock)
+
+    # Send the nearest POIs of a position to the sender of the position
+    def send_nearby(self, dest_id, service_id, timestamp_ms, nearby):
+        def text(value, size):
+            # fixed size field: cut on a character boundary
+            return str(value).encode('utf-8')[:size].decode('utf-8', 'ignore')
+        pois = [{'category': text(category, 16), 'poi_id': text(poi_id, 16), 'name': text(name, 32), 'distance_m': distance_m}
+                for category, results in nearby.items() for poi_id, name, distance_m in results]
+        payload = SCHEMA_REGISTRY.encode(IFTID.IFT_12_05.value, IFT_12_05_Type.TYPE_0002.value, {'timestamp_ms': timestamp_ms, 'pois': pois})
+        packet = ProtocolPacket(self.source_id, dest_id, service_id, P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_RESPONSE.value,
+                                IFTID.IFT_12_05.value, IFT_12_05_Type.TYPE_0002.value, len(payload), payload)
+        self.packet_data = packet.pack()
+        endpoint = self.routing.resolve(dest_id)
+        if endpoint is None:
+            self.logger.message("WARNING", "SEND", f"No route to {dest_id}")
+            return
+        self.udpControl.udp_client(*endpoint, self.packet_data)
+        self.logger.message("INFO", "SEND", f"Nearby : b{self.packet_data}")
+
+    def seat_id(self, seat, src_ip_addr, src_port):
+        """--seat, else the P-IVI route matching --src_ip_addr/--src_port, else P-IVI-1."""
+        if seat:
+            return SEATS[seat]
+        if not src_ip_addr and not src_port:
+            return SourceDestID.P_IVI_1.value
+        for seat_id in SEATS.values():
+            endpoint = self.routing.resolve(seat_id)
+            if endpoint is not None and src_ip_addr in (None, endpoint[0]) and int(src_port or endpoint[1]) == endpoint[1]:
+                return seat_id
+        raise ValueError(f"No P-IVI route for {src_ip_addr}:{src_port}, set --seat")
+
     def process_message(self, received_data):
         # Unpacking the packet
         unpacked_packet = ProtocolPacket.unpack(received_data)
@@ -108,6 +176,33 @@ class P_IVI_Control:
         self.logger.message("INFO", operation, f"service_data_length : {data_length}")
         self.logger.message("INFO", operation, f"service_payload_data : {payload_data}")
 
+        # Typed record for IFT types with a payload schema
+        record = SCHEMA_REGISTRY.decode(ift_id, ift_type, payload_data)
+        if record is not None:
+            self.logger.message("INFO", operation, f"service_record : {record}")
+
+        # Vehicle position: nearest POIs per category, answered to the sender as TYPE_0002
+        if self.location is not None and record is not None and \
+           ift_id == IFTID.IFT_12_05.value and ift_type == IFT_12_05_Type.TYPE_0001.value:
+            nearby = self.location.nearest(record['latitude'], record['longitude'])
+            self.logger.message("INFO", operation, f"nearby : {nearby}")
+            self.send_nearby(source_id, service_id, record['timestamp_ms'], nearby)
+            if dest_id != SourceDestID.P_IVI_ALL.value:
+                return
+
+        # Group message: acknowledge the display to the CCU so it can report the fan-out skew
+        if dest_id == SourceDestID.P_IVI_ALL.value:
+            message_type = P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_RESPONSE.value
+            packet = ProtocolPacket(self.source_id, SourceDestID.CCU.value, service_id, message_type, ift_id, ift_type)
+            self.packet_data = packet.pack()
+            endpoint = self.routing.resolve(source_id)
+            if endpoint is None:
+                self.logger.message("WARNING", "SEND", f"No route to {source_id}")
+                return
+            self.udpControl.udp_client(*endpoint, self.packet_data)
+            self.logger.message("INFO", "SEND", f"Group ack : b{self.packet_data}")
+            return
+
         # 1 receive message from D-IVI
         # 2 Process the message
         # 3 Send message to D-IVI
@@ -123,30 +218,7 @@ class P_IVI_Control:
                 if message_type == P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_REQUEST.value:
                     print("Received P-IVI Control Request")
                     # check ift id and ift type
-                    ift_type_map = {
-                        IFTID.IFT_12_01.value: {
-                            IFT_12_01_Type.TYPE_0001.value: IFT_12_01_Type.TYPE_0002.value,
-                            IFT_12_01_Type.TYPE_0003.value: IFT_12_01_Type.TYPE_0004.value,
-                            IFT_12_01_Type.TYPE_0005.value: IFT_12_01_Type.TYPE_0006.value,
-                        },
-                        IFTID.IFT_12_02.value: {
-                            IFT_12_02_Type.TYPE_0001.value: IFT_12_02_Type.TYPE_0002.value,
-                            IFT_12_02_Type.TYPE_0003.value: IFT_12_02_Type.TYPE_0004.value,
-                        },
-                        IFTID.IFT_12_03.value: {
-                            IFT_12_03_Type.TYPE_0001.value: IFT_12_03_Type.TYPE_0002.value,
-                            IFT_12_03_Type.TYPE_0003.value: IFT_12_03_Type.TYPE_0004.value,
-                            IFT_12_03_Type.TYPE_0005.value: IFT_12_03_Type.TYPE_0006.value,
-                        },
-                        IFTID.IFT_12_04.value: {
-                            IFT_12_04_Type.TYPE_0001.value: IFT_12_04_Type.TYPE_0002.value,
-                            IFT_12_04_Type.TYPE_0003.value: IFT_12_04_Type.TYPE_0004.value,
-                            IFT_12_04_Type.TYPE_0005.value: IFT_12_04_Type.TYPE_0006.value,
-                        },
-                        IFTID.IFT_12_05.value: {
-                            IFT_12_05_Type.TYPE_0001.value: IFT_12_05_Type.TYPE_0002.value,
-                        }
-                    }
+                    ift_type_map = P_IVI_RESPONSE_TYPE_MAP
                     message_type = P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_RESPONSE.value
                                 
                     if ift_id in ift_type_map:
@@ -158,7 +230,11 @@ class P_IVI_Control:
                             self.logger.message("INFO", "SEND", f"Send P-IVI Control Response")
                             packet = ProtocolPacket(self.source_id, source_id, service_id, message_type, ift_id, ift_type, data_length, payload_data)
                             self.packet_data = packet.pack()
-                            self.udpControl.udp_client(DIVI_IP_ADDR, DIVI_PORT, self.packet_data)
+                            endpoint = self.routing.resolve(source_id)
+                            if endpoint is None:
+                                self.logger.message("WARNING", "SEND", f"No route to {source_id}")
+                                return
+                            self.udpControl.udp_client(*endpoint, self.packet_data)
                             self.logger.message("INFO", "SEND", f"Packet : b{self.packet_data}")
 
                         else:
@@ -169,20 +245,41 @@ class P_IVI_Control:
 def main(args):
 
     # Set logger
-    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop, log_file=args.log_file, max_bytes=args.log_max_bytes)
+    if args.log_policy:
+        logger.load_policies(args.log_policy)
     logger.message("INFO", "Start", f"{SYSTEM} Control Service")
 
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    routing.install_sighup()
+
+    # Typed payload: encode the JSON record with the schema of the IFT type
+    if getattr(args, 'send_record', None):
+        args.send_data = SCHEMA_REGISTRY.encode(args.ift_id, args.ift_type, json.loads(args.send_record))
+
     if args.mode == 0:
+        # SIGUSR2: restart into a successor that takes over the server socket; SIGTERM: drain and exit
+        lifecycle = Lifecycle(SYSTEM, logger)
+        lifecycle.install()
+        # SIGUSR1 or profiling.py --pid: stage spans, cProfile and tracemalloc switched on in the running role
+        profiling = Profile_Control(SYSTEM, logger)
+        profiling.install(args.profile)
+        lifecycle.on_exit(profiling.close)
         pIviControl = P_IVI_Control(logger, args.mode, args.protocol, src_ip_addr=args.src_ip_addr, src_port=args.src_port, \
                     dest_ip_addr=args.dest_ip_addr, dest_port=args.dest_port, source_id=args.source_id, dest_id=args.dest_id, \
                         service_id=args.service_id, message_type=args.message_type, ift_id=args.ift_id, ift_type=args.ift_type, \
-                            send_data=args.send_data)
+                            send_data=args.send_data, routing=routing, multicast_group=args.multicast_group, crypto_key=args.crypto_key, \
+                                poi=args.poi, poi_radius_km=args.poi_radius_km, seat=args.seat, socket_tuning=Socket_Tuning(args.rcvbuf, args.sndbuf, args.busy_poll, logger=logger), lifecycle=lifecycle)
+        # Sockets are bound (or adopted from the previous process): let it drain and exit
+        lifecycle.ready()
     elif args.mode == 1:
         pIviControl = P_IVI_Control(logger, args.mode, args.protocol, \
                     dest_ip_addr=args.dest_ip_addr, dest_port=args.dest_port, \
                         source_id=args.source_id, dest_id=args.dest_id, \
                             service_id=args.service_id, message_type=args.message_type,\
-                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data)
+                                ift_id=args.ift_id, ift_type=args.ift_type, send_data=args.send_data, routing=routing, \
+                                    crypto_key=args.crypto_key)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=f"{SYSTEM} Message Sender/Receiver")
@@ -190,21 +287,36 @@ if __name__ == "__main__":
     parser.add_argument('--protocol', default=PROTOCOL, help='Protocol (TCP or UDP)')
     parser.add_argument('--debug_level', default=LOG_LEVEL, help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
     parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML), reloaded on SIGHUP')
+    parser.add_argument('--log_file', default=None, help='Log file, rotated at --log_max_bytes with gzipped backups (default: console only)')
+    parser.add_argument('--log_max_bytes', default=64 << 20, type=int, help='Log file rotation size in bytes (0: never)')
+    parser.add_argument('--log_policy', default=None, help='Per-operation sampling/rate limit/truncation (YAML, e.g. logging.yaml; default: log everything)')
 
     args, _ = parser.parse_known_args()
     if args.mode == 0:
-        parser.add_argument('--src_ip_addr', default=PIVI1_IP_ADDR, help='Src IP Address')
-        parser.add_argument('--src_port', default=PIVI1_PORT, help='Src Port')
-    parser.add_argument('--dest_ip_addr', default=PIVI1_IP_ADDR, help='Dest IP Address')
-    parser.add_argument('--dest_port', default=PIVI1_PORT, help='Dest Port')    
+        parser.add_argument('--seat', default=None, type=int, choices=list(SEATS), help='Seat display 1 or 2 (default: from --src_ip_addr/--src_port, else 1)')
+        parser.add_argument('--src_ip_addr', default=None, help='Src IP Address (default: route of the seat)')
+        parser.add_argument('--src_port', default=None, help='Src Port (default: route of the seat)')
+        parser.add_argument('--multicast_group', action='store_true', help='Join the P-IVI-ALL multicast group from the routing table')
+        parser.add_argument('--rcvbuf', default=None, type=int, help='SO_RCVBUF of the server socket in bytes (default: kernel)')
+        parser.add_argument('--sndbuf', default=None, type=int, help='SO_SNDBUF in bytes (default: kernel)')
+        parser.add_argument('--busy_poll', default=None, type=int, help='SO_BUSY_POLL in microseconds (default: off)')
+        parser.add_argument('--poi', default=None, help='POI dataset (CSV: id,category,latitude,longitude,name) for location based services (default: off)')
+        parser.add_argument('--poi_radius_km', default=None, type=float, help='Search radius for nearby POIs in km (default: unlimited)')
+        parser.add_argument('--profile', default=[], type=lambda value: value.split(','),
+                            help='Profilers on at start: stages,cprofile,tracemalloc (default: off, toggled with SIGUSR1)')
+    parser.add_argument('--dest_ip_addr', default=None, help='Dest IP Address (default: route of dest_id)')
+    parser.add_argument('--dest_port', default=None, help='Dest Port (default: route of dest_id)')
     parser.add_argument('--source_id', default=0x06, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Source ID')
     parser.add_argument('--dest_id', default=0x05, choices=['0x00: CCU', '0x05: D-IVI', '0x06: P-IVI1', '0x07: P-IVI2'], help='Destination ID')
     parser.add_argument('--service_id', default=0x0001, choices=[service.value for service in ServiceID], help='Service ID')
-    parser.add_argument('--message_type', default=0x0000, help='Message Type')
-    parser.add_argument('--ift_id', default=0x0001, help='IFT ID')
-    parser.add_argument('--ift_type', default=0x0001, help='IFT Type')
+    parser.add_argument('--message_type', default=0x0000, type=lambda value: int(value, 0), help='Message Type')
+    parser.add_argument('--ift_id', default=0x0001, type=lambda value: int(value, 0), help='IFT ID')
+    parser.add_argument('--ift_type', default=0x0001, type=lambda value: int(value, 0), help='IFT Type')
     parser.add_argument('--send_data', default=b"0987654321", help='Payload Data')
+    parser.add_argument('--send_record', default=None, help='Payload as a JSON record, encoded with the schema of ift_id/ift_type')
     parser.add_argument('--send_count', type=int, default=0, help='perioc test sending')
+    parser.add_argument('--crypto_key', default=None, help='Master key file (USB token) for encrypting Cloud-bound payloads (default: off)')
 
 
     args = parser.parse_args()
@@ -212,4 +324,5 @@ if __name__ == "__main__":
 
 # python3 P-IVI.py --dest_ip_addr='192.168.8.196'
 # python3 P-IVI.py --dest_ip_addr='192.168.10.103' --test_sending=10
-# python3 P-IVI.py --test_sending=10
\ No newline at end of file
+# python3 P-IVI.py --test_sending=10
+# python3 P-IVI.py --seat 2
\ No newline at end of file
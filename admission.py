@@ -0,0 +1,264 @@
+# admission.py
+# The admission.py file contains the Admission_Control class, the stage UDP_Control/TCP_Control run right after
+# recvfrom: token buckets per sender address and source, per SourceDestID and per ServiceID (configured per class in
+# admission.yaml) drop or defer packets over budget before any decode or logging work, so a misbehaving P-IVI seat
+# or a replay storm cannot starve D-IVI traffic in the CCU's single receive loop.
+# One instance serves one receive loop; it is not shared between threads.
+# The class contains the following attributes:
+# - addresses: (sender IP, source ID) -> Token_Bucket (bounded; idle buckets are dropped first). Keyed by source
+#   too, because roles on one host (every role on 127.0.0.1 by default) share an IP and one would starve the others.
+#   Source bytes that are no SourceDestID share one bucket per IP, so cycling through them buys no extra budget
+# - sources: Token_Bucket per SourceDestID, indexed by the first header byte
+# - services: ServiceID -> Token_Bucket
+# - deferred: Bounded FIFO of over-budget packets of defer classes, delivered by release()
+# - stats: Admitted/dropped/deferred counters, rejections per bucket kind
+
+import argparse
+import multiprocessing
+import os
+import socket
+import struct
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import yaml
+from packet import *
+
+ADMISSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'admission.yaml')
+MAX_ADDRESSES = 4096        # sender address buckets
+MAX_DEFERRED = 1024         # packets held over budget
+MAX_DEFER_AGE = 0.5         # seconds a deferred packet may wait before it is dropped
+STATS_INTERVAL = 10.0       # seconds between stats log lines while rejecting
+
+SOURCE_LABEL_MAP = {member.label: member.value for member in SourceDestID}
+SOURCE_IDS = frozenset(SOURCE_LABEL_MAP.values())
+SERVICE_LABEL_MAP = {member.label: member.value for member in ServiceID}
+
+
+class Token_Bucket:
+    __slots__ = ('rate', 'burst', 'defer', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, defer=False, now=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.defer = defer
+        self.tokens = self.burst
+        self.stamp = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        """Top up for the time since the last call; True if a token is available."""
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.stamp = now
+        return self.tokens >= 1.0
+
+
+def bucket_class(entry):
+    # {rate, burst, action} -> (rate, burst, defer)
+    if not entry:
+        return None
+    return float(entry['rate']), float(entry.get('burst', entry['rate'])), entry.get('action', 'drop') == 'defer'
+
+
+class Admission_Control:
+    def __init__(self, config=None, logger=None, max_addresses=MAX_ADDRESSES, max_deferred=MAX_DEFERRED):
+        config = config or {}
+        self.logger = logger
+        self.max_addresses = max_addresses
+        self.max_deferred = max_deferred
+
+        self.address_class = bucket_class(config.get('address'))
+        self.addresses = {}
+        self.overflow = Token_Bucket(*self.address_class) if self.address_class else None
+        self.sources = [None] * 256
+        for label, entry in (config.get('sources') or {}).items():
+            self.sources[SOURCE_LABEL_MAP.get(label, label)] = Token_Bucket(*bucket_class(entry))
+        self.services = {}
+        for label, entry in (config.get('services') or {}).items():
+            self.services[SERVICE_LABEL_MAP.get(label, label)] = Token_Bucket(*bucket_class(entry))
+
+        self.deferred = deque()     # (data, address, deferred time), oldest first
+        self.stats = {'admitted': 0, 'dropped': 0, 'deferred': 0, 'released': 0, 'expired': 0,
+                      'address': 0, 'source': 0, 'service': 0}
+        self.reported = time.monotonic()
+
+    @staticmethod
+    def load(path=ADMISSION_FILE, logger=None):
+        with open(path, 'r') as file:
+            config = yaml.safe_load(file) or {}
+        admission = Admission_Control(config, logger)
+        if logger is not None:
+            logger.message("INFO", "admission", f"Loaded {sum(bucket is not None for bucket in admission.sources)} source, "
+                                                f"{len(admission.services)} service classes from {path}")
+        return admission
+
+    def address_bucket(self, address, now):
+        bucket = self.addresses.get(address)
+        if bucket is None:
+            if len(self.addresses) >= self.max_addresses:
+                # drop buckets that have refilled completely: their senders are idle
+                for idle in [key for key, item in self.addresses.items() if item.refill(now) and item.tokens >= item.burst]:
+                    del self.addresses[idle]
+                if len(self.addresses) >= self.max_addresses:
+                    return self.overflow
+            bucket = self.addresses[address] = Token_Bucket(*self.address_class, now=now)
+        return bucket
+
+    # Set Admission ===============================================================================================================================
+    def admit(self, data, address, defer=True):
+        """True if the packet is within budget; otherwise it is dropped or deferred (see release) and False returned."""
+        now = time.monotonic()
+        rejected = self.take(data, address, now)
+        if rejected is None:
+            self.stats['admitted'] += 1
+            return True
+
+        self.stats[rejected[0]] += 1
+        if defer and rejected[1].defer and len(self.deferred) < self.max_deferred:
+            self.deferred.append((data, address, now))
+            self.stats['deferred'] += 1
+        else:
+            self.stats['dropped'] += 1
+        if now - self.reported >= STATS_INTERVAL:
+            self.report(now)
+        return False
+
+    def take(self, data, address, now):
+        # every bucket of the packet needs a token before any is consumed; returns (kind, bucket) of the first empty one
+        source_id = data[0] if data and data[0] in SOURCE_IDS else None
+        address_bucket = self.address_bucket((address, source_id), now) if self.address_class else None
+        source_bucket = self.sources[data[0]] if data else None
+        service_bucket = self.services.get(data[2] << 8 | data[3]) if len(data) >= 4 and self.services else None
+        if address_bucket is not None and not address_bucket.refill(now):
+            return 'address', address_bucket
+        if source_bucket is not None and not source_bucket.refill(now):
+            return 'source', source_bucket
+        if service_bucket is not None and not service_bucket.refill(now):
+            return 'service', service_bucket
+        for bucket in (address_bucket, source_bucket, service_bucket):
+            if bucket is not None:
+                bucket.tokens -= 1.0
+        return None
+
+    def release(self):
+        """Deferred (data, address) pairs whose buckets have refilled, in arrival order."""
+        if not self.deferred:
+            return []
+        now = time.monotonic()
+        released = []
+        waiting = deque()
+        for data, address, deferred_time in self.deferred:
+            if self.take(data, address, now) is None:
+                released.append((data, address))
+            elif now - deferred_time > MAX_DEFER_AGE:
+                self.stats['expired'] += 1
+            else:
+                waiting.append((data, address, deferred_time))
+        self.deferred = waiting
+        self.stats['released'] += len(released)
+        return released
+
+    def report(self, now=None):
+        self.reported = time.monotonic() if now is None else now
+        if self.logger is not None:
+            self.logger.message("INFO", "admission", ", ".join(f"{name}: {count}" for name, count in self.stats.items()))
+
+
+# Benchmark: admission cost, and D-IVI delivery while a P-IVI floods the receive loop ================================================================
+BENCH_HEADER = struct.Struct('!BBHHHHH')
+
+
+def bench_packet(source_id, service_id, payload=b'0123456789' * 4):
+    return BENCH_HEADER.pack(source_id, SourceDestID.CCU.value, service_id, 0, 1, 1, len(payload)) + payload
+
+
+def flood(port, source_id, service_id, rate, duration, bind_ip):
+    # rate 0: as fast as the socket allows
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((bind_ip, 0))
+    packet = bench_packet(source_id, service_id)
+    sent = 0
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        try:
+            sock.sendto(packet, ('127.0.0.1', port))
+            sent += 1
+        except OSError:
+            pass
+        if rate:
+            next_time = start + sent / rate
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return sent
+
+
+def receive_loop(port, admission, duration):
+    # stands in for udp_server: decode and format a log line for every delivered packet
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind(('127.0.0.1', port))
+    sock.settimeout(0.01)
+    delivered = {}
+    end = time.monotonic() + duration + 0.5
+
+    def deliver(data, address):
+        packet = ProtocolPacket.unpack(data)
+        line = f"[{address}] {data} SRC:{SourceDestID(packet.source_id)}:SID:{ServiceID(packet.service_id)}:{packet.payload_data}"
+        delivered[packet.source_id] = delivered.get(packet.source_id, 0) + (len(line) > 0)
+
+    while time.monotonic() < end:
+        try:
+            data, addr = sock.recvfrom(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
+        except socket.timeout:
+            data = None
+        if data is not None and (admission is None or admission.admit(data, addr[0])):
+            deliver(data, addr[0])
+        if admission is not None:
+            for data, address in admission.release():
+                deliver(data, address)
+    sock.close()
+    return delivered
+
+
+def benchmark(config_file, count, duration):
+    with open(config_file, 'r') as file:
+        config = yaml.safe_load(file) or {}
+
+    # 1. cost per decision at a saturating offered rate (no pauses between packets)
+    packets = [bench_packet(SourceDestID.P_IVI_1.value, ServiceID.OTT_CONTROL.value),
+               bench_packet(SourceDestID.D_IVI.value, ServiceID.D_IVI_CONTROL.value),
+               bench_packet(SourceDestID.P_IVI_2.value, ServiceID.P_IVI_CONTROL.value)]
+    admission = Admission_Control(config, max_deferred=0)
+    start = time.perf_counter_ns()
+    for index in range(count):
+        admission.admit(packets[index % 3], '10.0.0.%d' % (index % 3))
+    elapsed_ns = time.perf_counter_ns() - start
+    print(f"admit(): {count} packets, {elapsed_ns / count:.0f} ns/decision, {count * 1e9 / elapsed_ns:,.0f} decisions/s, "
+          f"admitted {admission.stats['admitted']}, dropped {admission.stats['dropped']}")
+
+    # 2. loopback: P-IVI-1 floods while D-IVI sends 1000 packets/s, both from 127.0.0.1 as in routes.yaml
+    for label, use_admission in (('no admission', False), ('admission', True)):
+        port = 47100 + use_admission
+        with multiprocessing.Pool(2) as pool, ThreadPool(1) as threads:
+            receiver = threads.apply_async(
+                receive_loop, (port, Admission_Control(config) if use_admission else None, duration))
+            time.sleep(0.1)
+            flooder = pool.apply_async(flood, (port, SourceDestID.P_IVI_1.value, ServiceID.OTT_CONTROL.value, 0, duration, '127.0.0.1'))
+            divi = pool.apply_async(flood, (port, SourceDestID.D_IVI.value, ServiceID.D_IVI_CONTROL.value, 1000, duration, '127.0.0.1'))
+            flood_sent, divi_sent, delivered = flooder.get(), divi.get(), receiver.get()
+        divi_delivered = delivered.get(SourceDestID.D_IVI.value, 0)
+        print(f"{label:<13} P-IVI-1 flood {flood_sent / duration:9,.0f}/s sent, {delivered.get(SourceDestID.P_IVI_1.value, 0) / duration:7,.0f}/s "
+              f"delivered; D-IVI {divi_delivered}/{divi_sent} delivered ({divi_delivered * 100 / max(divi_sent, 1):.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Admission control benchmark')
+    parser.add_argument('--config', default=ADMISSION_FILE, help='Admission classes (YAML)')
+    parser.add_argument('--count', default=1000000, type=int, help='Packets for the per-decision cost')
+    parser.add_argument('--duration', default=3.0, type=float, help='Seconds of loopback flood')
+
+    args = parser.parse_args()
+    benchmark(args.config, args.count, args.duration)
+
+# python3 admission.py --duration 5
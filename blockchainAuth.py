@@ -0,0 +1,375 @@
+# blockchainAuth.py
+# The blockchainAuth.py file contains the verification stage of Blockchain Authentication: every DID/VP step
+# (ServiceID.BLOCKCHAIN_AUTHENTICATION requests and the VP transfers of IFT_13_01, IFT_13_02 and IFT_23_01) carries
+# a verifiable presentation signed with the holder's Ed25519 key.
+# A presentation payload is PRESENTATION_MAGIC, DID length, public key, signature, DID, VP document; the signature
+# covers DID + document. The signing key must be the key the DID resolves to: a did:key DID encodes it, other DIDs
+# are looked up with a resolver (did -> registered key, e.g. from a registry file); a presentation carrying any other
+# key is rejected, however well it is signed. Resolving the DID document on the ledger is not part of this module.
+# Cache hits are checked against the resolver as well, so a rotated key stops a cached presentation at once.
+# The classes contain the following attributes:
+# - Verification_Cache: DID-keyed LRU + TTL cache of verified presentations
+# - Batch_Verifier: collects requests arriving within one window and verifies them together on a worker pool
+# - Auth_Sink: Cloud ingest sink verifying presentations (Cloud.py --sink blockchainAuth:Auth_Sink[:registry file])
+
+import argparse
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import nacl.signing
+from nacl.exceptions import BadSignatureError
+from packet import *
+
+PRESENTATION_MAGIC = b'DVP1'
+PRESENTATION_HEADER = struct.Struct('!4sH32s64s')     # magic, DID length, Ed25519 public key, signature
+CACHE_ENTRIES = 65536       # DIDs kept in the cache
+CACHE_TTL = 300.0           # seconds a verified presentation is trusted without a new check
+REGISTRY_POLL = 1.0         # seconds between checks of the registry file for rotated keys
+BATCH_WINDOW = 0.002        # seconds requests are collected before a batch is verified
+MAX_BATCH = 1024            # requests per batch
+
+# IFT IDs whose VP steps carry a presentation (IFT_13_02 shares its value with IFT_13_03, hence the magic check)
+PRESENTATION_IFTS = frozenset((IFTID.IFT_13_01.value, IFTID.IFT_13_02.value, IFTID.IFT_23_01.value))
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+ED25519_MULTICODEC = b'\xed\x01'     # did:key prefix of an Ed25519 public key
+
+
+# Set DID keys ====================================================================================================================================
+def did_key(public_key):
+    """did:key DID of an Ed25519 public key (multibase base58btc of the multicodec key)."""
+    number = int.from_bytes(ED25519_MULTICODEC + bytes(public_key), 'big')
+    encoded = ''
+    while number:
+        number, digit = divmod(number, 58)
+        encoded = BASE58_ALPHABET[digit] + encoded
+    return 'did:key:z' + encoded
+
+
+def resolve_did_key(did):
+    """Ed25519 public key a did:key DID encodes, or None."""
+    if not did.startswith('did:key:z'):
+        return None
+    number = 0
+    for char in did[len('did:key:z'):]:
+        digit = BASE58_ALPHABET.find(char)
+        if digit < 0:
+            return None
+        number = number * 58 + digit
+    key = number.to_bytes(34, 'big') if number < 1 << 272 else b''
+    return key[2:] if key[:2] == ED25519_MULTICODEC else None
+
+
+def load_registry(path):
+    registered = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2 and not line.startswith('#'):
+                registered[fields[0]] = bytes.fromhex(fields[1])
+    return registered
+
+
+def registry_resolver(path, poll=REGISTRY_POLL):
+    """Resolver for DIDs registered in a file ('<did> <public key hex>' per line), did:key DIDs as they encode.
+    The file is reloaded when it changes, so rotated keys apply within poll seconds."""
+    lock = threading.Lock()
+    state = {'registered': load_registry(path), 'mtime': os.stat(path).st_mtime_ns, 'checked': time.monotonic()}
+
+    def resolve(did):
+        now = time.monotonic()
+        if now - state['checked'] >= poll:
+            with lock:
+                if now - state['checked'] >= poll:
+                    state['checked'] = now
+                    mtime = os.stat(path).st_mtime_ns
+                    if mtime != state['mtime']:
+                        state['registered'], state['mtime'] = load_registry(path), mtime
+        return state['registered'].get(did) or resolve_did_key(did)
+    return resolve
+
+
+class Presentation:
+    __slots__ = ('did', 'public_key', 'signature', 'document', 'digest')
+
+    def __init__(self, did, public_key, signature, document):
+        self.did = did
+        self.public_key = public_key
+        self.signature = signature
+        self.document = document
+        # identifies this exact presentation: a DID presenting a new VP or key misses the cache
+        self.digest = hashlib.blake2b(public_key + signature + document, digest_size=16).digest()
+
+    def pack(self):
+        did = self.did.encode('utf-8')
+        return PRESENTATION_HEADER.pack(PRESENTATION_MAGIC, len(did), self.public_key, self.signature) + did + self.document
+
+    @staticmethod
+    def unpack(payload):
+        magic, did_length, public_key, signature = PRESENTATION_HEADER.unpack_from(payload, 0)
+        if magic != PRESENTATION_MAGIC:
+            raise ValueError("not a presentation")
+        start = PRESENTATION_HEADER.size
+        if len(payload) < start + did_length:
+            raise ValueError("truncated presentation")
+        did = bytes(payload[start:start + did_length]).decode('utf-8')
+        return Presentation(did, public_key, signature, bytes(payload[start + did_length:]))
+
+    @staticmethod
+    def sign(signing_key, did, document):
+        """Holder side (USB key): sign DID + VP document."""
+        signature = signing_key.sign(did.encode('utf-8') + document).signature
+        return Presentation(did, bytes(signing_key.verify_key), signature, document)
+
+
+def is_presentation(packet):
+    if packet.service_id == ServiceID.BLOCKCHAIN_AUTHENTICATION.value:
+        return packet.message_type == BLOCKCHAIN_MESSAGE_TYPES.BLOCKCHAIN_AUTHENTICATION_REQUEST.value
+    return packet.ift_id in PRESENTATION_IFTS and (packet.payload_data or b'')[:4] == PRESENTATION_MAGIC
+
+
+def verify_presentation(presentation, resolver=resolve_did_key):
+    # the embedded key only counts if it is the DID's own: anyone can sign with a key of their own
+    if resolver(presentation.did) != presentation.public_key:
+        return False
+    try:
+        nacl.signing.VerifyKey(presentation.public_key).verify(presentation.did.encode('utf-8') + presentation.document,
+                                                                presentation.signature)
+        return True
+    except (BadSignatureError, ValueError, TypeError):
+        return False
+
+
+def verify_chunk(presentations, resolver=resolve_did_key):
+    # one pool task per slice of a batch; libsodium runs with the GIL released
+    return [verify_presentation(presentation, resolver) for presentation in presentations]
+
+
+class Verification_Cache:
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # DID -> (presentation digest, expires), least recently used first
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'revoked': 0}
+
+    def get(self, presentation):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(presentation.did)
+            if entry is None or entry[0] != presentation.digest:
+                self.stats['misses'] += 1
+                return False
+            if entry[1] <= now:
+                del self.entries[presentation.did]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return False
+            self.entries.move_to_end(presentation.did)
+            self.stats['hits'] += 1
+            return True
+
+    def put(self, presentation):
+        with self.lock:
+            self.entries[presentation.did] = (presentation.digest, time.monotonic() + self.ttl)
+            self.entries.move_to_end(presentation.did)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def revoke(self, did):
+        with self.lock:
+            if self.entries.pop(did, None) is not None:
+                self.stats['revoked'] += 1
+
+
+class Batch_Verifier:
+    def __init__(self, logger=None, window=BATCH_WINDOW, max_batch=MAX_BATCH, workers=None, cache=None, resolver=resolve_did_key):
+        self.logger = logger
+        self.resolver = resolver
+        self.window = window
+        self.max_batch = max_batch
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache if cache is not None else Verification_Cache()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.condition = threading.Condition()
+        self.lock = threading.Lock()        # stats are updated from the collector and the pool threads
+        self.pending = []       # [(presentation, future), ...] of the open window
+        self.closed = False
+        self.stats = {'verified': 0, 'rejected': 0, 'batches': 0, 'coalesced': 0}
+
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, presentation):
+        """Future resolving to True for a valid presentation; cache hits resolve immediately."""
+        future = Future()
+        if self.cache.get(presentation):
+            if self.resolver(presentation.did) == presentation.public_key:
+                future.set_result(True)
+                return future
+            # the DID's key was rotated since it was cached: drop the entry, the new check rejects the old key
+            self.cache.revoke(presentation.did)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("verifier closed")
+            self.pending.append((presentation, future))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self.condition.notify()
+        return future
+
+    def verify(self, presentation):
+        return self.submit(presentation).result()
+
+    # Set Batching ================================================================================================================================
+    def collect(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending and self.closed:
+                    return
+                # the window opens with the first request; later arrivals join until it closes or the batch is full
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.dispatch(batch)
+
+    def dispatch(self, batch):
+        # the same presentation sent by several steps in one window is verified once
+        groups = OrderedDict()
+        for presentation, future in batch:
+            groups.setdefault((presentation.did, presentation.digest), (presentation, []))[1].append(future)
+        self.count('batches')
+        self.count('coalesced', len(batch) - len(groups))
+
+        entries = list(groups.values())
+        size = -(-len(entries) // self.workers)
+        for start in range(0, len(entries), size):
+            chunk = entries[start:start + size]
+            task = self.pool.submit(verify_chunk, [presentation for presentation, _ in chunk], self.resolver)
+            task.add_done_callback(lambda task, chunk=chunk: self.complete(chunk, task))
+
+    def complete(self, chunk, task):
+        try:
+            results = task.result()
+        except Exception as e:
+            for _, futures in chunk:
+                for future in futures:
+                    future.set_exception(e)
+            return
+        for (presentation, futures), valid in zip(chunk, results):
+            if valid:
+                self.cache.put(presentation)
+                self.count('verified')
+            else:
+                self.count('rejected')
+                if self.logger is not None:
+                    self.logger.message("WARNING", "auth", f"Invalid presentation from {presentation.did}")
+            for future in futures:
+                future.set_result(valid)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.collector.join()
+        self.pool.shutdown(wait=True)
+
+
+class Auth_Sink:
+    # Cloud ingest sink: Cloud.py --sink blockchainAuth:Auth_Sink[:registry file]
+    def __init__(self, registry=None):
+        self.verifier = Batch_Verifier(resolver=registry_resolver(registry) if registry else resolve_did_key)
+        self.stats = {'valid': 0, 'invalid': 0, 'malformed': 0}
+        self.lock = threading.Lock()
+
+    def write(self, records):
+        for vehicle, received, packet in records:
+            if not is_presentation(packet):
+                continue
+            try:
+                presentation = Presentation.unpack(packet.payload_data or b'')
+            except (ValueError, struct.error, UnicodeDecodeError):
+                self.count('malformed')
+                continue
+            self.verifier.submit(presentation).add_done_callback(
+                lambda future: self.count('valid' if future.result() else 'invalid'))
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def close(self):
+        self.verifier.close()
+        print(f"auth: {self.stats}, verifier: {self.verifier.stats}, cache: {self.verifier.cache.stats}")
+
+
+# Benchmark: verifications/s per batch window and cache hit latency =================================================================================
+def benchmark(count, dids, workers):
+    keys = [nacl.signing.SigningKey.generate() for _ in range(dids)]
+    presentations = [Presentation.sign(key, did_key(key.verify_key), b'{"vp":"vehicle"}' * 8) for key in keys]
+    requests = [presentations[index % dids] for index in range(count)]
+
+    # a presentation self-signed with another key for someone else's DID is rejected, and leaves the cache entry alone
+    forged = Presentation.sign(nacl.signing.SigningKey.generate(), presentations[0].did, presentations[0].document)
+    unbound = Presentation.sign(keys[0], f"did:huconn:{0:08d}", presentations[0].document)
+    assert resolve_did_key(presentations[0].did) == bytes(keys[0].verify_key)
+    assert verify_presentation(presentations[0]) and not verify_presentation(forged) and not verify_presentation(unbound)
+    verifier = Batch_Verifier(workers=workers)
+    assert verifier.verify(presentations[0]) and not verifier.verify(forged) and verifier.cache.get(presentations[0])
+    verifier.close()
+    print("forged presentation for another holder's DID: rejected")
+
+    start = time.perf_counter_ns()
+    valid = sum(verify_presentation(presentation) for presentation in presentations)
+    sequential_s = (time.perf_counter_ns() - start) / 1e9
+    print(f"sequential       {dids / sequential_s:10,.0f} verifications/s ({valid}/{dids} valid)")
+
+    for window in (0.0005, 0.002, 0.01):
+        verifier = Batch_Verifier(window=window, workers=workers, cache=Verification_Cache(ttl=0))
+        start = time.perf_counter_ns()
+        futures = [verifier.submit(presentation) for presentation in presentations]
+        valid = sum(future.result() for future in futures)
+        batched_s = (time.perf_counter_ns() - start) / 1e9
+        verifier.close()
+        print(f"window {window * 1000:5.1f} ms  {dids / batched_s:10,.0f} verifications/s ({valid}/{dids} valid, "
+              f"{verifier.stats['batches']} batches, {workers} workers)")
+
+    # cache: the first pass verifies every DID, later requests are hits
+    verifier = Batch_Verifier(workers=workers)
+    for future in [verifier.submit(presentation) for presentation in presentations]:
+        future.result()
+    latencies = []
+    for presentation in requests:
+        start = time.perf_counter_ns()
+        verifier.submit(presentation).result()
+        latencies.append(time.perf_counter_ns() - start)
+    verifier.close()
+    latencies.sort()
+    print(f"cache hit        p50 {latencies[len(latencies) // 2] / 1000:.1f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] / 1000:.1f} us over {count} requests, {verifier.cache.stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Blockchain Authentication presentation verification benchmark')
+    parser.add_argument('--count', default=100000, type=int, help='Requests for the cache hit measurement')
+    parser.add_argument('--dids', default=5000, type=int, help='Distinct DIDs (presentations)')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int, help='Verification threads')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.dids, args.workers)
+
+# python3 blockchainAuth.py --dids 5000 --workers 4
@@ -0,0 +1,198 @@
+# conformance.py
+# The conformance.py file contains the Conformance_Runner class that replaces the CCU test mode.
+# It generates every valid (service, message type, IFT ID, IFT type) request, sends them concurrently from
+# the CCU endpoint, matches each response and reports a pass/fail and latency table plus the total wall time.
+# Each request is sent as the source its responder serves; requests no role answers are only sent and reported
+# as such (NOREPLY), not as timeouts.
+# The class contains the following attributes:
+# - routing: Routing_Table used to bind the CCU endpoint and resolve each destination
+# - concurrency: Number of requests in flight at once
+# - timeout: Seconds to wait for each response
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from packet import *
+
+HEADER_LEN = 12
+
+# service -> (destination, source the request is sent as, source of the answer reaching the CCU endpoint or None)
+SERVICE_DEST_MAP = {
+    # served by the CCU itself, whose endpoint the runner binds
+    ServiceID.VEHICLE_INFORMATION: (SourceDestID.D_IVI, SourceDestID.CCU, None),
+    # the D-IVI only forwards P-IVI control responses
+    ServiceID.D_IVI_CONTROL: (SourceDestID.D_IVI, SourceDestID.CCU, None),
+    # the P-IVI answers the D-IVI's requests (P_IVI_RESPONSE_TYPE_MAP); the D-IVI forwards the response to the CCU
+    ServiceID.P_IVI_CONTROL: (SourceDestID.P_IVI_1, SourceDestID.D_IVI, SourceDestID.D_IVI),
+    # the Cloud ingests, it never answers
+    ServiceID.OTT_CONTROL: (SourceDestID.CLOUD, SourceDestID.CCU, None),
+    ServiceID.BLOCKCHAIN_AUTHENTICATION: (SourceDestID.CLOUD, SourceDestID.CCU, None)
+}
+
+
+# Build the request matrix ==================================================================================================================
+def request_message_types(service_id):
+    message_types = SERVICE_MESSAGE_TYPE_MAP[service_id]
+    return [message_type for message_type in message_types if not message_type.name.endswith('_RESPONSE')]
+
+
+def build_matrix():
+    """Every valid (service, message type, IFT ID, IFT type) request; services without IFTs use IFT 0/0."""
+    matrix = []
+    for service_id in ServiceID:
+        for message_type in request_message_types(service_id):
+            ift_ids = SERVICE_IFT_ID_MAP.get(service_id)
+            if not ift_ids:
+                matrix.append((service_id, message_type, None, None))
+                continue
+            for ift_id in ift_ids:
+                for ift_type in IFT_TYPE_MAP[ift_id]:
+                    matrix.append((service_id, message_type, ift_id, ift_type))
+    # requests the P-IVI answers
+    for ift_id, ift_types in P_IVI_RESPONSE_TYPE_MAP.items():
+        for ift_type in ift_types:
+            matrix.append((ServiceID.P_IVI_CONTROL, P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_REQUEST,
+                           IFTID(ift_id), IFT_TYPE_MAP[IFTID(ift_id)](ift_type)))
+    # IFT IDs sharing a value alias to one member; keep each combination once
+    return list(dict.fromkeys(matrix))
+
+
+def expected_replier(case):
+    """Source ID of the answer to case at the CCU endpoint, or None if no role answers it."""
+    service_id, message_type, ift_id, ift_type = case
+    replier = SERVICE_DEST_MAP[service_id][2]
+    if service_id == ServiceID.P_IVI_CONTROL and \
+       (message_type != P_IVI_CONTROL_MESSAGE_TYPES.P_IVI_CONTROL_REQUEST or ift_id is None or
+            ift_type.value not in P_IVI_RESPONSE_TYPE_MAP.get(ift_id.value, {})):
+        return None
+    return replier.value if replier is not None else None
+
+
+class Conformance_Runner:
+    def __init__(self, system, logger, routing, concurrency=8, timeout=1.0, iterations=1):
+        self.system = system
+        self.logger = logger
+        self.routing = routing
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.iterations = iterations
+        self.lock = threading.Lock()
+        # (replier, service, ift_id, ift_type) -> deque of [event, received_ns]
+        self.pending = {}
+        self.running = False
+
+    # Set Response Receiver ======================================================================================================================
+    def receiver(self, sock):
+        while self.running:
+            try:
+                received_data, addr = sock.recvfrom(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            received_ns = time.perf_counter_ns()
+            if len(received_data) < HEADER_LEN:
+                continue
+            source_id, dest_id, service_id, message_type, ift_id, ift_type, _ = struct.unpack_from('!BBHHHHH', received_data)
+
+            with self.lock:
+                waiters = self.pending.get((source_id, service_id, ift_id, ift_type))
+                if not waiters:
+                    self.logger.message("WARNING", "test", f"Unmatched response [{addr[0]}] {received_data}")
+                    continue
+                waiter = waiters.popleft()
+            waiter[1] = received_ns
+            waiter[0].set()
+
+    # Set Request Sender =========================================================================================================================
+    def run_case(self, sock, case):
+        service_id, message_type, ift_id, ift_type = case
+        dest_id, source_id, _ = SERVICE_DEST_MAP[service_id]
+        replier = expected_replier(case)
+        ift_id_val = ift_id.value if ift_id else 0
+        ift_type_val = ift_type.value if ift_type else 0
+        endpoint = self.routing.resolve(dest_id.value)
+        if endpoint is None:
+            return case, False, None, "no route"
+
+        packet = ProtocolPacket(source_id.value, dest_id.value, service_id.value, message_type.value, ift_id_val, ift_type_val)
+        if replier is None:
+            sock.sendto(packet.pack(), endpoint)
+            return case, None, None, "no reply expected"
+
+        key = (replier, service_id.value, ift_id_val, ift_type_val)
+        waiter = [threading.Event(), None]
+        with self.lock:
+            self.pending.setdefault(key, deque()).append(waiter)
+
+        sent_ns = time.perf_counter_ns()
+        sock.sendto(packet.pack(), endpoint)
+
+        if waiter[0].wait(self.timeout):
+            return case, True, (waiter[1] - sent_ns) / 1e6, ""
+
+        with self.lock:
+            if waiter in self.pending.get(key, ()):
+                self.pending[key].remove(waiter)
+        return case, False, None, "timeout"
+
+    def run(self):
+        matrix = build_matrix() * self.iterations
+        ccu_endpoint = self.routing.resolve(SourceDestID.CCU.value)
+
+        # Responses are routed to the CCU endpoint, so the runner sends and receives there
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(ccu_endpoint)
+        sock.settimeout(0.1)
+
+        self.logger.message("INFO", "test", f"Conformance: {len(matrix)} requests, concurrency {self.concurrency}, timeout {self.timeout}s")
+        self.running = True
+        receiver_thread = threading.Thread(target=self.receiver, args=(sock,), daemon=True)
+        receiver_thread.start()
+
+        start_ns = time.perf_counter_ns()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(lambda case: self.run_case(sock, case), matrix))
+        wall_time = (time.perf_counter_ns() - start_ns) / 1e9
+
+        self.running = False
+        receiver_thread.join()
+        sock.close()
+
+        self.report(results, wall_time)
+        return results, wall_time
+
+    # Set Result Table ===========================================================================================================================
+    def report(self, results, wall_time):
+        table = {}
+        for case, passed, latency_ms, reason in results:
+            entry = table.setdefault(case, {'pass': 0, 'fail': 0, 'latency_ms': [], 'reason': ''})
+            if passed is None:
+                entry['reason'] = reason
+            elif passed:
+                entry['pass'] += 1
+                entry['latency_ms'].append(latency_ms)
+            else:
+                entry['fail'] += 1
+                entry['reason'] = reason
+
+        operation = "test"
+        self.logger.message("INFO", operation, f"{'RESULT':<6} {'SERVICE':<26} {'MESSAGE TYPE':<36} {'IFT ID':<10} {'TYPE':<10} {'PASS':>5} {'FAIL':>5} {'AVG ms':>8} {'MAX ms':>8}")
+        for (service_id, message_type, ift_id, ift_type), entry in table.items():
+            latencies = entry['latency_ms']
+            avg_ms = f"{sum(latencies) / len(latencies):.3f}" if latencies else "-"
+            max_ms = f"{max(latencies):.3f}" if latencies else "-"
+            result = "FAIL" if entry['fail'] else "PASS" if entry['pass'] else "NOREPLY"
+            self.logger.message("INFO", operation, f"{result:<6} {service_id.label:<26} {message_type.name:<36} "
+                                f"{ift_id.name if ift_id else '-':<10} {ift_type.name if ift_type else '-':<10} "
+                                f"{entry['pass']:>5} {entry['fail']:>5} {avg_ms:>8} {max_ms:>8} {entry['reason']}")
+
+        passed = sum(1 for _, ok, _, _ in results if ok)
+        answered = sum(1 for _, ok, _, _ in results if ok is not None)
+        self.logger.message("INFO", operation, f"Total: {passed}/{answered} passed, {len(results) - answered} sent without a reply expected, "
+                            f"wall time {wall_time:.3f}s, {len(results) / wall_time if wall_time else 0:.1f} requests/s")
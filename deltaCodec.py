@@ -0,0 +1,323 @@
+# deltaCodec.py
+# The deltaCodec.py file contains the delta codec for periodic telemetry (IFT_13_03 driving info groups,
+# IFT_13_05 start-up diagnostics, IFT_13_06 in-drive warning-light data).
+# A stream sends a keyframe with the full payload, then only the fields that changed as a bitmask plus values.
+# A keyframe is forced every KEYFRAME_INTERVAL packets and whenever the receiver asks for one (resync).
+# Streams are named by their concrete IFT type enum: IFT_13_02 (driver info, never delta coded) shares its IFT ID
+# value with IFT_13_03, so every frame starts with FRAME_MAGIC and receivers decode only payloads carrying it.
+# Only destinations with a decoder (CCU, Cloud) get frames; everything else is sent as is.
+# Every frame carries the origin, a random ID of the sending encoder: senders sharing a source ID and an address
+# (vehicles behind NAT, fleetSim) keep separate streams, and a resync names the origin whose stream was lost.
+# The classes contain the following attributes:
+# - Delta_Encoder: last payload sent per stream, used by ProtocolPacket.add_payload_data on the sender
+# - Delta_Decoder: last payload rebuilt per stream, restores the full payload before the message handler
+
+import argparse
+import os
+import struct
+from array import array
+import threading
+import time
+from packet import *
+
+FIELD_SIZE = 4              # payload is compared in 4-byte fields
+KEYFRAME_INTERVAL = 32      # packets between forced keyframes
+
+FRAME_MAGIC = b'DF'
+FRAME_KEYFRAME = 0x4B       # 'K' magic, kind, origin, seq, full payload
+FRAME_DELTA = 0x44          # 'D' magic, kind, origin, seq, payload length, bitmask, changed fields
+FRAME_RESYNC = 0x52         # 'R' magic, kind, origin, seq: receiver lost the origin's state, send a keyframe
+
+FRAME_HEADER = struct.Struct('!2sBIH')
+DELTA_HEADER = struct.Struct('!2sBIHH')
+
+# IFT types carrying delta-coded frames, by concrete type enum (not raw values: IFT_13_02_Type.TYPE_0002 is (7, 2) too)
+DELTA_IFT_TYPES = frozenset((
+    IFT_13_03_Type.TYPE_0002,
+    IFT_13_03_Type.TYPE_0003,
+    IFT_13_05_Type.TYPE_0001,
+    IFT_13_05_Type.TYPE_0002,
+    IFT_13_05_Type.TYPE_0003,
+    IFT_13_05_Type.TYPE_0004,
+    IFT_13_06_Type.TYPE_0010,
+    IFT_13_06_Type.TYPE_0011,
+    IFT_13_06_Type.TYPE_0012,
+    IFT_13_06_Type.TYPE_0013,
+))
+IFT_TYPE_IDS = {type_enum: ift_id.value for ift_id, type_enum in IFT_TYPE_MAP.items()}
+# (IFT ID, IFT type) values on the wire; receivers also check FRAME_MAGIC
+DELTA_IFT_VALUES = frozenset((IFT_TYPE_IDS[type(ift_type)], ift_type.value) for ift_type in DELTA_IFT_TYPES)
+# roles decoding frames: the CCU before process_message, the Cloud on ingest
+DECODING_DEST_IDS = frozenset((SourceDestID.CCU.value, SourceDestID.CLOUD.value))
+
+
+def delta_type(ift_id, ift_type):
+    """The delta-coded IFT type enum with these raw values, or None; for senders of periodic telemetry."""
+    for member in DELTA_IFT_TYPES:
+        if (ift_id, ift_type) == (IFT_TYPE_IDS[type(member)], member.value):
+            return member
+    return None
+
+
+def is_delta_frame(packet):
+    return (packet.ift_id, packet.ift_type) in DELTA_IFT_VALUES and (packet.payload_data or b'')[:len(FRAME_MAGIC)] == FRAME_MAGIC
+
+
+def stream_key(packet):
+    # Sender and receiver name a stream the same way: the sender's view of (source, dest, IFT)
+    return (packet.source_id, packet.dest_id, packet.service_id, packet.ift_id, packet.ift_type)
+
+
+def split_fields(data):
+    # whole 4-byte fields as ints plus the trailing partial field, if any
+    whole = len(data) - len(data) % FIELD_SIZE
+    return array('I', data[:whole]), data[whole:]
+
+
+def diff_fields(previous, data):
+    """Return (bitmask bytes, changed field bytes) of data against previous (same length)."""
+    field_count = (len(data) + FIELD_SIZE - 1) // FIELD_SIZE
+    mask_len = (field_count + 7) // 8
+    # whole-payload compare first: periodic telemetry is mostly unchanged
+    if previous == data:
+        return bytes(mask_len), b''
+
+    previous_words, previous_tail = split_fields(previous)
+    words, tail = split_fields(data)
+    changed_index = [index for index, (old, new) in enumerate(zip(previous_words, words)) if old != new]
+    changed = array('I', [words[index] for index in changed_index]).tobytes()
+    if tail and tail != previous_tail:
+        changed_index.append(len(words))
+        changed += tail
+
+    mask = 0
+    for index in changed_index:
+        mask |= 1 << index
+    return mask.to_bytes(mask_len, 'little'), changed
+
+
+def parse_delta(frame, previous):
+    """Full payload of a delta frame applied to previous, or None if the frame does not fit previous."""
+    if len(frame) < DELTA_HEADER.size:
+        return None
+    _, _, _, _, length = DELTA_HEADER.unpack_from(frame, 0)
+    if length != len(previous):
+        return None
+    field_count = (length + FIELD_SIZE - 1) // FIELD_SIZE
+    mask_end = DELTA_HEADER.size + (field_count + 7) // 8
+    mask = int.from_bytes(frame[DELTA_HEADER.size:mask_end], 'little')
+    if len(frame) < mask_end or mask >> field_count:
+        return None
+    # one value per mask bit; the last field may be partial
+    expected = bin(mask).count('1') * FIELD_SIZE
+    if field_count and mask >> (field_count - 1) & 1 and length % FIELD_SIZE:
+        expected -= FIELD_SIZE - length % FIELD_SIZE
+    if len(frame) - mask_end != expected:
+        return None
+    return apply_fields(previous, frame[DELTA_HEADER.size:mask_end], frame[mask_end:])
+
+
+def apply_fields(previous, mask_bytes, changed):
+    data = bytearray(previous)
+    mask = int.from_bytes(mask_bytes, 'little')
+    offset = 0
+    while mask:
+        low = mask & -mask
+        start = (low.bit_length() - 1) * FIELD_SIZE
+        length = min(FIELD_SIZE, len(data) - start)
+        data[start:start + length] = changed[offset:offset + length]
+        offset += length
+        mask ^= low
+    return bytes(data)
+
+
+class Delta_Encoder:
+    def __init__(self, logger=None, keyframe_interval=KEYFRAME_INTERVAL):
+        self.logger = logger
+        self.keyframe_interval = keyframe_interval
+        self.origin = int.from_bytes(os.urandom(4), 'big')
+        self.lock = threading.Lock()
+        # stream -> [seq, last payload, packets since keyframe, keyframe requested]
+        self.streams = {}
+        self.stats = {'keyframes': 0, 'deltas': 0, 'resyncs': 0, 'payload_bytes': 0, 'wire_bytes': 0}
+
+    # Set Encoder =================================================================================================================================
+    def add_payload_data(self, packet, data, ift_type=None):
+        """ProtocolPacket.add_payload_data for telemetry: keyframe or delta depending on the stream state.
+        ift_type is the IFT type enum of the stream; other types and destinations without a decoder get data as is."""
+        if ift_type not in DELTA_IFT_TYPES or packet.dest_id not in DECODING_DEST_IDS:
+            packet.add_payload_data(data)
+            return packet
+
+        key = stream_key(packet)
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None:
+                stream = self.streams[key] = [0, None, 0, True]
+            stream[0] = (stream[0] + 1) & 0xFFFF
+            seq = stream[0]
+            previous = stream[1]
+
+            keyframe = stream[3] or previous is None or len(previous) != len(data) or stream[2] >= self.keyframe_interval
+            if keyframe:
+                frame = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_KEYFRAME, self.origin, seq) + data
+                stream[2] = 0
+                stream[3] = False
+                self.stats['keyframes'] += 1
+            else:
+                mask, changed = diff_fields(previous, data)
+                frame = DELTA_HEADER.pack(FRAME_MAGIC, FRAME_DELTA, self.origin, seq, len(data)) + mask + changed
+                stream[2] += 1
+                self.stats['deltas'] += 1
+            stream[1] = bytes(data)
+            self.stats['payload_bytes'] += len(data)
+            self.stats['wire_bytes'] += len(frame)
+
+        packet.add_payload_data(frame)
+        return packet
+
+    def handle_resync(self, packet):
+        """Mark the stream for a keyframe if packet is a receiver's resync request. Returns True if it was one."""
+        if not is_delta_frame(packet) or packet.payload_data[len(FRAME_MAGIC):len(FRAME_MAGIC) + 1] != bytes((FRAME_RESYNC,)):
+            return False
+        if len(packet.payload_data) < FRAME_HEADER.size or FRAME_HEADER.unpack_from(packet.payload_data, 0)[2] != self.origin:
+            return True     # for another (e.g. the previous process's) encoder
+
+        # the request comes back with source and dest swapped
+        key = (packet.dest_id, packet.source_id, packet.service_id, packet.ift_id, packet.ift_type)
+        with self.lock:
+            if key in self.streams:
+                self.streams[key][3] = True
+            self.stats['resyncs'] += 1
+        if self.logger:
+            self.logger.message("INFO", "delta", f"Keyframe requested by {packet.source_id} for IFT {packet.ift_id}:{packet.ift_type}")
+        return True
+
+
+class Delta_Decoder:
+    def __init__(self, logger=None, send_resync=None):
+        self.logger = logger
+        self.send_resync = send_resync      # send_resync(dest_id, packet_data, reply_to)
+        self.lock = threading.Lock()
+        # (origin,) + stream -> [seq, last payload]; payload None while waiting for a keyframe
+        self.streams = {}
+        self.stats = {'keyframes': 0, 'deltas': 0, 'dropped': 0, 'resyncs': 0}
+
+    # Set Decoder =================================================================================================================================
+    def decode(self, packet, reply_to=None):
+        """Rebuild the full payload in place. Returns False if the frame cannot be applied (stream lost).
+        reply_to is the sender's (ip, port) a keyframe request goes to; None: the route of the source ID."""
+        if not is_delta_frame(packet):
+            return True
+
+        frame = packet.payload_data
+        _, kind, origin, seq = FRAME_HEADER.unpack_from(frame, 0) if len(frame) >= FRAME_HEADER.size else (None, None, 0, 0)
+        key = (origin,) + stream_key(packet)
+        with self.lock:
+            stream = self.streams.setdefault(key, [None, None])
+            data = None
+            if kind == FRAME_KEYFRAME:
+                data = bytes(frame[FRAME_HEADER.size:])
+                self.stats['keyframes'] += 1
+            elif kind == FRAME_DELTA and stream[1] is not None and seq == (stream[0] + 1) & 0xFFFF:
+                data = parse_delta(frame, stream[1])
+                self.stats['deltas'] += data is not None
+            if data is None:
+                # gap, unknown or malformed frame, or delta without a base: state is lost until the next keyframe.
+                # Ask once per loss; the periodic keyframe covers a lost request.
+                resync = stream[1] is not None or stream[0] is None
+                self.stats['dropped'] += 1
+                self.stats['resyncs'] += resync
+            stream[0], stream[1] = seq, data
+
+        if data is None:
+            if resync:
+                self.request_keyframe(packet, origin, reply_to)
+            return False
+        packet.add_payload_data(data)
+        return True
+
+    def request_keyframe(self, packet, origin, reply_to=None):
+        if self.send_resync is None:
+            return
+        request = ProtocolPacket(packet.dest_id, packet.source_id, packet.service_id, packet.message_type,
+                                 packet.ift_id, packet.ift_type)
+        request.add_payload_data(FRAME_HEADER.pack(FRAME_MAGIC, FRAME_RESYNC, origin, 0))
+        if self.logger:
+            self.logger.message("INFO", "delta", f"Stream lost, keyframe requested from {packet.source_id} ({origin:08x}) for IFT {packet.ift_id}:{packet.ift_type}")
+        self.send_resync(packet.source_id, request.pack(), reply_to)
+
+    def wrap(self, message_handler):
+        """message_handler taking raw packets, fed with full payloads rebuilt from delta frames."""
+        def handler(received_data):
+            packet = ProtocolPacket.unpack(received_data)
+            if not is_delta_frame(packet):
+                return message_handler(received_data)
+            if packet.payload_data[len(FRAME_MAGIC):len(FRAME_MAGIC) + 1] == bytes((FRAME_RESYNC,)):
+                return message_handler(received_data)
+            if self.decode(packet):
+                return message_handler(packet.pack())
+        return handler
+
+
+# Benchmark: bytes on the wire and CPU per packet against full resends ================================================================================
+def benchmark(count, size, change_ratio):
+    import random
+    random.seed(1)
+
+    ift_id = IFTID.IFT_13_06.value
+    ift_type = IFT_13_06_Type.TYPE_0010.value
+    delta_ift_type = IFT_13_06_Type.TYPE_0010
+    field_count = (size + FIELD_SIZE - 1) // FIELD_SIZE
+    payloads = []
+    data = bytearray(random.getrandbits(8) for _ in range(size))
+    for _ in range(count):
+        for index in range(field_count):
+            if random.random() < change_ratio:
+                data[index * FIELD_SIZE] = random.getrandbits(8)
+        payloads.append(bytes(data))
+
+    header = (SourceDestID.D_IVI.value, SourceDestID.CLOUD.value, ServiceID.D_IVI_CONTROL.value,
+              D_IVI_CONTROL_MESSAGE_TYPES.D_IVI_CONTROL_REQUEST.value, ift_id, ift_type)
+
+    def make_packet():
+        return ProtocolPacket(*header)
+
+    # full resend
+    full_bytes = 0
+    start_ns = time.process_time_ns()
+    for payload in payloads:
+        packet = make_packet()
+        packet.add_payload_data(payload)
+        packet_data = packet.pack()
+        full_bytes += len(packet_data)
+        ProtocolPacket.unpack(packet_data)
+    full_ns = (time.process_time_ns() - start_ns) / count
+
+    # delta coded
+    encoder = Delta_Encoder()
+    decoder = Delta_Decoder()
+    delta_bytes = 0
+    start_ns = time.process_time_ns()
+    for payload in payloads:
+        packet_data = encoder.add_payload_data(make_packet(), payload, delta_ift_type).pack()
+        delta_bytes += len(packet_data)
+        received = ProtocolPacket.unpack(packet_data)
+        decoder.decode(received)
+        assert received.payload_data == payload
+    delta_ns = (time.process_time_ns() - start_ns) / count
+
+    print(f"{count} packets, {size}-byte payload, {change_ratio:.0%} of fields change per packet, keyframe every {KEYFRAME_INTERVAL}")
+    print(f"full resend: {full_bytes / count:8.1f} bytes/packet {full_ns / 1000:8.2f} us CPU/packet")
+    print(f"delta:       {delta_bytes / count:8.1f} bytes/packet {delta_ns / 1000:8.2f} us CPU/packet "
+          f"({delta_bytes / full_bytes:.1%} of full bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Delta codec benchmark')
+    parser.add_argument('--count', default=10000, type=int, help='Packets')
+    parser.add_argument('--size', default=128, type=int, help='Payload bytes')
+    parser.add_argument('--change', default=0.1, type=float, help='Fraction of fields changed per packet')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.size, args.change)
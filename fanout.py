@@ -0,0 +1,106 @@
+# fanout.py
+# The fanout.py file contains the FanOut_Control class that delivers one packet to every seat of a
+# SourceDestID group (e.g. P_IVI_ALL) and reports the per-seat delivery latency skew.
+# The class contains the following attributes:
+# - routing: Routing_Table resolving each seat's unicast endpoint and the group's multicast address
+# - multicast: Send to the group's IP multicast address instead of the batched unicast fallback
+
+import socket
+import struct
+import threading
+import time
+from packet import *
+from udpControl import LOCAL_ENDPOINTS
+
+MULTICAST_TTL = 1
+
+
+class FanOut_Control:
+    def __init__(self, system, logger, routing, multicast=False):
+        self.system = system
+        self.logger = logger
+        self.routing = routing
+        self.multicast = multicast
+        self.lock = threading.Lock()
+        # (group_id, ift_id, ift_type) -> {'sent_ns', 'offsets', 'acks'}
+        self.pending = {}
+
+        # one socket for every group send instead of one socket per seat
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', MULTICAST_TTL))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.logger.message("INFO", "fanout", f"Fan-out mode: {'multicast' if self.multicast else 'unicast'}")
+
+    def group_members(self, group_id):
+        return [member.value for member in GROUP_MEMBER_MAP.get(SourceDestID(group_id), [])
+                if self.routing.resolve(member.value) is not None]
+
+    # Set Group Sender ===========================================================================================================================
+    def send_group(self, group_id, packet_data):
+        seats = self.group_members(group_id)
+        if not seats:
+            self.logger.message("WARNING", "fanout", f"No members for group {group_id}")
+            return
+
+        ift_id, ift_type = struct.unpack_from('!HH', packet_data, 6)
+        offsets = {}
+        sent_ns = time.perf_counter_ns()
+        multicast_group = self.routing.group(group_id) if self.multicast else None
+        try:
+            if multicast_group is not None:
+                self.sock.sendto(packet_data, multicast_group)
+                offsets = {seat: 0 for seat in seats}
+            else:
+                for seat in seats:
+                    endpoint = self.routing.resolve(seat)
+                    local_queue = LOCAL_ENDPOINTS.get(endpoint)
+                    if local_queue is not None:
+                        local_queue.put(packet_data)
+                    else:
+                        self.sock.sendto(packet_data, endpoint)
+                    offsets[seat] = time.perf_counter_ns() - sent_ns
+        except Exception as e:
+            print(f"An error occurred while sending the group message: {e}")
+            return
+
+        with self.lock:
+            self.pending[(group_id, ift_id, ift_type)] = {'sent_ns': sent_ns, 'offsets': offsets, 'acks': {}}
+        self.logger.message("INFO", "send", f"[GROUP:{SourceDestID(group_id)}:{len(seats)}] {packet_data}")
+
+    # Set Group Ack ==============================================================================================================================
+    def ack(self, seat_id, ift_id, ift_type):
+        """Record a seat's response to an outstanding group send; returns the skew report once every seat answered."""
+        now_ns = time.perf_counter_ns()
+        with self.lock:
+            for key, entry in self.pending.items():
+                group_id, pending_ift_id, pending_ift_type = key
+                if pending_ift_id != ift_id or pending_ift_type != ift_type or seat_id not in entry['offsets']:
+                    continue
+                entry['acks'].setdefault(seat_id, now_ns - entry['sent_ns'])
+                if len(entry['acks']) < len(entry['offsets']):
+                    return None
+                del self.pending[key]
+                break
+            else:
+                return None
+
+        report = self.skew_report(group_id, entry)
+        self.logger.message("INFO", "fanout", f"[GROUP:{SourceDestID(group_id)}:IFT:{ift_id}:{ift_type}] "
+                            f"latency_us:{report['latency_us']} send_offset_us:{report['send_offset_us']} skew_us:{report['skew_us']:.1f}")
+        return report
+
+    @staticmethod
+    def skew_report(group_id, entry):
+        latency_us = {SourceDestID(seat).label: ns / 1000 for seat, ns in entry['acks'].items()}
+        send_offset_us = {SourceDestID(seat).label: ns / 1000 for seat, ns in entry['offsets'].items()}
+        values = list(latency_us.values())
+        return {
+            'group': SourceDestID(group_id).label,
+            'latency_us': latency_us,
+            'send_offset_us': send_offset_us,
+            'skew_us': max(values) - min(values) if values else 0.0,
+        }
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,334 @@
+# fleetSim.py
+# The fleetSim.py file contains the fleet simulator: many virtual vehicles spread over a process pool, generating
+# load against a CCU or Cloud endpoint. Each vehicle drives its own D_IVI_Control and P_IVI_Control (D-IVI.py, P-IVI.py,
+# mode 1 without the one-shot send): D-IVI telemetry goes through the role's delta encoder, DMS warnings through its
+# send-path suppressor, and both roles send from the vehicle's socket, so every vehicle is its own delta stream
+# (frames carry the encoder's origin) and the receivers' keyframe requests come back to the vehicle.
+# Towards the Cloud with --batch > 1 a vehicle sends the CCU's uplink batches instead (uplink.pack_batch), which carry
+# full payloads: the CCU decodes the telemetry before queueing it.
+# The classes contain the following attributes:
+# - TRAFFIC_MIXES: named mixes of IFT IDs (weights); the IFT types are drawn from IFT_TYPE_MAP
+# - Virtual_Vehicle: per-vehicle socket, roles, uplink epoch and stats
+
+import argparse
+import csv
+import heapq
+import importlib.util
+import multiprocessing
+import os
+import random
+import socket
+import time
+from logger import Logger
+from routing import Routing_Table, ROUTES_FILE
+from deltaCodec import is_delta_frame
+from payloadSchema import SCHEMA_REGISTRY, FIELD_TYPES
+from uplink import pack_batch, ACK, ACK_MAGIC
+from packet import *
+
+SYSTEM = 'FLEET-SIM'
+LOG_LEVEL = 'INFO'
+PROTOCOL = 'UDP'
+HEADER_LEN = 12
+
+# mix -> {IFT ID: weight}
+TRAFFIC_MIXES = {
+    'dms': {IFTID.IFT_12_03: 4.0, IFTID.IFT_12_04: 0.5, IFTID.IFT_13_04: 1.0},
+    'diagnostics': {IFTID.IFT_13_03: 4.0, IFTID.IFT_13_05: 1.0, IFTID.IFT_13_06: 2.0, IFTID.IFT_13_01: 0.2},
+    'media': {IFTID.IFT_23_02: 4.0, IFTID.IFT_23_01: 0.5, IFTID.IFT_23_03: 0.5},
+    'location': {IFTID.IFT_12_05: 1.0},
+}
+
+# IFT types a vehicle emits: sent by the D-IVI ([D]) or a P-IVI ([P]), or with a payload schema
+VEHICLE_SENDER_PREFIXES = ('[D]', '[P]', '[P, R]')
+
+# source ID -> role script and class sending its packets
+VEHICLE_ROLES = {
+    SourceDestID.D_IVI.value: ('D-IVI.py', 'D_IVI_Control'),
+    SourceDestID.P_IVI_1.value: ('P-IVI.py', 'P_IVI_Control'),
+}
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROLE_MODULES = {}
+
+
+def load_role_class(script, class_name):
+    # role scripts have dashes in their names: load them from the file, as ivi-node.py does
+    if script not in ROLE_MODULES:
+        name = os.path.splitext(script)[0].replace('-', '_').lower()
+        spec = importlib.util.spec_from_file_location(name, os.path.join(BASE_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        ROLE_MODULES[script] = module
+    return getattr(ROLE_MODULES[script], class_name)
+
+
+def mix_streams(names):
+    """[(source_id, ift_id, ift_type), ...] and cumulative weights for a comma separated list of mixes."""
+    weights = {}
+    for name in names.split(','):
+        for ift_id, weight in TRAFFIC_MIXES[name.strip()].items():
+            weights[ift_id] = weights.get(ift_id, 0) + weight
+
+    streams, cumulative, total = [], [], 0.0
+    for ift_id, weight in weights.items():
+        ift_types = [ift_type for ift_type in IFT_TYPE_MAP[ift_id]
+                     if ift_type.label.startswith(VEHICLE_SENDER_PREFIXES) or SCHEMA_REGISTRY.get(ift_id, ift_type) is not None]
+        for ift_type in ift_types:
+            source_id = SourceDestID.P_IVI_1 if ift_type.label.startswith('[P') else SourceDestID.D_IVI
+            streams.append((source_id.value, ift_id.value, ift_type.value))
+            total += weight / len(ift_types)
+            cumulative.append(total)
+    return streams, cumulative
+
+
+def synthetic_value(field_type, rng):
+    if isinstance(field_type, tuple) and field_type[0] == 'str':
+        return ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789') for _ in range(field_type[1]))
+    if isinstance(field_type, tuple) and field_type[0] == 'group':
+        return [synthetic_record(field_type[2], rng) for _ in range(rng.randint(1, 8))]
+    code = FIELD_TYPES[field_type]
+    if code in 'fd':
+        return rng.uniform(0, 100)
+    if code == '?':
+        return rng.random() < 0.5
+    bits = {'B': 8, 'H': 16, 'I': 32, 'Q': 64, 'b': 7, 'h': 15, 'i': 31, 'q': 63}[code]
+    return rng.getrandbits(min(bits, 16))
+
+
+def synthetic_record(fields, rng):
+    return {name: synthetic_value(field_type, rng) for name, field_type in fields}
+
+
+class Virtual_Vehicle:
+    def __init__(self, vehicle_id, config, streams, cumulative, logger, routing, rng):
+        self.vehicle_id = vehicle_id
+        self.target = config['target']
+        self.endpoint = config['endpoint']
+        self.streams = streams
+        self.cumulative = cumulative
+        self.batch = config['batch']
+        self.rng = rng
+
+        # one socket per vehicle: its own source port towards the receiver, keyframe requests and acks come back to it
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', 0))
+        target_id = SourceDestID.CLOUD if self.target == 'cloud' else SourceDestID.CCU
+        self.roles = {}
+        for source_id, (script, class_name) in VEHICLE_ROLES.items():
+            role_class = load_role_class(script, class_name)
+            self.roles[source_id] = role_class(logger, 1, PROTOCOL, dest_ip_addr=self.endpoint[0], dest_port=self.endpoint[1],
+                                               source_id=source_id, dest_id=target_id.value, send_data=b"", routing=routing,
+                                               suppress=config['suppress'], crypto_key=config['crypto_key'], sock=self.sock, start=False)
+        self.divi = self.roles[SourceDestID.D_IVI.value]
+        self.driver_state = 0
+        self.epoch = (os.getpid() << 32) | vehicle_id
+        self.seq = 1
+        self.pending = []
+        self.stats = {'vehicle': vehicle_id, 'generated': 0, 'suppressed': 0, 'packets': 0, 'datagrams': 0, 'bytes': 0,
+                      'acks': 0, 'resyncs': 0, 'errors': 0}
+
+    # Set Traffic ================================================================================================================================
+    def make_packet(self):
+        """(source ID, header-only ProtocolPacket, payload) of the next message."""
+        source_id, ift_id, ift_type = self.streams[self.pick()]
+        dest_id = SourceDestID.CLOUD.value if self.target == 'cloud' or ift_id >= IFTID.IFT_13_01.value else SourceDestID.P_IVI_ALL.value
+        service_id = (ServiceID.P_IVI_CONTROL if source_id == SourceDestID.P_IVI_1.value else ServiceID.D_IVI_CONTROL).value
+
+        schema = SCHEMA_REGISTRY.get(ift_id, ift_type)
+        if schema is not None:
+            record = synthetic_record(schema.fields, self.rng)
+            if 'driver_state' in record:
+                # drowsiness episodes: the DMS keeps re-emitting the same state for a while
+                if self.rng.random() < 0.05:
+                    self.driver_state = self.rng.randint(0, 3)
+                record['driver_state'] = self.driver_state
+                record['warning_level'] = self.driver_state
+            data = schema.encode(record)
+        else:
+            data = self.rng.randbytes(32) if hasattr(self.rng, 'randbytes') else bytes(self.rng.getrandbits(8) for _ in range(32))
+
+        return source_id, ProtocolPacket(source_id, dest_id, service_id, 0, ift_id, ift_type), data
+
+    def pick(self):
+        point = self.rng.random() * self.cumulative[-1]
+        low, high = 0, len(self.cumulative) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.cumulative[middle] < point:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def tick(self):
+        source_id, packet, data = self.make_packet()
+        role = self.roles[source_id]
+        self.stats['generated'] += 1
+        if self.target == 'cloud' and self.batch > 1:
+            # the CCU queues what the D-IVI's suppressor let through, with full payloads
+            packet.add_payload_data(data)
+            packet_data = packet.pack()
+            suppressor = getattr(role, 'suppressor', None)
+            if suppressor is not None and not suppressor.check(packet_data):
+                return
+            self.stats['packets'] += 1
+            self.pending.append(packet_data)
+            if len(self.pending) >= self.batch:
+                self.flush()
+        else:
+            # periodic messages: the D-IVI delta codes its telemetry
+            sent = role.send_message(packet, data, telemetry=True) if role is self.divi else role.send_message(packet, data)
+            if sent:
+                self.stats['packets'] += 1
+                self.stats['datagrams'] += 1
+                self.stats['bytes'] += HEADER_LEN + packet.data_length
+        self.drain()
+
+    def flush(self):
+        if self.pending:
+            data = pack_batch(self.epoch, self.seq, self.pending)
+            try:
+                self.sock.sendto(data, self.endpoint)
+                self.stats['datagrams'] += 1
+                self.stats['bytes'] += len(data)
+            except OSError:
+                self.stats['errors'] += len(self.pending)
+            self.seq += len(self.pending)
+            self.pending = []
+
+    def drain(self):
+        # uplink acks from the Cloud; keyframe requests from the CCU's or Cloud's delta decoder go to the D-IVI role
+        while True:
+            try:
+                data = self.sock.recv(PROTOCOL_LEN + MAX_PAYLOAD_LEN, socket.MSG_DONTWAIT)
+            except OSError:
+                return
+            if len(data) == ACK.size and data[:4] == ACK_MAGIC:
+                self.stats['acks'] += 1
+            elif len(data) >= HEADER_LEN and is_delta_frame(ProtocolPacket.unpack(data)):
+                self.divi.process_message(data)
+
+    def close(self):
+        self.flush()
+        self.drain()
+        self.sock.close()
+        suppressor = self.divi.suppressor
+        self.stats['suppressed'] = suppressor.stats['suppressed'] if suppressor is not None else 0
+        self.stats['resyncs'] = self.divi.deltaEncoder.stats['resyncs']
+        if self.target != 'cloud' or self.batch <= 1:
+            self.stats['errors'] = self.stats['generated'] - self.stats['suppressed'] - self.stats['packets']
+
+
+# Set Worker ==================================================================================================================================
+def run_vehicles(vehicle_ids, config):
+    """Drive a share of the fleet in one process; returns the per-vehicle stats."""
+    streams, cumulative = mix_streams(config['mix'])
+    # the roles log only errors: their per-packet lines would cost more than the sends
+    logger = Logger('ERROR', SYSTEM, PROTOCOL)
+    routing = Routing_Table(logger, config['routes'])
+    vehicles = [Virtual_Vehicle(vehicle_id, config, streams, cumulative, logger, routing,
+                                random.Random(config['seed'] * 1000003 + vehicle_id))
+                for vehicle_id in vehicle_ids]
+
+    interval = 1.0 / config['rate']
+    start = time.monotonic()
+    end = start + config['duration']
+    # stagger the vehicles over one interval so the load is smooth
+    schedule = [(start + interval * index / len(vehicles), index) for index in range(len(vehicles))]
+    heapq.heapify(schedule)
+    late = 0
+    while schedule:
+        due, index = schedule[0]
+        now = time.monotonic()
+        if now >= end:
+            break
+        if due > now:
+            time.sleep(min(due - now, 0.01))
+            continue
+        if now - due > interval:
+            late += 1
+        vehicles[index].tick()
+        heapq.heapreplace(schedule, (due + interval, index))
+
+    # last partial batches, then a moment for their acks
+    for vehicle in vehicles:
+        vehicle.flush()
+    time.sleep(0.2)
+    results = []
+    for vehicle in vehicles:
+        vehicle.close()
+        results.append(vehicle.stats)
+    if results:
+        results[0]['late_ticks'] = late
+    return results
+
+
+def main(args):
+    # Set logger
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger.message("INFO", "Start", f"{SYSTEM}: {args.vehicles} vehicles, {args.workers} workers, mix {args.mix} -> {args.target}")
+
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    target_id = SourceDestID.CLOUD if args.target == 'cloud' else SourceDestID.CCU
+    endpoint = (args.dest_ip_addr, int(args.dest_port)) if args.dest_ip_addr and args.dest_port else routing.resolve(target_id.value)
+
+    config = {'mix': args.mix, 'target': args.target, 'endpoint': endpoint, 'batch': args.batch, 'suppress': args.suppress,
+              'rate': args.rate, 'duration': args.duration, 'seed': args.seed, 'routes': args.routes, 'crypto_key': args.crypto_key}
+    shares = [list(range(worker, args.vehicles, args.workers)) for worker in range(args.workers)]
+    shares = [share for share in shares if share]
+
+    start_ns = time.perf_counter_ns()
+    with multiprocessing.Pool(len(shares)) as pool:
+        results = [stats for worker_stats in pool.starmap(run_vehicles, [(share, config) for share in shares]) for stats in worker_stats]
+    elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9
+
+    report(logger, results, args, elapsed_s)
+    if args.stats_file:
+        with open(args.stats_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=[name for name in results[0] if name != 'late_ticks'], extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(sorted(results, key=lambda stats: stats['vehicle']))
+        logger.message("INFO", "stats", f"Per-vehicle stats written to {args.stats_file}")
+    return results
+
+
+def report(logger, results, args, elapsed_s):
+    totals = {name: sum(stats[name] for stats in results) for name in results[0] if name not in ('vehicle', 'late_ticks')}
+    late = sum(stats.get('late_ticks', 0) for stats in results)
+    duration = args.duration
+    logger.message("INFO", "stats", f"aggregate: {totals['packets'] / duration:,.0f} packets/s, {totals['datagrams'] / duration:,.0f} datagrams/s, "
+                   f"{totals['bytes'] * 8 / duration / 1e6:.1f} Mbit/s over {duration:.0f} s ({elapsed_s:.1f} s with startup)")
+    logger.message("INFO", "stats", ", ".join(f"{name}: {count}" for name, count in totals.items()) + f", late ticks: {late}")
+
+    sent = sorted(stats['packets'] / duration for stats in results)
+    logger.message("INFO", "stats", f"per vehicle packets/s: min {sent[0]:.1f}, median {sent[len(sent) // 2]:.1f}, "
+                   f"max {sent[-1]:.1f} (target {args.rate:.1f} generated)")
+    if late:
+        logger.message("WARNING", "stats", f"{late} ticks ran more than one interval late: add workers or lower --rate")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"{SYSTEM}: virtual vehicles generating load against a CCU or Cloud endpoint")
+    parser.add_argument('--protocol', default=PROTOCOL, choices=['UDP'], help='Protocol')
+    parser.add_argument('--debug_level', default=LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+    parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML)')
+    parser.add_argument('--target', default='cloud', choices=['cloud', 'ccu'], help='Send to the Cloud (as CCU uplinks) or to a CCU (as D-IVI/P-IVI)')
+    parser.add_argument('--dest_ip_addr', default=None, help='Dest IP Address (default: route of the target)')
+    parser.add_argument('--dest_port', default=None, help='Dest Port (default: route of the target)')
+    parser.add_argument('--vehicles', default=100, type=int, help='Virtual vehicles')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int, help='Processes the vehicles are spread over')
+    parser.add_argument('--mix', default='dms,diagnostics,media', help=f"Comma separated traffic mixes ({', '.join(TRAFFIC_MIXES)})")
+    parser.add_argument('--rate', default=10.0, type=float, help='Messages generated per vehicle per second')
+    parser.add_argument('--duration', default=10.0, type=float, help='Seconds to run')
+    parser.add_argument('--batch', default=16, type=int, help='Cloud target: packets per uplink batch (1: single packets)')
+    parser.add_argument('--suppress', default=1.0, type=float, help='Suppress repeated warnings, keepalive every N seconds (0: off)')
+    parser.add_argument('--crypto_key', default=None, help='Master key file the vehicles encrypt Cloud-bound payloads with (default: off)')
+    parser.add_argument('--seed', default=1, type=int, help='Random seed')
+    parser.add_argument('--stats_file', default=None, help='Write per-vehicle stats as CSV')
+
+    args = parser.parse_args()
+    main(args)
+
+# python3 fleetSim.py --vehicles 2000 --rate 5 --duration 30 --target cloud
+# python3 fleetSim.py --vehicles 50 --mix dms --target ccu --batch 1
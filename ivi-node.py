@@ -0,0 +1,187 @@
+import argparse
+import importlib.util
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import queue
+from logger import Logger
+import udpControl
+from udpControl import UDP_Control
+from routing import Routing_Table, ROUTES_FILE
+from packet import SourceDestID
+
+# Global variables
+SYSTEM = 'IVI-NODE'
+LOG_LEVEL = 'INFO'
+PROTOCOL = 'UDP'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# role -> (script, class, SourceDestID of the role, default dest ID)
+ROLE_MAP = {
+    'ccu': ('CCU-IVI-Control.py', 'CCU_IVI_Control', SourceDestID.CCU, SourceDestID.D_IVI),
+    'divi': ('D-IVI.py', 'D_IVI_Control', SourceDestID.D_IVI, SourceDestID.P_IVI_1),
+    'pivi1': ('P-IVI.py', 'P_IVI_Control', SourceDestID.P_IVI_1, SourceDestID.D_IVI),
+    'pivi2': ('P-IVI.py', 'P_IVI_Control', SourceDestID.P_IVI_2, SourceDestID.D_IVI),
+    'cloud': ('Cloud.py', 'Cloud_Control', SourceDestID.CLOUD, SourceDestID.CCU),
+}
+
+BENCHMARK_TIMEOUT = 10.0
+ROLE_MODULES = {}
+
+
+# Load role scripts lazily; pivi1 and pivi2 share one module ==================================================================================
+def load_role_module(script):
+    if script not in ROLE_MODULES:
+        name = os.path.splitext(script)[0].replace('-', '_').lower()
+        spec = importlib.util.spec_from_file_location(name, os.path.join(BASE_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        ROLE_MODULES[script] = module
+    return ROLE_MODULES[script]
+
+
+def start_role(role, args, routing):
+    script, class_name, role_id, dest_id = ROLE_MAP[role]
+    module = load_role_module(script)
+    logger = Logger(args.debug_level, role_id.label, args.protocol, args.debug_devlop)
+    src_ip_addr, src_port = routing.resolve(role_id.value)
+
+    role_class = getattr(module, class_name)
+    return role_class(logger, 0, args.protocol, src_ip_addr=src_ip_addr, src_port=src_port,
+                      source_id=role_id.value, dest_id=dest_id.value, service_id=0, message_type=0,
+                      ift_id=0, ift_type=0, send_data=b"", routing=routing, multicast_group=args.multicast_group)
+
+
+# Benchmark ===================================================================================================================================
+def wait_bound(endpoint, timeout=BENCHMARK_TIMEOUT):
+    # A probe bind without SO_REUSEADDR fails once the role has bound the port
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.bind(endpoint)
+        except OSError:
+            return True
+        finally:
+            probe.close()
+        time.sleep(0.001)
+    return False
+
+
+def benchmark_multiprocess_startup(roles, args, routing):
+    start_ns = time.perf_counter_ns()
+    processes = []
+    for role in roles:
+        script, _, role_id, _ = ROLE_MAP[role]
+        ip_addr, port = routing.resolve(role_id.value)
+        command = [sys.executable, os.path.join(BASE_DIR, script), '--routes', args.routes,
+                   '--src_ip_addr', ip_addr, '--src_port', str(port), '--debug_level', 'CRITICAL']
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    ready = all(wait_bound(routing.resolve(ROLE_MAP[role][2].value)) for role in roles)
+    elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+    return elapsed_ms if ready else None
+
+
+def benchmark_hop(count, local):
+    # One-way hop through UDP_Control.udp_client: in-process queue vs loopback socket
+    quiet = Logger('CRITICAL', SYSTEM, PROTOCOL, log_console=False)
+    sender = UDP_Control(SYSTEM, '127.0.0.1', 0, quiet)
+    latencies = []
+    received = threading.Semaphore(0)
+
+    def on_packet(data):
+        latencies.append(time.perf_counter_ns() - struct.unpack('!Q', data)[0])
+        received.release()
+
+    if local:
+        endpoint = ('127.0.0.1', 1)   # never bound: only reachable through the local table
+        local_queue = queue.SimpleQueue()
+        udpControl.LOCAL_ENDPOINTS[endpoint] = local_queue
+        consumer = lambda: [on_packet(local_queue.get()) for _ in range(count)]
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        endpoint = sock.getsockname()
+        consumer = lambda: [on_packet(sock.recv(64)) for _ in range(count)]
+
+    consumer_thread = threading.Thread(target=consumer, daemon=True)
+    consumer_thread.start()
+    for _ in range(count):
+        sender.udp_client(endpoint[0], endpoint[1], struct.pack('!Q', time.perf_counter_ns()))
+        received.acquire(timeout=BENCHMARK_TIMEOUT)
+
+    if local:
+        del udpControl.LOCAL_ENDPOINTS[endpoint]
+    else:
+        sock.close()
+
+    latencies.sort()
+    return {
+        'p50_us': latencies[len(latencies) // 2] / 1000,
+        'p99_us': latencies[int(len(latencies) * 0.99)] / 1000,
+        'mean_us': sum(latencies) / len(latencies) / 1000,
+    }
+
+
+def main(args):
+    start_ns = time.perf_counter_ns()
+
+    # Set logger
+    logger = Logger(args.debug_level, SYSTEM, args.protocol, args.debug_devlop)
+    logger.message("INFO", "Start", f"{SYSTEM}: {args.roles}")
+
+    roles = [role.strip() for role in args.roles.split(',') if role.strip()]
+    for role in roles:
+        if role not in ROLE_MAP:
+            raise ValueError(f"Unknown role: {role} (choose from {', '.join(ROLE_MAP)})")
+
+    # Set routing table
+    routing = Routing_Table(logger, args.routes)
+    routing.install_sighup()
+
+    # Multi-process baseline has to run before the roles bind their ports here
+    if args.benchmark:
+        multiprocess_ms = benchmark_multiprocess_startup(roles, args, routing)
+        start_ns = time.perf_counter_ns()
+
+    # Roles in this node exchange packets through in-process queues; other endpoints stay on the network
+    udpControl.enable_local_delivery()
+    nodes = {role: start_role(role, args, routing) for role in roles}
+    startup_ms = (time.perf_counter_ns() - start_ns) / 1e6
+    logger.message("INFO", "Start", f"Roles up in {startup_ms:.1f} ms: {', '.join(nodes)}")
+
+    if args.benchmark:
+        logger.message("INFO", "benchmark", f"Startup {','.join(roles)}: single process {startup_ms:.1f} ms, "
+                       + (f"multi-process {multiprocess_ms:.1f} ms" if multiprocess_ms is not None else "multi-process did not come up"))
+        for local in (True, False):
+            result = benchmark_hop(args.benchmark, local)
+            logger.message("INFO", "benchmark", f"Hop ({'in-process queue' if local else 'UDP loopback'}, {args.benchmark} packets): "
+                           f"p50 {result['p50_us']:.1f} us, p99 {result['p99_us']:.1f} us, mean {result['mean_us']:.1f} us")
+
+    return nodes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"{SYSTEM}: run several IVI roles in one process")
+    parser.add_argument('--roles', default='ccu,divi,pivi1,pivi2', help=f"Comma separated roles ({', '.join(ROLE_MAP)})")
+    parser.add_argument('--protocol', default=PROTOCOL, choices=['UDP'], help='Protocol (in-process delivery is UDP only)')
+    parser.add_argument('--debug_level', default=LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help='Debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+    parser.add_argument('--debug_devlop', action='store_true')
+    parser.add_argument('--routes', default=ROUTES_FILE, help='Routing table (YAML), reloaded on SIGHUP')
+    parser.add_argument('--multicast_group', action='store_true', help='Use the P-IVI-ALL multicast group for fan-out')
+    parser.add_argument('--benchmark', default=0, type=int, help='Compare startup and per-hop latency against the multi-process setup using N packets')
+
+    args = parser.parse_args()
+    main(args)
+
+# python3 ivi-node.py --roles ccu,divi,pivi1,pivi2
+# python3 ivi-node.py --roles divi,pivi1 --benchmark 10000
@@ -0,0 +1,334 @@
+# lifecycle.py
+# The lifecycle.py file contains the Lifecycle class: graceful shutdown and zero-downtime restart of a role.
+# On SIGUSR2 the running process starts a successor (same interpreter, arguments and working directory) and hands
+# it the bound server sockets as file descriptors over a Unix socket (SCM_RIGHTS). Both processes share the same
+# kernel socket, so datagrams queued during the switch stay queued; once the successor reports ready, the old
+# process stops its receive loops, lets in-flight handlers finish, runs its exit hooks and exits.
+# A successor that opens on-disk stores (claim) asks its predecessor to release them first: the old process then
+# stops, drains and runs its exit hooks (closing the stores) before the successor opens them, and only exits once
+# the successor is ready. Each claimed directory holds an exclusive flock, so two processes never write one store.
+# SIGTERM runs the same stop/drain/exit path without a successor.
+# The class contains the following attributes:
+# - sockets: Server sockets by key ('udp:<ip>:<port>', 'tcp:<ip>:<port>') that are handed to a successor
+# - inherited: Sockets received from the predecessor, adopted by the servers binding the same key
+# - servers: stop() callables of the receive loops; each returns once its loop has exited
+# - locks: File descriptors of the flocks on the claimed store directories, closed after the exit hooks
+
+import argparse
+import array
+import fcntl
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HANDOFF_ENV = 'IVI_HANDOFF_SOCKET'      # set for a successor: Unix socket path of its predecessor
+HANDOFF_TIMEOUT = 30.0      # seconds the old process waits for its successor to become ready
+DRAIN_TIMEOUT = 5.0         # seconds in-flight handlers get to finish
+MAX_SOCKETS = 16
+LOCK_FILE = '.lock'         # flocked in every claimed store directory
+
+
+# socket.send_fds/recv_fds are Python 3.9+; the targets run 3.8, so pass the descriptors with sendmsg/recvmsg directly
+def send_fds(sock, buffers, fds):
+    return sock.sendmsg(buffers, [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def recv_fds(sock, bufsize, maxfds):
+    fds = array.array('i')
+    message, ancdata, flags, addr = sock.recvmsg(bufsize, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return message, list(fds), flags, addr
+
+
+class Lifecycle:
+    def __init__(self, system, logger):
+        self.system = system
+        self.logger = logger
+        self.sockets = {}
+        self.inherited = {}
+        self.servers = []
+        self.exit_hooks = []
+        self.locks = []
+        self.lock = threading.Lock()
+        self.restarting = False
+        self.released = False       # loops stopped and exit hooks run (release/shutdown)
+        self.predecessor = None     # Unix connection to the predecessor until ready() is sent
+        self.predecessor_released = False
+        self.receive_handoff()
+
+    # Set Successor side ==========================================================================================================================
+    def receive_handoff(self):
+        path = os.environ.pop(HANDOFF_ENV, None)
+        if not path:
+            return
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(path)
+            message, fds, _, _ = recv_fds(conn, 65536, MAX_SOCKETS)
+            for key, fd in zip(json.loads(message.decode('utf-8')), fds):
+                family, kind = (socket.AF_INET, socket.SOCK_DGRAM) if key.startswith('udp:') else (socket.AF_INET, socket.SOCK_STREAM)
+                self.inherited[key] = socket.socket(family, kind, fileno=fd)
+            self.predecessor = conn
+            self.logger.message("INFO", "lifecycle", f"Adopted {len(self.inherited)} sockets from the previous process: {list(self.inherited)}")
+        except (OSError, ValueError) as e:
+            conn.close()
+            self.logger.message("ERROR", "lifecycle", f"Socket handoff from {path} failed, binding new sockets: {e}")
+
+    def adopt(self, key):
+        """The socket handed over for key, or None if the server should bind its own."""
+        with self.lock:
+            sock = self.inherited.pop(key, None)
+            if sock is not None:
+                self.sockets[key] = sock
+            return sock
+
+    def register(self, key, sock, stop=None):
+        with self.lock:
+            self.sockets[key] = sock
+            if stop is not None:
+                self.servers.append(stop)
+
+    def add_server(self, stop):
+        with self.lock:
+            self.servers.append(stop)
+
+    def on_exit(self, hook):
+        self.exit_hooks.append(hook)
+
+    def claim(self, directory):
+        """Own the store in directory before opening it: a successor first has its predecessor drain and close its stores."""
+        if self.predecessor is not None and not self.predecessor_released:
+            try:
+                self.predecessor.settimeout(HANDOFF_TIMEOUT + DRAIN_TIMEOUT)
+                self.predecessor.sendall(b'RELEASE')
+                if self.predecessor.recv(16) != b'RELEASED':
+                    raise OSError("previous process closed the handoff")
+                self.logger.message("INFO", "lifecycle", "Previous process released its stores")
+            except OSError as e:
+                # an exited predecessor released its flocks with the process; a live one still holds them (below)
+                self.logger.message("WARNING", "lifecycle", f"Store release by the previous process failed: {e}")
+            self.predecessor_released = True
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise RuntimeError(f"Store {directory} is in use by another process")
+        self.locks.append(fd)
+
+    def ready(self, timeout=HANDOFF_TIMEOUT):
+        """Tell the predecessor this process is serving; it then drains and exits."""
+        # the server threads adopt their sockets after the role is constructed
+        deadline = time.monotonic() + timeout
+        while self.inherited and self.predecessor is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.lock:
+            for sock in self.inherited.values():
+                sock.close()        # handed over but not served by this version
+            self.inherited.clear()
+        if self.predecessor is not None:
+            try:
+                self.predecessor.sendall(b'READY')
+            except OSError as e:
+                self.logger.message("WARNING", "lifecycle", f"Ready notification failed: {e}")
+            self.predecessor.close()
+            self.predecessor = None
+
+    # Set Signals =================================================================================================================================
+    def install(self):
+        # Signal handlers run on the main thread; do the restart/shutdown off it. Not daemon threads: once the server
+        # loops have stopped, the interpreter would otherwise exit before the exit hooks have run
+        signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=self.restart).start())
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.shutdown).start())
+        self.logger.message("INFO", "lifecycle", f"Restart on SIGUSR2, graceful stop on SIGTERM (pid {os.getpid()})")
+
+    # Set Restart =================================================================================================================================
+    def restart(self):
+        with self.lock:
+            if self.restarting:
+                return
+            self.restarting = True
+            keys = list(self.sockets)
+            fds = [self.sockets[key].fileno() for key in keys]
+
+        path = os.path.join(tempfile.gettempdir(), f"ivi-handoff-{self.system}-{os.getpid()}.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        successor = None
+        handed_over = False
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+            listener.bind(path)
+            listener.listen(1)
+            listener.settimeout(HANDOFF_TIMEOUT)
+
+            env = dict(os.environ, **{HANDOFF_ENV: path})
+            successor = subprocess.Popen([sys.executable] + sys.argv, env=env)
+            self.logger.message("INFO", "lifecycle", f"Restart: successor pid {successor.pid}, handing over {keys}")
+
+            conn, _ = listener.accept()
+            conn.settimeout(HANDOFF_TIMEOUT)
+            send_fds(conn, [json.dumps(keys).encode('utf-8')], fds)
+            request = conn.recv(16)
+            if request == b'RELEASE':
+                # the successor opens the same stores: stop, drain and close them here first
+                self.release()
+                conn.sendall(b'RELEASED')
+                request = conn.recv(16)
+            if request != b'READY':
+                raise OSError("successor closed the handoff before it was ready")
+            conn.close()
+            handed_over = True
+        except Exception as e:
+            if self.released:
+                # loops and stores are already closed; the successor holds the sockets or nobody serves them
+                self.logger.message("ERROR", "lifecycle", f"Restart failed after the stores were released: {e}")
+                self.shutdown(1)
+            self.logger.message("ERROR", "lifecycle", f"Restart failed, this process keeps serving: {e}")
+            if successor is not None and successor.poll() is None:
+                successor.terminate()
+            return
+        finally:
+            listener.close()
+            if os.path.exists(path):
+                os.unlink(path)
+            if not handed_over:
+                # a later SIGUSR2 can try again
+                with self.lock:
+                    self.restarting = False
+
+        self.logger.message("INFO", "lifecycle", f"Successor {successor.pid} ready")
+        self.shutdown()
+
+    def release(self):
+        """Stop reading, let the handler running in each loop finish, run the exit hooks and unlock the stores."""
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        start = time.monotonic()
+        stoppers = [threading.Thread(target=stop, args=(DRAIN_TIMEOUT,), daemon=True) for stop in self.servers]
+        for stopper in stoppers:
+            stopper.start()
+        for stopper in stoppers:
+            stopper.join(max(DRAIN_TIMEOUT - (time.monotonic() - start), 0))
+        for hook in self.exit_hooks:
+            try:
+                hook()
+            except Exception as e:
+                self.logger.message("ERROR", "lifecycle", f"Exit hook failed: {e}")
+        for fd in self.locks:
+            os.close(fd)
+        self.locks = []
+        self.logger.message("INFO", "lifecycle", f"Stopped after {(time.monotonic() - start) * 1000:.0f} ms drain (pid {os.getpid()})")
+
+    def shutdown(self, code=0):
+        # flush and exit; a restart may have released the stores already
+        self.release()
+        sys.stdout.flush()
+        self.logger.flush()
+        # server and worker threads are not daemons; leave without joining them
+        os._exit(code)
+
+
+# Benchmark: packet loss while a role restarts under load ===========================================================================================
+def bench_role(port, collector_port, handoff):
+    # minimal role: a UDP_Control server reporting the sequence number of every packet it handles
+    from logger import Logger
+    from udpControl import UDP_Control
+
+    logger = Logger('ERROR', 'BENCH', 'UDP')
+    collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udpControl = UDP_Control('BENCH', '127.0.0.1', port, logger)
+    if handoff:
+        lifecycle = Lifecycle('BENCH', logger)
+        lifecycle.install()
+        udpControl.lifecycle = lifecycle
+    threading.Thread(target=udpControl.udp_server, args=(lambda data: collector.sendto(data[-4:], ('127.0.0.1', collector_port)),)).start()
+    collector.sendto(b'PID' + str(os.getpid()).encode(), ('127.0.0.1', collector_port))
+    if handoff:
+        lifecycle.ready()
+
+
+def benchmark(rate, duration, port):
+    import struct
+    from packet import ProtocolPacket, SourceDestID, ServiceID, IFTID, IFT_12_01_Type
+
+    for label, handoff in (('kill + start', False), ('SIGUSR2 handoff', True)):
+        collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        collector.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+        collector.bind(('127.0.0.1', 0))
+        collector.settimeout(0.001)
+        collector_port = collector.getsockname()[1]
+        command = [sys.executable, os.path.abspath(__file__), '--bench_role', str(port), str(collector_port)] + (['--handoff'] if handoff else [])
+        role = subprocess.Popen(command)
+        pids = []
+        received = set()
+
+        def collect(until):
+            while time.monotonic() < until:
+                try:
+                    data = collector.recv(64)
+                except socket.timeout:
+                    continue
+                if data.startswith(b'PID'):
+                    pids.append(int(data[3:]))
+                else:
+                    received.add(struct.unpack('!I', data)[0])
+
+        collect(time.monotonic() + 2.0)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        packet = ProtocolPacket(SourceDestID.D_IVI.value, SourceDestID.CCU.value, ServiceID.D_IVI_CONTROL.value, 0,
+                                IFTID.IFT_12_01.value, IFT_12_01_Type.TYPE_0001.value)
+        count = int(rate * duration)
+        start = time.monotonic()
+        restarted = None
+        for seq in range(count):
+            packet.add_payload_data(struct.pack('!I', seq))
+            sender.sendto(packet.pack(), ('127.0.0.1', port))
+            if restarted is None and seq >= count // 2:
+                restarted = time.monotonic()
+                if handoff:
+                    os.kill(pids[0], signal.SIGUSR2)
+                else:
+                    role.kill()
+                    role.wait()
+                    role = subprocess.Popen(command)
+            collect(start + (seq + 1) / rate)
+        collect(time.monotonic() + 2.0)
+
+        lost = count - len(received)
+        lost_seqs = sorted(set(range(count)) - received)
+        window = f", lost seq {lost_seqs[0]}..{lost_seqs[-1]}" if lost_seqs else ""
+        print(f"{label:<16} {count} sent at {rate}/s, {len(received)} handled, {lost} lost ({lost * 100 / count:.2f}%){window}, "
+              f"pids {pids}")
+        for pid in pids[1:] if handoff else []:
+            os.kill(pid, signal.SIGTERM)
+        role.terminate()
+        time.sleep(1.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Restart packet loss benchmark')
+    parser.add_argument('--rate', default=2000, type=int, help='Packets per second')
+    parser.add_argument('--duration', default=4.0, type=float, help='Seconds of traffic (the restart is at half time)')
+    parser.add_argument('--port', default=47500, type=int, help='Port of the benchmark role')
+    parser.add_argument('--bench_role', nargs=2, type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--handoff', action='store_true', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.bench_role:
+        bench_role(args.bench_role[0], args.bench_role[1], args.handoff)
+    else:
+        benchmark(args.rate, args.duration, args.port)
+
+# python3 lifecycle.py --rate 2000 --duration 4
@@ -0,0 +1,222 @@
+# logAnalyzer.py
+# The logAnalyzer.py file contains the offline analyzer for Logger output: it joins the send and receive lines of
+# every role (CCU, D-IVI, P-IVI, ...) by packet bytes and reports per-hop latency percentiles and throughput over time.
+# Log lines look like [<time_ns>:<SYSTEM>:<OPERATION>:<PROTOCOL>]-<data>; the hop events come from UDP_Control:
+# - SEND:     [<dest ip>:<dest port>] <packet bytes>   (or [local:<ip>:<port>] for in-process delivery;
+#             [suppressed:<ip>:<port>] lines are packets the suppressor dropped and are skipped)
+# - RECEIVED: [<source ip>] <packet bytes>             (or [local], [<ip>:GROUP])
+# Files are split into byte ranges parsed by a process pool; lines are parsed with bytes.find/split, no regex.
+# Each range's events are sorted and spilled to a file of fixed-size records; the merge streams the spill files,
+# so memory is bounded by the range size and the packets still in flight, not by the size of the logs.
+# Latencies between logs of different hosts include their clock offset.
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from array import array
+from collections import deque
+from operator import itemgetter
+
+CHUNK_BYTES = 64 * 1024 * 1024     # byte range per parse task
+SPILL_READ = 1 << 16               # spill records read at a time per range during the merge
+KIND_SEND = 0
+KIND_RECEIVED = 1
+
+# spill record: time_ns, packet key, kind, system (index into the range's systems)
+SPILL_RECORD = struct.Struct('<qQBH')
+
+
+def packet_key(data):
+    # 64-bit key stable across worker processes (hash() of bytes is salted per process)
+    return zlib.crc32(data) << 32 | zlib.adler32(data)
+
+
+def parse_line(line):
+    """(time_ns, system, kind, packet key) for a hop event line, else None."""
+    header_end = line.find(b']-', 0, 128)
+    if header_end < 0 or line[0] != 0x5B:     # '['
+        return None
+    # cheap rejection of every other operation before splitting the header
+    if line.find(b':SEND:', 0, header_end) >= 0:
+        kind = KIND_SEND
+    elif line.find(b':RECEIVED:', 0, header_end) >= 0:
+        kind = KIND_RECEIVED
+    else:
+        return None
+    fields = line[1:header_end].split(b':', 3)
+    if len(fields) != 4:
+        return None
+
+    # data: [endpoint] b'...'; role-level SEND lines (DEST:..., packet : ...) have no endpoint and are skipped
+    data_start = header_end + 2
+    if line[data_start:data_start + 1] != b'[' or line.startswith(b'[suppressed:', data_start):
+        return None
+    packet_start = line.find(b'] ', data_start) + 2
+    if packet_start < 2 or line[packet_start:packet_start + 1] != b'b':
+        return None
+    try:
+        time_ns = int(fields[0])
+    except ValueError:
+        return None
+    return time_ns, fields[1], kind, packet_key(line[packet_start:].rstrip(b'\r\n'))
+
+
+def parse_range(path, start, end, spill_path):
+    """Parse the lines starting in [start, end) of one file into (time_ns, system index, kind, key) events sorted by
+    time, spilled to spill_path. Returns (spill_path, systems, lines)."""
+    systems = {}
+    events = []
+    lines = 0
+    with open(path, 'rb') as f:
+        if start > 0:
+            # the line crossing the range start belongs to the previous range; reading from the byte before the
+            # start skips only that line's rest, so a line starting exactly at the range start stays in this range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            lines += 1
+            event = parse_line(line)
+            if event is not None:
+                system = systems.get(event[1])
+                if system is None:
+                    system = systems[event[1]] = len(systems)
+                events.append((event[0], system, event[2], event[3]))
+
+    # one role's log is written in time order, so this sort is close to linear
+    events.sort(key=itemgetter(0))
+    pack = SPILL_RECORD.pack
+    with open(spill_path, 'wb') as f:
+        f.write(b''.join(pack(time_ns, key, kind, system) for time_ns, system, kind, key in events))
+    return spill_path, [name.decode('utf-8', 'replace') for name in systems], lines
+
+
+def parse_task(task):
+    return parse_range(*task)
+
+
+def read_spill(spill_path, systems):
+    """(time_ns, system, kind, key) events of one spill file, in time order, read SPILL_READ records at a time."""
+    with open(spill_path, 'rb') as f:
+        while True:
+            block = f.read(SPILL_RECORD.size * SPILL_READ)
+            if not block:
+                return
+            for time_ns, key, kind, system in SPILL_RECORD.iter_unpack(block):
+                yield time_ns, systems[system], kind, key
+
+
+def split_ranges(paths, chunk_bytes=CHUNK_BYTES):
+    ranges = []
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_bytes):
+            ranges.append((path, start, min(start + chunk_bytes, size)))
+    return ranges
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Hop_Analyzer:
+    def __init__(self, bucket_s=1.0):
+        self.bucket_ns = int(bucket_s * 1e9)
+        self.pending = {}       # packet key -> deque of (send time, sender)
+        self.latencies = {}     # hop -> array of ns
+        self.throughput = {}    # hop -> {bucket: packets}
+        self.unmatched_received = 0
+
+    def add(self, event):
+        time_ns, system, kind, key = event
+        if kind == KIND_SEND:
+            self.pending.setdefault(key, deque()).append((time_ns, system))
+            return
+
+        # the earliest send of the same bytes by another role
+        sends = self.pending.get(key)
+        if not sends:
+            self.unmatched_received += 1
+            return
+        for index, (send_ns, sender) in enumerate(sends):
+            if sender != system:
+                del sends[index]
+                break
+        else:
+            self.unmatched_received += 1
+            return
+        if not sends:
+            del self.pending[key]
+
+        hop = f"{sender}->{system}"
+        latencies = self.latencies.get(hop)
+        if latencies is None:
+            latencies = self.latencies[hop] = array('q')
+        latencies.append(time_ns - send_ns)
+        buckets = self.throughput.setdefault(hop, {})
+        bucket = time_ns // self.bucket_ns
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def unmatched_sent(self):
+        return sum(len(sends) for sends in self.pending.values())
+
+    def report(self):
+        print(f"{'hop':<32} {'packets':>9} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'max us':>10}")
+        for hop in sorted(self.latencies):
+            values = sorted(self.latencies[hop])
+            print(f"{hop:<32} {len(values):9d} {percentile(values, 0.5) / 1000:10.1f} {percentile(values, 0.9) / 1000:10.1f} "
+                  f"{percentile(values, 0.99) / 1000:10.1f} {values[-1] / 1000:10.1f}")
+        print(f"unmatched: {self.unmatched_sent()} sent (lost or receiver not logged), {self.unmatched_received} received")
+
+        bucket_s = self.bucket_ns / 1e9
+        print(f"\nthroughput (packets/s per {bucket_s:g} s bucket)")
+        for hop in sorted(self.throughput):
+            buckets = self.throughput[hop]
+            first = min(buckets)
+            series = [buckets.get(bucket, 0) / bucket_s for bucket in range(first, max(buckets) + 1)]
+            print(f"{hop:<32} from {first * self.bucket_ns}: " + " ".join(f"{rate:.0f}" for rate in series))
+
+
+def main(args):
+    start_ns = time.perf_counter_ns()
+    ranges = split_ranges(args.logs, args.chunk_mb * 1024 * 1024)
+    spill_dir = tempfile.mkdtemp(prefix='log-analyzer-', dir=args.spill_dir)
+    try:
+        tasks = [(path, start, end, os.path.join(spill_dir, f"{index}.events")) for index, (path, start, end) in enumerate(ranges)]
+        with multiprocessing.Pool(min(args.workers, len(ranges)) or 1) as pool:
+            parsed = list(pool.imap(parse_task, tasks))
+
+        analyzer = Hop_Analyzer(args.bucket)
+        for event in heapq.merge(*(read_spill(spill_path, systems) for spill_path, systems, _ in parsed)):
+            analyzer.add(event)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    lines = sum(count for _, _, count in parsed)
+    size = sum(os.path.getsize(path) for path in args.logs)
+    elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9
+    analyzer.report()
+    print(f"\n{lines} lines, {size / 1e6:.1f} MB in {len(ranges)} ranges, {elapsed_s:.2f} s ({size / 1e6 / elapsed_s:.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-hop latency and throughput from CCU/D-IVI/P-IVI logs')
+    parser.add_argument('logs', nargs='+', help='Log files (Logger output of each role)')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int, help='Parse processes')
+    parser.add_argument('--bucket', default=1.0, type=float, help='Throughput bucket in seconds')
+    parser.add_argument('--chunk_mb', default=CHUNK_BYTES // (1024 * 1024), type=int, help='MB of log per parse task')
+    parser.add_argument('--spill_dir', default=None, help='Directory for the parsed events of each range (default: system temp)')
+
+    args = parser.parse_args()
+    main(args)
+
+# python3 logAnalyzer.py ccu.log d-ivi.log p-ivi-1.log --bucket 1
@@ -4,8 +4,19 @@
 # - debug_level: The debug level for the service
 # - protocol: The protocol used by the service
 # - log_file: The file to which the logs are written
+# - max_bytes: Size at which the log file is rotated; closed segments are gzipped in the background, the newest
+#   backups kept
+# - policies: Per-operation Log_Policy (sampling, rate limit, truncation), e.g. loaded from logging.yaml
 
+import argparse
+import glob
+import gzip
 import inspect
+import os
+import queue
+import shutil
+import tempfile
+import threading
 import time
 from datetime import datetime
 
@@ -17,40 +28,221 @@ DEBUG_LEVELS = {
     'CRITICAL': 4
 }
 
+LOG_BACKUPS = 10            # gzipped segments kept per log file
+FLUSH_INTERVAL = 1.0        # seconds a line may wait in the file buffer (WARNING and above are flushed at once)
+FILE_BUFFER = 1 << 16
+SUMMARY_INTERVAL = 1.0      # seconds between "suppressed N messages" lines of a rate-limited operation
+
+
+class Log_Policy:
+    __slots__ = ('sample', 'rate', 'burst', 'truncate', 'count', 'tokens', 'stamp', 'suppressed', 'since')
+
+    def __init__(self, sample=1, rate=None, burst=None, truncate=None):
+        self.sample = int(sample or 1)
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst or rate or 1)
+        self.truncate = int(truncate) if truncate else None
+        self.count = 0
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.suppressed = 0         # rate-limited messages not yet reported
+        self.since = self.stamp
+
+    def admit(self, now):
+        """True if the message is logged: 1 in sample messages, within the rate limit."""
+        self.count += 1
+        if self.sample > 1 and self.count % self.sample:
+            return False
+        if self.rate is not None:
+            tokens = self.tokens + (now - self.stamp) * self.rate
+            self.tokens = tokens if tokens < self.burst else self.burst
+            self.stamp = now
+            if self.tokens < 1.0:
+                if not self.suppressed:
+                    self.since = now
+                self.suppressed += 1
+                return False
+            self.tokens -= 1.0
+        return True
+
+
 class Logger:
-    def __init__(self, debug_level='INFO', system=None, protocol='UDP', debug_devlop=False, log_console=True, log_file=None):
+    def __init__(self, debug_level='INFO', system=None, protocol='UDP', debug_devlop=False, log_console=True, log_file=None,
+                 max_bytes=None, backups=LOG_BACKUPS, policies=None):
         self.debug_level = debug_level
         self.system = system
         self.protocol = protocol
         self.log_file = log_file
         self.log_console = log_console
         self.debug_devlop = debug_devlop
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.policies = {operation.upper(): policy for operation, policy in (policies or {}).items()}
+        self.file = None
+        self.file_size = 0
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+        self.compress_queue = None
+        self.stats = {'lines': 0, 'bytes': 0, 'rotations': 0}
         self.message(debug_level, protocol, f"Debug level: {self.debug_level}:{self.debug_devlop}")
 
     def set_debug_level(self, debug_level):
         self.debug_level = debug_level
 
+    def set_policy(self, operation, policy):
+        self.policies[operation.upper()] = policy
+
+    def load_policies(self, path):
+        import yaml     # only needed with a policy file
+
+        with open(path, 'r') as file:
+            config = yaml.safe_load(file) or {}
+        for operation, entry in (config.get('policies') or {}).items():
+            self.set_policy(operation, Log_Policy(**entry))
+        self.message("INFO", "log", f"Loaded {len(self.policies)} log policies from {path}")
+
     def message(self, debug, operation, data):
+        if DEBUG_LEVELS.get(debug, 1) < DEBUG_LEVELS.get(self.debug_level, 1):
+            return
+        operation = operation.upper()
+
+        policy = self.policies.get(operation) if self.policies else None
+        if policy is not None:
+            now = time.monotonic()
+            if not policy.admit(now):
+                return
+            if policy.suppressed and now - policy.since >= SUMMARY_INTERVAL:
+                self.emit(debug, f"[{time.time_ns()}:{self.system.upper()}:{operation}:{self.protocol}]-"
+                                 f"suppressed {policy.suppressed} messages in {now - policy.since:.1f} s")
+                policy.suppressed = 0
+            if policy.truncate:
+                data = str(data)
+                if len(data) > policy.truncate:
+                    data = f"{data[:policy.truncate]}...[{len(data)} chars]"
+
         # Get current timestamp (nanoseconds)
         #timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
         #timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') + f".{datetime.now().microsecond:06d}{time.time_ns() % 1000:03d}"
         timestamp = time.time_ns()
 
-        message = f"[{timestamp}:{self.system.upper()}:{operation.upper()}:{self.protocol}]-{data}"
+        message = f"[{timestamp}:{self.system.upper()}:{operation}:{self.protocol}]-{data}"
+
+        if self.debug_devlop is True:
+            # file name, function name, line number
+            frame = inspect.currentframe()
+            caller_frame = frame.f_back
+            file_name = caller_frame.f_code.co_filename
+            function_name = caller_frame.f_code.co_name
+            line_number = caller_frame.f_lineno
+            message = f"[{timestamp}] [{file_name}][{function_name}][{line_number}] {debug.upper()} {self.protocol} : {data}"
+
+        self.emit(debug, message)
+
+    def emit(self, debug, message):
+        if self.log_console is True:
+            print(message)
+
+        if self.log_file is not None:
+            self.write(message + '\n', DEBUG_LEVELS.get(debug, 1) >= DEBUG_LEVELS['WARNING'])
+
+    # Set Log file ================================================================================================================================
+    def write(self, line, urgent=False):
+        with self.lock:
+            if self.file is None:
+                self.open_file()
+            self.file.write(line)
+            self.file_size += len(line)
+            self.stats['lines'] += 1
+            self.stats['bytes'] += len(line)
+            now = time.monotonic()
+            if urgent or now - self.flushed >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed = now
+            if self.max_bytes and self.file_size >= self.max_bytes:
+                self.rotate()
+
+    def open_file(self):
+        self.file = open(self.log_file, 'a', buffering=FILE_BUFFER)
+        self.file_size = self.file.tell()
+        if self.max_bytes and self.compress_queue is None:
+            self.compress_queue = queue.SimpleQueue()
+            threading.Thread(target=self.compress_loop, daemon=True).start()
+            # segments a previous run closed but did not get to compress
+            for segment in sorted(glob.glob(glob.escape(self.log_file) + '.*')):
+                if segment.rsplit('.', 1)[1].isdigit():
+                    self.compress_queue.put(segment)
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        segment = f"{self.log_file}.{time.time_ns()}"
+        os.rename(self.log_file, segment)
+        self.compress_queue.put(segment)
+        self.stats['rotations'] += 1
+
+    def compress_loop(self):
+        while True:
+            segment = self.compress_queue.get()
+            try:
+                with open(segment, 'rb') as source, gzip.open(segment + '.gz.tmp', 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, FILE_BUFFER)
+                os.replace(segment + '.gz.tmp', segment + '.gz')
+                os.remove(segment)
+                for expired in sorted(glob.glob(glob.escape(self.log_file) + '.*.gz'))[:-self.backups or None]:
+                    os.remove(expired)
+            except OSError as e:
+                print(f"Log segment {segment} not compressed: {e}")
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                self.flushed = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# Benchmark: log cost per received packet under each policy ========================================================================================
+def benchmark(count, payload_size):
+    payload = bytes(range(256)) * (payload_size // 256 + 1)
+    payload = payload[:payload_size]
+    directory = tempfile.mkdtemp()
+    policies = (('unlimited', {}),
+                ('truncate 64', {'truncate': 64}),
+                ('sample 1/100', {'sample': 100}),
+                ('rate 1000/s', {'rate': 1000, 'burst': 100}),
+                ('level WARNING', None))
+    print(f"{count} packets, {payload_size} B payload, 3 log lines per packet (Received + process), file only, "
+          f"rotation at 8 MB into {directory}")
+    for label, policy in policies:
+        log_file = os.path.join(directory, label.replace(' ', '_').replace('/', '_') + '.log')
+        logger = Logger('WARNING' if policy is None else 'INFO', 'BENCH', 'UDP', log_console=False, log_file=log_file,
+                        max_bytes=8 << 20, backups=count)
+        if policy:
+            for operation in ('Received', 'process'):
+                logger.set_policy(operation, Log_Policy(**policy))
+        start = time.perf_counter_ns()
+        for index in range(count):
+            # the lines udp_deliver and process_message write for every packet
+            logger.message("INFO", "Received", f"[127.0.0.1] {payload}")
+            logger.message("INFO", "process", f"SRC:D-IVI:DEST:CCU:SID:D-IVI Control:{index}")
+            logger.message("INFO", "process", f"service_payload_data : {payload}")
+        elapsed_ns = time.perf_counter_ns() - start
+        logger.close()
+        print(f"{label:<14} {elapsed_ns / count / 1000:7.2f} us/packet, {logger.stats['lines'] / count:5.2f} lines and "
+              f"{logger.stats['bytes'] / count:7.1f} B/packet written, {logger.stats['rotations']} rotations")
+
 
-        if DEBUG_LEVELS.get(debug, 1) >= DEBUG_LEVELS.get(self.debug_level, 1):
-            if self.debug_devlop is True:
-                # file name, function name, line number
-                frame = inspect.currentframe()
-                caller_frame = frame.f_back
-                file_name = caller_frame.f_code.co_filename
-                function_name = caller_frame.f_code.co_name
-                line_number = caller_frame.f_lineno
-                message = f"[{timestamp}] [{file_name}][{function_name}][{line_number}] {debug.upper()} {self.protocol} : {data}"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Log cost per packet under each logging policy')
+    parser.add_argument('--count', default=100000, type=int, help='Packets')
+    parser.add_argument('--payload', default=200, type=int, help='Payload bytes per packet')
 
-            if self.log_console is True:
-                print(message)
+    args = parser.parse_args()
+    benchmark(args.count, args.payload)
 
-            if self.log_file is not None:
-                with open(self.log_file, 'a') as file:
-                    file.write(message + '\n')
+# python3 logger.py --count 200000 --payload 200
@@ -0,0 +1,301 @@
+# mediaTopK.py
+# The mediaTopK.py file contains the streaming heavy-hitters aggregation behind the Cloud passenger recommendations
+# (IFT_23_02): every media usage report of TYPE_0002 counts one play of a content title, globally and for its
+# passenger, and TYPE_0004 "Top10" answers come from these counts.
+# Counting is Space-Saving with a Stream-Summary (counters grouped in buckets by count), so an update is O(1) and
+# memory is bounded by the number of counters: a title outside the counters replaces one with the minimum count and
+# inherits that count as its error. Counts overestimate by at most error <= plays / capacity. Summaries of shards
+# (worker processes, ingest nodes) merge into one with the same bound.
+# The classes contain the following attributes:
+# - Space_Saving: counters of one stream; update(item), top(k) -> [(item, count, error)], merge(other)
+# - Media_TopK: the global summary and one small summary per passenger, the least recently active passengers
+#   evicted beyond max_passengers
+# - stats: reports counted, passengers evicted, undecodable reports
+
+import argparse
+import heapq
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from operator import itemgetter
+from packet import *
+from payloadSchema import SCHEMA_REGISTRY
+
+TOP_COUNT = 10                  # titles per Top-K answer (IFT_23_02 TYPE_0004 "Top10")
+GLOBAL_CAPACITY = 4096          # counters of the fleet-wide summary
+PASSENGER_CAPACITY = 64         # counters per passenger
+MAX_PASSENGERS = 2048           # passenger summaries kept (least recently active evicted); a full 64-counter
+                                # summary takes 14-25 KB, so at most about 50 MB at this bound
+STATS_INTERVAL = 10.0           # seconds between Top-K log lines
+
+
+class Space_Saving:
+    __slots__ = ('capacity', 'counts', 'errors', 'buckets', 'min_count', 'total')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}        # item -> count (upper bound of its true count)
+        self.errors = {}        # item -> overestimation bound
+        self.buckets = {}       # count -> {item: None}, insertion ordered
+        self.min_count = 0
+        self.total = 0          # items seen
+
+    def update(self, item):
+        self.total += 1
+        counts = self.counts
+        buckets = self.buckets
+        count = counts.get(item)
+        if count is not None:
+            bucket = buckets[count]
+            del bucket[item]
+            if not bucket:
+                del buckets[count]
+                if count == self.min_count:
+                    self.min_count = count + 1
+        elif len(counts) < self.capacity:
+            count = 0
+            self.errors[item] = 0
+            self.min_count = 1
+        else:
+            # replace the oldest counter with the minimum count
+            count = self.min_count
+            bucket = buckets[count]
+            victim = next(iter(bucket))
+            del bucket[victim]
+            del counts[victim]
+            del self.errors[victim]
+            self.errors[item] = count
+            if not bucket:
+                del buckets[count]
+                self.min_count = count + 1
+        counts[item] = count + 1
+        bucket = buckets.get(count + 1)
+        if bucket is None:
+            bucket = buckets[count + 1] = {}
+        bucket[item] = None
+
+    def top(self, k=TOP_COUNT):
+        """The k items with the highest counts as (item, count, error), highest first."""
+        errors = self.errors
+        return [(item, count, errors[item]) for item, count in heapq.nlargest(k, self.counts.items(), key=itemgetter(1))]
+
+    def guaranteed(self, k=TOP_COUNT):
+        """Number of leading top(k) items certain to be among the true top k (count - error above the next count)."""
+        top = self.top(k + 1)
+        bound = top[k][1] if len(top) > k else self.min_count if len(self.counts) >= self.capacity else 0
+        guaranteed = 0
+        for item, count, error in top[:k]:
+            if count - error < bound:
+                break
+            guaranteed += 1
+        return guaranteed
+
+    def merge(self, other):
+        """Fold another summary in: an item missing from a full summary may have up to its minimum count there."""
+        own_floor = self.min_count if len(self.counts) >= self.capacity else 0
+        other_floor = other.min_count if len(other.counts) >= other.capacity else 0
+        merged = []
+        for item in self.counts.keys() | other.counts.keys():
+            merged.append((self.counts.get(item, own_floor) + other.counts.get(item, other_floor), item,
+                           self.errors.get(item, own_floor) + other.errors.get(item, other_floor)))
+        self.rebuild(heapq.nlargest(self.capacity, merged, key=itemgetter(0)))
+        self.total += other.total
+        return self
+
+    def rebuild(self, entries):
+        self.counts = {}
+        self.errors = {}
+        self.buckets = {}
+        for count, item, error in sorted(entries, key=itemgetter(0)):
+            self.counts[item] = count
+            self.errors[item] = error
+            self.buckets.setdefault(count, {})[item] = None
+        self.min_count = min(self.buckets) if self.buckets else 0
+
+    def copy(self):
+        summary = Space_Saving(self.capacity)
+        summary.rebuild([(count, item, self.errors[item]) for item, count in self.counts.items()])
+        summary.total = self.total
+        return summary
+
+
+class Media_TopK:
+    def __init__(self, capacity=GLOBAL_CAPACITY, passenger_capacity=PASSENGER_CAPACITY, max_passengers=MAX_PASSENGERS, logger=None):
+        self.capacity = capacity
+        self.passenger_capacity = passenger_capacity
+        self.max_passengers = max_passengers
+        self.logger = logger
+        self.overall = Space_Saving(capacity)
+        self.passengers = OrderedDict()     # passenger_id -> Space_Saving, least recently active first
+        self.stats = {'reports': 0, 'passengers_evicted': 0, 'undecodable': 0}
+        self.reported = time.monotonic()
+
+    # Set Update ==================================================================================================================================
+    def add(self, passenger_id, content_id):
+        self.stats['reports'] += 1
+        self.overall.update(content_id)
+        passengers = self.passengers
+        summary = passengers.get(passenger_id)
+        if summary is None:
+            summary = passengers[passenger_id] = Space_Saving(self.passenger_capacity)
+            if len(passengers) > self.max_passengers:
+                passengers.popitem(last=False)
+                self.stats['passengers_evicted'] += 1
+        else:
+            passengers.move_to_end(passenger_id)
+        summary.update(content_id)
+
+    def add_packets(self, packets):
+        """Count the media usage reports (IFT_23_02 TYPE_0002) among ProtocolPackets; others are ignored."""
+        ift_id = IFTID.IFT_23_02.value
+        ift_type = IFT_23_02_Type.TYPE_0002.value
+        for packet in packets:
+            if packet.ift_id != ift_id or packet.ift_type != ift_type:
+                continue
+            record = SCHEMA_REGISTRY.decode(ift_id, ift_type, packet.payload_data)
+            if record is None:
+                self.stats['undecodable'] += 1
+                continue
+            self.add(record['passenger_id'], record['content_id'])
+        self.report_if_due()
+
+    # Set Query ===================================================================================================================================
+    def top(self, passenger_id=None, k=TOP_COUNT):
+        """Top k titles as (content_id, plays, error) of a passenger, or of the whole fleet for None."""
+        if passenger_id is None:
+            return self.overall.top(k)
+        summary = self.passengers.get(passenger_id)
+        return summary.top(k) if summary is not None else []
+
+    def merge(self, other):
+        """Fold the summaries of another shard in."""
+        self.overall.merge(other.overall)
+        for passenger_id, summary in other.passengers.items():
+            own = self.passengers.get(passenger_id)
+            if own is None:
+                self.passengers[passenger_id] = summary.copy()
+            else:
+                own.merge(summary)
+                self.passengers.move_to_end(passenger_id)
+        while len(self.passengers) > self.max_passengers:
+            self.passengers.popitem(last=False)
+            self.stats['passengers_evicted'] += 1
+        self.stats['reports'] += other.stats['reports']
+        return self
+
+    def report_if_due(self):
+        now = time.monotonic()
+        if self.logger is not None and self.stats['reports'] and now - self.reported >= STATS_INTERVAL:
+            self.reported = now
+            top = ", ".join(f"{content_id}: {count}" for content_id, count, _ in self.top())
+            self.logger.message("INFO", "topk", f"passengers: {len(self.passengers)}, " +
+                                ", ".join(f"{name}: {count}" for name, count in self.stats.items()) + f", top: {top}")
+
+
+# Benchmark: accuracy against memory on Zipf distributed plays =====================================================================================
+def zipf_stream(count, titles, passengers, skew, seed=5):
+    import numpy as np
+
+    # title popularity is Zipf over the catalogue; each passenger has a preference order of its own
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, titles + 1) ** skew
+    ranks = rng.choice(titles, count, p=weights / weights.sum())
+    passenger_ids = rng.integers(0, passengers, count)
+    shift = rng.integers(0, titles, passengers)
+    global_share = rng.random(count) < 0.5      # half the plays follow the fleet-wide chart
+    content = np.where(global_share, ranks, (ranks + shift[passenger_ids]) % titles)
+    return [(int(p), f"C{c:07d}") for p, c in zip(passenger_ids, content)]
+
+
+def accuracy(summary_top, exact, k):
+    # recall of the true top k, and the largest count error relative to the true count among them
+    true_top = [item for item, _ in exact.most_common(k)]
+    found = {item: count for item, count, _ in summary_top}
+    recall = sum(item in found for item in true_top) / max(len(true_top), 1)
+    error = max((abs(found[item] - exact[item]) / exact[item] for item in true_top if item in found), default=0.0)
+    return recall, error
+
+
+def summary_bytes(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+    return result, size
+
+
+def full_summary_bytes(capacity):
+    # one passenger summary with every counter in use, each title in a bucket of its own (the worst case)
+    def build():
+        summary = Space_Saving(capacity)
+        for index in range(capacity):
+            for _ in range(index + 1):
+                summary.update(f"C{index:07d}")
+        return summary
+    return summary_bytes(build)[1]
+
+
+def benchmark(count, titles, passengers, skew, k, max_passengers=MAX_PASSENGERS):
+    stream = zipf_stream(count, titles, passengers, skew)
+    exact = Counter(content_id for _, content_id in stream)
+    exact_by_passenger = {}
+    for passenger_id, content_id in stream:
+        exact_by_passenger.setdefault(passenger_id, Counter())[content_id] += 1
+    _, exact_bytes = summary_bytes(lambda: Counter(content_id for _, content_id in stream))
+    print(f"{count} plays of {titles} titles (Zipf s={skew}) by {passengers} passengers; exact global count: "
+          f"{len(exact)} titles, {exact_bytes / 1024:.0f} KiB")
+
+    print(f"{'global counters':<16} {'KiB':>8} {'updates/s':>11} {'recall@' + str(k):>10} {'max err':>8} {'guaranteed':>11} "
+          f"{'4 shards merged':>16}")
+    for capacity in (64, 256, 1024, 4096):
+        summary = Space_Saving(capacity)
+        start = time.perf_counter_ns()
+        for _, content_id in stream:
+            summary.update(content_id)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        recall, error = accuracy(summary.top(k), exact, k)
+
+        shards = [Space_Saving(capacity) for _ in range(4)]
+        for index, (_, content_id) in enumerate(stream):
+            shards[index % 4].update(content_id)
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged.merge(shard)
+        merged_recall, merged_error = accuracy(merged.top(k), exact, k)
+        _, size = summary_bytes(lambda: summary.copy())
+        print(f"{capacity:<16} {size / 1024:8.0f} {count / elapsed:11,.0f} {recall:10.0%} {error:8.2%} {summary.guaranteed(k):>8}/{k:<2} "
+              f"{merged_recall:9.0%}, {merged_error:.2%}")
+
+    print(f"{'per passenger':<16} {'KiB':>8} {'updates/s':>11} {'recall@' + str(k):>10} {'max err':>8}")
+    for passenger_capacity in (16, 32, 64, 128):
+        topk = Media_TopK(GLOBAL_CAPACITY, passenger_capacity, max_passengers)
+        start = time.perf_counter_ns()
+        for passenger_id, content_id in stream:
+            topk.add(passenger_id, content_id)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        _, size = summary_bytes(lambda: [summary.copy() for summary in topk.passengers.values()])
+        results = [accuracy(topk.top(passenger_id, k), exact_passenger, k) for passenger_id, exact_passenger in exact_by_passenger.items()]
+        print(f"{passenger_capacity:<16} {size / 1024:8.0f} {count / elapsed:11,.0f} "
+              f"{sum(r for r, _ in results) / len(results):10.0%} {max(e for _, e in results):8.2%}")
+
+    # what the passenger summaries can grow to: every summary full, max_passengers of them
+    print(f"{'per passenger':<16} {'full KiB':>8} {'at ' + str(max_passengers) + ' passengers':>24}")
+    for passenger_capacity in (16, 32, 64, 128):
+        size = full_summary_bytes(passenger_capacity)
+        print(f"{passenger_capacity:<16} {size / 1024:8.1f} {size * max_passengers / 2**20:20.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Media usage Top-K accuracy against memory benchmark')
+    parser.add_argument('--count', default=500000, type=int, help='Media usage reports')
+    parser.add_argument('--titles', default=100000, type=int, help='Content titles in the catalogue')
+    parser.add_argument('--passengers', default=1000, type=int, help='Passengers')
+    parser.add_argument('--skew', default=1.1, type=float, help='Zipf exponent of title popularity')
+    parser.add_argument('--k', default=TOP_COUNT, type=int, help='Titles per Top-K answer')
+    parser.add_argument('--max_passengers', default=MAX_PASSENGERS, type=int, help='Passenger summaries kept, for the memory bound')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.titles, args.passengers, args.skew, args.k, args.max_passengers)
+
+# python3 mediaTopK.py --count 500000 --titles 100000 --passengers 1000 --skew 1.1
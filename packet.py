@@ -52,6 +52,12 @@ class SourceDestID(LabeledEnum):
     P_IVI_1 = (0x06, "P-IVI-1")
     P_IVI_2 = (0x07, "P-IVI-2")
     CLOUD = (0x08, "Cloud")
+    P_IVI_ALL = (0x0F, "P-IVI-ALL")     # fan-out group: every P-IVI seat
+
+# Map the fan-out group IDs to their member seats
+GROUP_MEMBER_MAP = {
+    SourceDestID.P_IVI_ALL: [SourceDestID.P_IVI_1, SourceDestID.P_IVI_2]
+}
 
 # Define the service IDs
 class ServiceID(LabeledEnum):
@@ -251,6 +257,29 @@ SERVICE_IFT_ID_MAP = {
     ]
 }
 
+# P-IVI control requests the P-IVI answers: IFT ID -> {request IFT type: response IFT type}
+P_IVI_RESPONSE_TYPE_MAP = {
+    IFTID.IFT_12_01.value: {
+        IFT_12_01_Type.TYPE_0001.value: IFT_12_01_Type.TYPE_0002.value,
+        IFT_12_01_Type.TYPE_0003.value: IFT_12_01_Type.TYPE_0004.value,
+        IFT_12_01_Type.TYPE_0005.value: IFT_12_01_Type.TYPE_0006.value,
+    },
+    IFTID.IFT_12_02.value: {
+        IFT_12_02_Type.TYPE_0001.value: IFT_12_02_Type.TYPE_0002.value,
+    },
+    IFTID.IFT_12_03.value: {
+        IFT_12_03_Type.TYPE_0001.value: IFT_12_03_Type.TYPE_0002.value,
+        IFT_12_03_Type.TYPE_0003.value: IFT_12_03_Type.TYPE_0004.value,
+    },
+    IFTID.IFT_12_04.value: {
+        IFT_12_04_Type.TYPE_0001.value: IFT_12_04_Type.TYPE_0002.value,
+        IFT_12_04_Type.TYPE_0003.value: IFT_12_04_Type.TYPE_0004.value,
+    },
+    IFTID.IFT_12_05.value: {
+        IFT_12_05_Type.TYPE_0001.value: IFT_12_05_Type.TYPE_0002.value,
+    }
+}
+
 # ift id to service id map
 IFT_ID_SERVICE_ID_MAP = {
     IFTID.IFT_12_01: ServiceID.D_IVI_CONTROL,
@@ -0,0 +1,166 @@
+# packetValidator.py
+# The packetValidator.py file contains the Packet_Validator class, the validating decode stage of the receive loops:
+# every datagram is classified against tables built once from packet.py (valid SourceDestID bitmap, valid
+# service/message type and IFT ID/IFT type pairs) before a handler sees it. Malformed packets are classified
+# without raising, counted per reason and kept in a small quarantine for inspection; they never reach
+# process_message, where SourceDestID(x)/IFTID(x) would raise.
+# The class contains the following attributes:
+# - counters: Quarantined packets per reason
+# - quarantine: The last QUARANTINE_SIZE malformed packets (time, source, reason, first bytes)
+
+import argparse
+import struct
+import time
+from collections import deque
+from packet import *
+
+HEADER = struct.Struct('!BBHHHHH')
+HEADER_LEN = HEADER.size
+QUARANTINE_SIZE = 256       # malformed packets kept for inspection
+QUARANTINE_BYTES = 64       # bytes kept per quarantined packet
+STATS_INTERVAL = 10.0       # seconds between stats log lines while quarantining
+
+REASONS = ('short', 'truncated', 'trailing', 'unknown_source', 'unknown_dest', 'unknown_service',
+           'unknown_message_type', 'unknown_ift_id', 'unknown_ift_type')
+
+
+# Define the lookup tables ========================================================================================================================
+def build_tables():
+    valid_node = bytearray(256)
+    for member in SourceDestID:
+        valid_node[member.value] = 1
+
+    valid_service = bytearray(65536)
+    valid_message = set()
+    for service, message_types in SERVICE_MESSAGE_TYPE_MAP.items():
+        valid_service[service.value] = 1
+        valid_message.update(service.value << 16 | message_type.value for message_type in message_types)
+
+    # IFT IDs sharing a value (IFT_13_02/IFT_13_03) alias to one member: accept the types of every name
+    valid_ift = bytearray(65536)
+    valid_ift_type = set()
+    for name, member in IFTID.__members__.items():
+        valid_ift[member.value] = 1
+        type_enum = globals().get(name + '_Type')
+        if type_enum is not None:
+            valid_ift_type.update(member.value << 16 | ift_type.value for ift_type in type_enum)
+
+    no_ift_services = frozenset(service.value for service in ServiceID if service not in SERVICE_IFT_ID_MAP)
+    return bytes(valid_node), bytes(valid_service), frozenset(valid_message), bytes(valid_ift), frozenset(valid_ift_type), no_ift_services
+
+
+VALID_NODE, VALID_SERVICE, VALID_MESSAGE, VALID_IFT, VALID_IFT_TYPE, NO_IFT_SERVICES = build_tables()
+
+
+def classify(data):
+    """None for a well-formed packet, else the reason it is malformed. Never raises for bytes input."""
+    payload_length = len(data) - HEADER_LEN
+    if payload_length < 0:
+        return 'short'
+    source_id, dest_id, service_id, message_type, ift_id, ift_type, data_length = HEADER.unpack_from(data, 0)
+    if data_length != payload_length:
+        return 'truncated' if data_length > payload_length else 'trailing'
+    if not VALID_NODE[source_id]:
+        return 'unknown_source'
+    if not VALID_NODE[dest_id]:
+        return 'unknown_dest'
+    if (service_id << 16 | message_type) not in VALID_MESSAGE:
+        return 'unknown_message_type' if VALID_SERVICE[service_id] else 'unknown_service'
+    if (ift_id << 16 | ift_type) not in VALID_IFT_TYPE:
+        # services without IFTs (vehicle information, OTT, blockchain) may carry IFT 0/0
+        if ift_id == 0 and ift_type == 0 and service_id in NO_IFT_SERVICES:
+            return None
+        return 'unknown_ift_type' if VALID_IFT[ift_id] else 'unknown_ift_id'
+    return None
+
+
+class Packet_Validator:
+    def __init__(self, logger=None, quarantine_size=QUARANTINE_SIZE):
+        self.logger = logger
+        self.counters = dict.fromkeys(REASONS, 0)
+        self.quarantine = deque(maxlen=quarantine_size)
+        self.stats = {'valid': 0, 'quarantined': 0, 'handler_errors': 0}
+        self.reported = time.monotonic()
+
+    def validate(self, data, source=None):
+        """True if the packet may be handled; malformed packets are counted and quarantined."""
+        reason = classify(data)
+        if reason is None:
+            self.stats['valid'] += 1
+            return True
+        self.counters[reason] += 1
+        self.stats['quarantined'] += 1
+        self.quarantine.append((time.time_ns(), source, reason, bytes(data[:QUARANTINE_BYTES])))
+        if self.logger is not None:
+            self.logger.message("DEBUG", "quarantine", f"[{source}] {reason}: {bytes(data[:QUARANTINE_BYTES])}")
+        self.report_if_due()
+        return False
+
+    def handler_error(self, data, source, error):
+        # the handler raised on a packet that passed validation: keep the loop alive and record it
+        self.stats['handler_errors'] += 1
+        self.quarantine.append((time.time_ns(), source, f"handler: {error!r}", bytes(data[:QUARANTINE_BYTES])))
+        if self.logger is not None:
+            self.logger.message("ERROR", "handler", f"[{source}] {error!r} on {bytes(data[:QUARANTINE_BYTES])}")
+        self.report_if_due()
+
+    def report_if_due(self):
+        now = time.monotonic()
+        if now - self.reported >= STATS_INTERVAL:
+            self.report(now)
+
+    def report(self, now=None):
+        self.reported = time.monotonic() if now is None else now
+        if self.logger is not None:
+            reasons = ", ".join(f"{reason}: {count}" for reason, count in self.counters.items() if count)
+            self.logger.message("WARNING", "quarantine", f"valid: {self.stats['valid']}, quarantined: {self.stats['quarantined']} "
+                                                         f"({reasons or 'none'}), handler errors: {self.stats['handler_errors']}")
+
+
+# Benchmark: cost per packet of classify() against ProtocolPacket.unpack ==========================================================================
+def benchmark(count):
+    valid = ProtocolPacket(SourceDestID.D_IVI.value, SourceDestID.CCU.value, ServiceID.D_IVI_CONTROL.value,
+                           D_IVI_CONTROL_MESSAGE_TYPES.D_IVI_CONTROL_REQUEST.value, IFTID.IFT_12_03.value,
+                           IFT_12_03_Type.TYPE_0002.value)
+    valid.add_payload_data(b'0123456789' * 4)
+    valid_data = valid.pack()
+    cases = {
+        'valid': valid_data,
+        'short': valid_data[:7],
+        'truncated': valid_data[:-5],
+        'unknown_source': b'\x42' + valid_data[1:],
+        'unknown_ift_type': valid_data[:8] + b'\x00\x63' + valid_data[10:],
+    }
+    print(f"{'case':<18} {'classify ns':>12} {'unpack ns':>10}")
+    for label, data in cases.items():
+        assert classify(data) == (None if label == 'valid' else label), label
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            classify(data)
+        classify_ns = (time.perf_counter_ns() - start) / count
+
+        start = time.perf_counter_ns()
+        failed = 0
+        for _ in range(count):
+            try:
+                ProtocolPacket.unpack(data)
+            except struct.error:
+                failed += 1
+        unpack_ns = (time.perf_counter_ns() - start) / count
+        print(f"{label:<18} {classify_ns:12.0f} {unpack_ns:10.0f}" + (" (raises)" if failed else ""))
+
+    validator = Packet_Validator()
+    start = time.perf_counter_ns()
+    for index in range(count):
+        validator.validate(cases['valid'] if index % 10 else cases['truncated'], '127.0.0.1')
+    print(f"validate() with 10% malformed: {(time.perf_counter_ns() - start) / count:.0f} ns/packet, {validator.counters['truncated']} quarantined")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validating decoder benchmark')
+    parser.add_argument('--count', default=500000, type=int, help='Packets per case')
+
+    args = parser.parse_args()
+    benchmark(args.count)
+
+# python3 packetValidator.py --count 1000000
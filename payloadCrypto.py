@@ -0,0 +1,277 @@
+# payloadCrypto.py
+# The payloadCrypto.py file contains the payload encryption of the "[B] ... USB 내 키로 암호화" steps: ProtocolPacket
+# payloads are sealed with an AEAD cipher (ChaCha20-Poly1305 or AES-GCM) under a key derived per sender/receiver pair
+# from the master key on the USB token. The 12-byte header stays in clear for routing and is authenticated.
+# An encrypted payload is CRYPTO_MAGIC, session salt, counter, ciphertext + tag; the nonce is the counter.
+# Every process draws a new 16-byte salt, so a counter restarting at 0 is under a new key; a receiver rejects a
+# counter it has already accepted (or one older than the replay window) for the same source, dest and salt.
+# The classes contain the following attributes:
+# - sessions: (source, dest, salt) -> [AEAD, highest counter, replay bitmap], derived once with HKDF and cached
+#   after the first authenticated packet
+# - buffers: Per-thread packet buffer the header, envelope and ciphertext are written into
+# - pool: Worker threads for payloads above the offload threshold (seal_many/open_many)
+
+import argparse
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from packet import *
+
+CRYPTO_MAGIC = b'\xae\xad'
+HEADER = struct.Struct('!BBHHHHH')
+ENVELOPE = struct.Struct('!2s16sQ')     # magic, session salt, counter
+TAG_LEN = 16
+OVERHEAD = ENVELOPE.size + TAG_LEN
+OFFLOAD_BYTES = 16384       # payloads from this size are sealed/opened on the pool
+MAX_SESSIONS = 4096         # cached session keys
+REPLAY_WINDOW = 1024        # counters below the highest accepted one that are still checked for replays
+CIPHERS = {'chacha20': ChaCha20Poly1305, 'aesgcm': AESGCM}
+
+
+def load_key(path):
+    """Master key file: 32 raw bytes or 64 hex characters."""
+    with open(path, 'rb') as f:
+        key = f.read().strip()
+    if len(key) == 64:
+        key = bytes.fromhex(key.decode('ascii'))
+    if len(key) != 32:
+        raise ValueError(f"{path}: expected a 32-byte key")
+    return key
+
+
+def is_sealed(payload):
+    return payload is not None and len(payload) >= OVERHEAD and payload[:2] == CRYPTO_MAGIC
+
+
+class Packet_Crypto:
+    def __init__(self, master_key, dest_ids=(SourceDestID.CLOUD.value,), cipher='chacha20', threshold=OFFLOAD_BYTES,
+                 workers=2, logger=None):
+        self.master_key = master_key
+        self.dest_ids = frozenset(getattr(dest_id, 'value', dest_id) for dest_id in dest_ids)
+        self.cipher = CIPHERS[cipher]
+        self.threshold = threshold
+        self.logger = logger
+        self.salt = os.urandom(16)      # new session keys on every start, so counters may restart at 0
+        self.counters = {}              # (source, dest) -> next counter
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.buffers = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {'sealed': 0, 'opened': 0, 'rejected': 0, 'replayed': 0, 'derived': 0, 'offloaded': 0}
+
+    def session(self, source_id, dest_id, salt, store=True):
+        """AEAD of the session; with store=False a new one is not cached (receivers cache it once a packet authenticates)."""
+        key = (source_id, dest_id, salt)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions.move_to_end(key)
+                return session[0]
+        session_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'huconn-ivi' + bytes((source_id, dest_id)),
+                           backend=default_backend()).derive(self.master_key)
+        aead = self.cipher(session_key)
+        with self.lock:
+            self.stats['derived'] += 1
+            if store:
+                self.store(key, aead)
+        return aead
+
+    def store(self, key, aead):
+        # called with the lock held
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = [aead, -1, 0]
+            while len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+        return session
+
+    def accept(self, key, aead, counter):
+        """Record an authenticated counter in the session's replay window; False if it was seen or is too old."""
+        with self.lock:
+            session = self.store(key, aead)
+            highest, bitmap = session[1], session[2]
+            if counter > highest:
+                shift = counter - highest
+                session[1] = counter
+                session[2] = ((bitmap << shift) | 1) & ((1 << REPLAY_WINDOW) - 1) if shift < REPLAY_WINDOW else 1
+                return True
+            offset = highest - counter
+            if offset >= REPLAY_WINDOW or bitmap >> offset & 1:
+                return False
+            session[2] = bitmap | 1 << offset
+            return True
+
+    def buffer(self):
+        buffer = getattr(self.buffers, 'data', None)
+        if buffer is None:
+            buffer = self.buffers.data = bytearray(HEADER.size + MAX_PAYLOAD_LEN + OVERHEAD)
+        return buffer
+
+    def count(self, name, n=1):
+        # seal/open also run on the pool threads
+        with self.lock:
+            self.stats[name] += n
+
+    def next_counter(self, source_id, dest_id):
+        with self.lock:
+            counter = self.counters.get((source_id, dest_id), 0)
+            self.counters[(source_id, dest_id)] = counter + 1
+        return counter
+
+    # Set Seal ====================================================================================================================================
+    def seal(self, packet_data):
+        """Encrypted packet bytes for a packet to one of dest_ids, else the packet unchanged."""
+        source_id, dest_id, service_id, message_type, ift_id, ift_type, data_length = HEADER.unpack_from(packet_data, 0)
+        if dest_id not in self.dest_ids or data_length == 0:
+            return packet_data
+        length = data_length + OVERHEAD
+        if length > MAX_PAYLOAD_LEN:
+            raise ValueError(f"payload of {data_length} bytes too large to seal")
+
+        aead = self.session(source_id, dest_id, self.salt)
+        counter = self.next_counter(source_id, dest_id)
+        buffer = self.buffer()
+        view = memoryview(buffer)
+        HEADER.pack_into(buffer, 0, source_id, dest_id, service_id, message_type, ift_id, ift_type, length)
+        ENVELOPE.pack_into(buffer, HEADER.size, CRYPTO_MAGIC, self.salt, counter)
+        start = HEADER.size + ENVELOPE.size
+        end = HEADER.size + length
+        nonce = bytes(4) + buffer[start - 8:start]
+        plaintext = memoryview(packet_data)[HEADER.size:HEADER.size + data_length]
+        if hasattr(aead, 'encrypt_into'):
+            aead.encrypt_into(nonce, plaintext, bytes(view[:HEADER.size]), view[start:end])
+        else:
+            # cryptography < 45 allocates the ciphertext itself
+            view[start:end] = aead.encrypt(nonce, bytes(plaintext), bytes(view[:HEADER.size]))
+        self.count('sealed')
+        return bytes(view[:end])
+
+    def open(self, packet_data):
+        """Plaintext packet bytes; packets without an envelope are returned unchanged. Raises InvalidTag if forged."""
+        header = HEADER.unpack_from(packet_data, 0)
+        payload = memoryview(packet_data)[HEADER.size:HEADER.size + header[6]]
+        if not is_sealed(payload):
+            return packet_data
+        plaintext = self.open_payload(header, payload)
+        return HEADER.pack(*header[:6], len(plaintext)) + plaintext
+
+    def open_payload(self, header, payload):
+        _, salt, counter = ENVELOPE.unpack_from(payload, 0)
+        aead = self.session(header[0], header[1], salt, store=False)
+        try:
+            plaintext = aead.decrypt(bytes(4) + counter.to_bytes(8, 'big'), bytes(payload[ENVELOPE.size:]), HEADER.pack(*header))
+        except InvalidTag:
+            self.count('rejected')
+            raise
+        if not self.accept((header[0], header[1], salt), aead, counter):
+            # a replayed packet fails like a forged one
+            self.count('replayed')
+            raise InvalidTag()
+        self.count('opened')
+        return plaintext
+
+    # Set Batch ===================================================================================================================================
+    def seal_many(self, packets):
+        """Seal a list of packets in order; large payloads are encrypted on the pool while small ones run inline."""
+        results = [None] * len(packets)
+        futures = []
+        for index, packet_data in enumerate(packets):
+            if len(packet_data) - HEADER.size >= self.threshold:
+                futures.append((index, self.pool.submit(self.seal, packet_data)))
+            else:
+                results[index] = self.seal(packet_data)
+        self.count('offloaded', len(futures))
+        for index, future in futures:
+            results[index] = future.result()
+        return results
+
+    def open_packets(self, packets):
+        """Decrypt ProtocolPacket payloads in place; returns the packets that failed authentication."""
+        failed = []
+        futures = []
+        for packet in packets:
+            if not is_sealed(packet.payload_data):
+                continue
+            header = (packet.source_id, packet.dest_id, packet.service_id, packet.message_type, packet.ift_id, packet.ift_type,
+                      packet.data_length)
+            if len(packet.payload_data) >= self.threshold:
+                futures.append((packet, self.pool.submit(self.open_payload, header, packet.payload_data)))
+                continue
+            try:
+                packet.add_payload_data(self.open_payload(header, packet.payload_data))
+            except InvalidTag:
+                failed.append(packet)
+        self.count('offloaded', len(futures))
+        for packet, future in futures:
+            try:
+                packet.add_payload_data(future.result())
+            except InvalidTag:
+                failed.append(packet)
+        return failed
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+# Benchmark: plaintext vs encrypted packets/s per payload size ======================================================================================
+def benchmark(count, cipher, workers):
+    crypto = Packet_Crypto(os.urandom(32), cipher=cipher, workers=workers)
+    opener = Packet_Crypto(crypto.master_key, cipher=cipher, workers=workers)
+    print(f"{'payload':>8} {'plain pkt/s':>12} {'sealed pkt/s':>13} {'opened pkt/s':>13} {'batch pkt/s':>12}")
+    for size in (64, 1024, 16384, 60000):
+        packet = ProtocolPacket(SourceDestID.D_IVI.value, SourceDestID.CLOUD.value, ServiceID.D_IVI_CONTROL.value, 0,
+                                IFTID.IFT_13_04.value, IFT_13_04_Type.TYPE_0002.value)
+        packet.add_payload_data(os.urandom(size))
+        rounds = max(count * 64 // (size + 64), 100)
+
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            packet.pack()
+        plain_s = (time.perf_counter_ns() - start) / 1e9
+        packet_data = packet.pack()
+
+        start = time.perf_counter_ns()
+        sealed = [crypto.seal(packet_data) for _ in range(rounds)]
+        sealed_s = (time.perf_counter_ns() - start) / 1e9
+
+        # every sealed packet once: the replay window rejects a counter it has already accepted
+        start = time.perf_counter_ns()
+        for sealed_data in sealed:
+            opened = opener.open(sealed_data)
+        opened_s = (time.perf_counter_ns() - start) / 1e9
+        assert opened == packet_data
+        try:
+            opener.open(sealed[-1])
+            raise AssertionError("replayed packet accepted")
+        except InvalidTag:
+            pass
+
+        start = time.perf_counter_ns()
+        for offset in range(0, rounds, 64):
+            crypto.seal_many([packet_data] * min(64, rounds - offset))
+        batch_s = (time.perf_counter_ns() - start) / 1e9
+        print(f"{size:8d} {rounds / plain_s:12,.0f} {rounds / sealed_s:13,.0f} {rounds / opened_s:13,.0f} {rounds / batch_s:12,.0f}")
+    print(f"sessions derived: sender {crypto.stats['derived']}, receiver {opener.stats['derived']}; "
+          f"offloaded {crypto.stats['offloaded']} ({workers} workers)")
+    crypto.close()
+    opener.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Payload encryption benchmark')
+    parser.add_argument('--count', default=200000, type=int, help='Packets per size (scaled down for large payloads)')
+    parser.add_argument('--cipher', default='chacha20', choices=list(CIPHERS), help='AEAD cipher')
+    parser.add_argument('--workers', default=2, type=int, help='Offload threads')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.cipher, args.workers)
+
+# python3 payloadCrypto.py --cipher aesgcm
@@ -0,0 +1,298 @@
+# payloadSchema.py
+# The payloadSchema.py file contains the schema registry for payload data.
+# Each (IFT ID, IFT type) maps to a typed field layout (ints, floats, fixed strings, repeated groups) that is
+# compiled once into struct.Struct based encoders and decoders, so message handlers receive typed records.
+# The classes contain the following attributes:
+# - Payload_Schema: compiled layout; runs of fixed fields share one struct.Struct, groups are count-prefixed
+# - Schema_Registry: (IFT ID, IFT type) -> Payload_Schema
+
+import argparse
+import json
+import struct
+import time
+from packet import *
+
+# Field types (network byte order)
+FIELD_TYPES = {
+    'u8': 'B', 'u16': 'H', 'u32': 'I', 'u64': 'Q',
+    'i8': 'b', 'i16': 'h', 'i32': 'i', 'i64': 'q',
+    'f32': 'f', 'f64': 'd', 'bool': '?',
+}
+
+
+def string(size):
+    """Fixed size UTF-8 string field, NUL padded."""
+    return ('str', size)
+
+
+def group(fields, count='u8'):
+    """Repeated group of fields, prefixed with its element count."""
+    return ('group', count, fields)
+
+
+class Payload_Schema:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        # segments: ('fixed', struct, names, string indexes) or ('group', name, count struct, sub schema)
+        self.segments = []
+        self.compile()
+
+    def compile(self):
+        formats, names, strings = [], [], []
+
+        def flush():
+            if names:
+                self.segments.append(('fixed', struct.Struct('!' + ''.join(formats)), tuple(names), tuple(strings)))
+                formats.clear(); names.clear(); strings.clear()
+
+        for name, field_type in self.fields:
+            if isinstance(field_type, tuple) and field_type[0] == 'group':
+                flush()
+                self.segments.append(('group', name, struct.Struct('!' + FIELD_TYPES[field_type[1]]),
+                                      Payload_Schema(f"{self.name}.{name}", field_type[2])))
+            elif isinstance(field_type, tuple) and field_type[0] == 'str':
+                strings.append(len(names))
+                formats.append(f"{field_type[1]}s")
+                names.append(name)
+            elif field_type in FIELD_TYPES:
+                formats.append(FIELD_TYPES[field_type])
+                names.append(name)
+            else:
+                raise ValueError(f"Unsupported field type in {self.name}.{name}: {field_type}")
+        flush()
+
+        # single fixed segment: encode/decode is one struct call
+        self.fixed = self.segments[0] if len(self.segments) == 1 and self.segments[0][0] == 'fixed' else None
+        self.items_structs = {}
+
+    # Set Encoder =================================================================================================================================
+    def encode(self, record):
+        parts = []
+        self.encode_into(record, parts)
+        return b''.join(parts)
+
+    def encode_into(self, record, parts):
+        for segment in self.segments:
+            if segment[0] == 'fixed':
+                _, fixed_struct, names, strings = segment
+                values = [record[name] for name in names]
+                for index in strings:
+                    if isinstance(values[index], str):
+                        values[index] = values[index].encode('utf-8')
+                parts.append(fixed_struct.pack(*values))
+            else:
+                _, name, count_struct, sub_schema = segment
+                items = record[name]
+                parts.append(count_struct.pack(len(items)))
+                if sub_schema.fixed is not None:
+                    parts.append(sub_schema.pack_items(items))
+                else:
+                    for item in items:
+                        sub_schema.encode_into(item, parts)
+
+    def pack_items(self, items):
+        # fixed layout group: every element in one struct call, one struct per element count
+        _, item_struct, names, strings = self.fixed
+        items_struct = self.items_structs.get(len(items))
+        if items_struct is None:
+            items_struct = self.items_structs[len(items)] = struct.Struct('!' + item_struct.format[1:] * len(items))
+        values = [item[name] for item in items for name in names]
+        if strings:
+            width = len(names)
+            for offset in range(0, len(values), width):
+                for index in strings:
+                    if isinstance(values[offset + index], str):
+                        values[offset + index] = values[offset + index].encode('utf-8')
+        return items_struct.pack(*values)
+
+    # Set Decoder =================================================================================================================================
+    def decode(self, payload):
+        record, _ = self.decode_from(payload, 0)
+        return record
+
+    def decode_from(self, payload, offset):
+        if self.fixed is not None:
+            _, fixed_struct, names, strings = self.fixed
+            record = dict(zip(names, fixed_struct.unpack_from(payload, offset)))
+            for index in strings:
+                record[names[index]] = record[names[index]].rstrip(b'\0').decode('utf-8', 'replace')
+            return record, offset + fixed_struct.size
+
+        record = {}
+        for segment in self.segments:
+            if segment[0] == 'fixed':
+                _, fixed_struct, names, strings = segment
+                record.update(zip(names, fixed_struct.unpack_from(payload, offset)))
+                for index in strings:
+                    record[names[index]] = record[names[index]].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += fixed_struct.size
+            else:
+                _, name, count_struct, sub_schema = segment
+                count = count_struct.unpack_from(payload, offset)[0]
+                offset += count_struct.size
+                items = []
+                if sub_schema.fixed is not None:
+                    # fixed layout group: unpack every element with one iter_unpack
+                    _, item_struct, item_names, item_strings = sub_schema.fixed
+                    end = offset + count * item_struct.size
+                    items = [dict(zip(item_names, values)) for values in item_struct.iter_unpack(payload[offset:end])]
+                    if len(items) != count:
+                        raise struct.error(f"{sub_schema.name}: {count} elements expected, {len(items)} present")
+                    for index in item_strings:
+                        item_name = item_names[index]
+                        for item in items:
+                            item[item_name] = item[item_name].rstrip(b'\0').decode('utf-8', 'replace')
+                    offset = end
+                else:
+                    for _ in range(count):
+                        item, offset = sub_schema.decode_from(payload, offset)
+                        items.append(item)
+                record[name] = items
+        return record, offset
+
+
+class Schema_Registry:
+    def __init__(self):
+        self.schemas = {}
+
+    @staticmethod
+    def key(ift_id, ift_type):
+        return (getattr(ift_id, 'value', ift_id), getattr(ift_type, 'value', ift_type))
+
+    def register(self, ift_id, ift_type, fields):
+        schema = Payload_Schema(f"{getattr(ift_id, 'name', ift_id)}:{getattr(ift_type, 'name', ift_type)}", fields)
+        self.schemas[self.key(ift_id, ift_type)] = schema
+        return schema
+
+    def get(self, ift_id, ift_type):
+        return self.schemas.get(self.key(ift_id, ift_type))
+
+    def encode(self, ift_id, ift_type, record):
+        schema = self.get(ift_id, ift_type)
+        if schema is None:
+            raise ValueError(f"No payload schema for IFT {ift_id}:{ift_type}")
+        return schema.encode(record)
+
+    def decode(self, ift_id, ift_type, payload):
+        """Typed record for the payload, or None if the IFT type has no schema or the payload does not fit it."""
+        schema = self.schemas.get((ift_id, ift_type))
+        if schema is None or not payload:
+            return None
+        try:
+            return schema.decode(payload)
+        except (struct.error, UnicodeDecodeError):
+            return None
+
+
+# Define the payload schemas ======================================================================================================================
+SCHEMA_REGISTRY = Schema_Registry()
+
+# DMS warnings
+for ift_id, ift_type_enum in ((IFTID.IFT_12_03, IFT_12_03_Type), (IFTID.IFT_12_04, IFT_12_04_Type)):
+    for ift_type in (ift_type_enum.TYPE_0002, ift_type_enum.TYPE_0004):
+        SCHEMA_REGISTRY.register(ift_id, ift_type, [
+            ('timestamp_ms', 'u64'),
+            ('driver_state', 'u8'),         # 0: normal, 1: drowsy, 2: inattentive, 3: unconscious
+            ('warning_level', 'u8'),
+        ])
+
+# Location based service
+SCHEMA_REGISTRY.register(IFTID.IFT_12_05, IFT_12_05_Type.TYPE_0001, [
+    ('timestamp_ms', 'u64'),
+    ('latitude', 'f64'),
+    ('longitude', 'f64'),
+    ('heading', 'f32'),
+    ('speed_kph', 'f32'),
+])
+SCHEMA_REGISTRY.register(IFTID.IFT_12_05, IFT_12_05_Type.TYPE_0002, [
+    ('timestamp_ms', 'u64'),
+    ('pois', group([('category', string(16)), ('poi_id', string(16)), ('name', string(32)), ('distance_m', 'u32')])),
+])
+
+# Driving info groups
+SCHEMA_REGISTRY.register(IFTID.IFT_13_03, IFT_13_03_Type.TYPE_0002, [
+    ('timestamp_ms', 'u64'),
+    ('latitude', 'f64'),
+    ('longitude', 'f64'),
+    ('speed_kph', 'f32'),
+    ('heading', 'f32'),
+    ('odometer_km', 'u32'),
+])
+SCHEMA_REGISTRY.register(IFTID.IFT_13_03, IFT_13_03_Type.TYPE_0003, [
+    ('timestamp_ms', 'u64'),
+    ('engine_rpm', 'u16'),
+    ('throttle_pct', 'u8'),
+    ('brake_pct', 'u8'),
+    ('fuel_level_pct', 'f32'),
+    ('coolant_temp_c', 'f32'),
+])
+
+# Start-up diagnostics and in-drive warning lights
+for ift_type in (IFT_13_05_Type.TYPE_0001, IFT_13_05_Type.TYPE_0002, IFT_13_05_Type.TYPE_0003, IFT_13_05_Type.TYPE_0004):
+    SCHEMA_REGISTRY.register(IFTID.IFT_13_05, ift_type, [
+        ('timestamp_ms', 'u64'),
+        ('battery_v', 'f32'),
+        ('dtcs', group([('code', string(5)), ('status', 'u8')])),
+    ])
+for ift_type in (IFT_13_06_Type.TYPE_0010, IFT_13_06_Type.TYPE_0011, IFT_13_06_Type.TYPE_0012, IFT_13_06_Type.TYPE_0013):
+    SCHEMA_REGISTRY.register(IFTID.IFT_13_06, ift_type, [
+        ('timestamp_ms', 'u64'),
+        ('lights', group([('light_id', 'u16'), ('state', 'u8'), ('value', 'f32')])),
+    ])
+
+# Media usage
+SCHEMA_REGISTRY.register(IFTID.IFT_23_02, IFT_23_02_Type.TYPE_0002, [
+    ('timestamp_ms', 'u64'),
+    ('passenger_id', 'u32'),
+    ('content_id', string(16)),
+    ('duration_s', 'u32'),
+])
+
+
+# Benchmark: schema codec vs JSON for the same records ===========================================================================================
+def benchmark(count):
+    records = {
+        'position': (IFTID.IFT_12_05, IFT_12_05_Type.TYPE_0001,
+                     {'timestamp_ms': 1700000000000, 'latitude': 37.5665, 'longitude': 126.978, 'heading': 90.0, 'speed_kph': 42.5}),
+        'diagnostics': (IFTID.IFT_13_05, IFT_13_05_Type.TYPE_0003,
+                        {'timestamp_ms': 1700000000000, 'battery_v': 12.6,
+                         'dtcs': [{'code': f"P{index:04d}", 'status': index % 4} for index in range(8)]}),
+        'warning lights': (IFTID.IFT_13_06, IFT_13_06_Type.TYPE_0010,
+                           {'timestamp_ms': 1700000000000,
+                            'lights': [{'light_id': index, 'state': 1, 'value': 0.5} for index in range(16)]}),
+    }
+
+    for label, (ift_id, ift_type, record) in records.items():
+        schema = SCHEMA_REGISTRY.get(ift_id, ift_type)
+        payload = schema.encode(record)
+        text = json.dumps(record).encode('utf-8')
+
+        start_ns = time.perf_counter_ns()
+        for _ in range(count):
+            schema.encode(record)
+        encode_ns = (time.perf_counter_ns() - start_ns) / count
+        start_ns = time.perf_counter_ns()
+        for _ in range(count):
+            schema.decode(payload)
+        decode_ns = (time.perf_counter_ns() - start_ns) / count
+
+        start_ns = time.perf_counter_ns()
+        for _ in range(count):
+            json.dumps(record).encode('utf-8')
+        json_encode_ns = (time.perf_counter_ns() - start_ns) / count
+        start_ns = time.perf_counter_ns()
+        for _ in range(count):
+            json.loads(text)
+        json_decode_ns = (time.perf_counter_ns() - start_ns) / count
+
+        print(f"{label:<15} schema: {len(payload):4d} bytes, encode {1e9 / encode_ns:10.0f}/s, decode {1e9 / decode_ns:10.0f}/s")
+        print(f"{'':<15} json:   {len(text):4d} bytes, encode {1e9 / json_encode_ns:10.0f}/s, decode {1e9 / json_decode_ns:10.0f}/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Payload schema codec benchmark')
+    parser.add_argument('--count', default=100000, type=int, help='Records per measurement')
+
+    args = parser.parse_args()
+    benchmark(args.count)
@@ -0,0 +1,283 @@
+# poiIndex.py
+# The poiIndex.py file contains the nearest-POI search behind the P-IVI location based services (IFT_12_05): the
+# vehicle position of TYPE_0001 is matched against car wash / repair shop POIs for TYPE_0002.
+# POIs are bucketed once into a uniform lat/lon grid (CSR layout: points sorted by cell, one offset per cell), a query
+# visits rings of cells around the vehicle until no unvisited cell can hold a closer POI, and candidates are ranked
+# with a vectorized haversine. Longitude wrap-around (antimeridian) is not handled.
+# The classes contain the following attributes:
+# - POI_Index: grid over the POIs of one category; query(lat, lon, k, max_km) -> (indexes, distances in km)
+# - Location_Service: one index per category; nearest() reuses the previous answer while the vehicle has not moved
+#   far enough for it to change
+# - stats: queries, reused answers, candidates ranked per query
+
+import argparse
+import csv
+import math
+import time
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+POINTS_PER_CELL = 8         # average POIs per occupied grid cell the cell size aims for
+MAX_CELLS = 1 << 22         # grid size cap (cell offsets are 4 bytes each)
+NEAREST_COUNT = 5           # POIs returned per category
+SEARCH_MARGIN_KM = 1.0      # searched beyond max_km so a small move can reuse the answer
+STATS_INTERVAL = 10.0       # seconds between stats log lines
+
+
+def haversine_km(lat, lon, lats, lons, cos_lats):
+    """Distances from one point to arrays of points; all angles in radians, cos_lats = cos(lats)."""
+    sin_dlat = np.sin((lats - lat) * 0.5)
+    sin_dlon = np.sin((lons - lon) * 0.5)
+    a = sin_dlat * sin_dlat + math.cos(lat) * cos_lats * sin_dlon * sin_dlon
+    return (2.0 * EARTH_RADIUS_KM) * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # scalar haversine in degrees
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) * 0.5) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class POI_Index:
+    def __init__(self, latitudes, longitudes, points_per_cell=POINTS_PER_CELL):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.size = len(latitudes)
+        if self.size == 0:
+            self.rows = self.cols = 0
+            return
+
+        # cells about square on the ground at the dataset's latitude, sized for points_per_cell on average
+        self.lat0, self.lon0 = float(latitudes.min()), float(longitudes.min())
+        lat_span = max(float(latitudes.max()) - self.lat0, 1e-6)
+        lon_span = max(float(longitudes.max()) - self.lon0, 1e-6)
+        aspect = max(math.cos(math.radians(float(np.abs(latitudes).max()))), 1e-3)     # lon degrees per lat degree
+        cell_lat = math.sqrt(lat_span * lon_span * aspect * points_per_cell / self.size)
+        cell_lat = max(cell_lat, math.sqrt(lat_span * lon_span * aspect / MAX_CELLS), 1e-5)
+        self.aspect = aspect
+        self.cell_lat = cell_lat
+        self.cell_lon = cell_lat / aspect
+        self.rows = int(lat_span / self.cell_lat) + 1
+        self.cols = int(lon_span / self.cell_lon) + 1
+        # a POI outside the visited block of r rings is at least r cells away: the shortest cell side, on the ground
+        self.cell_km = math.radians(min(self.cell_lat, self.cell_lon * aspect)) * EARTH_RADIUS_KM
+
+        rows = np.minimum(((latitudes - self.lat0) / self.cell_lat).astype(np.int64), self.rows - 1)
+        cols = np.minimum(((longitudes - self.lon0) / self.cell_lon).astype(np.int64), self.cols - 1)
+        cells = rows * self.cols + cols
+        self.order = np.argsort(cells, kind='stable')       # grid position -> index in the input
+        self.starts = np.searchsorted(cells[self.order], np.arange(self.rows * self.cols + 1)).astype(np.int32)
+        self.lats = np.radians(latitudes[self.order])
+        self.lons = np.radians(longitudes[self.order])
+        self.cos_lats = np.cos(self.lats)
+
+    def cell_of(self, lat, lon):
+        return int((lat - self.lat0) // self.cell_lat), int((lon - self.lon0) // self.cell_lon)
+
+    def ring_slices(self, row, col, ring):
+        # CSR ranges of the cells at Chebyshev distance ring from (row, col), clipped to the grid
+        starts, cols = self.starts, self.cols
+        col0, col1 = max(col - ring, 0), min(col + ring, cols - 1)
+        if col0 > col1:
+            return
+        for ring_row in (row - ring, row + ring) if ring else (row,):
+            if 0 <= ring_row < self.rows:
+                yield starts[ring_row * cols + col0], starts[ring_row * cols + col1 + 1]
+        for ring_row in range(max(row - ring + 1, 0), min(row + ring, self.rows)):
+            for ring_col in (col - ring, col + ring):
+                if 0 <= ring_col < cols:
+                    yield starts[ring_row * cols + ring_col], starts[ring_row * cols + ring_col + 1]
+
+    def query(self, lat, lon, k, max_km=None):
+        """Indexes (into the input arrays) and distances in km of the k nearest POIs within max_km, nearest first."""
+        if self.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        row, col = self.cell_of(lat, lon)
+        # cells are narrower on the ground north (south) of the POIs
+        cell_km = self.cell_km * min(1.0, math.cos(lat_r) / self.aspect)
+        # rings beyond this one are outside the grid on every side
+        last_ring = max(row, self.rows - 1 - row, col, self.cols - 1 - col)
+        first_ring = max(-row, row - self.rows + 1, -col, col - self.cols + 1, 0)     # vehicle outside the grid
+        positions = []
+        distances = []
+        found = 0
+        ring = first_ring
+        while ring <= last_ring:
+            for start, end in self.ring_slices(row, col, ring):
+                if end > start:
+                    positions.append(np.arange(start, end))
+                    distances.append(haversine_km(lat_r, lon_r, self.lats[start:end], self.lons[start:end], self.cos_lats[start:end]))
+                    found += end - start
+            reach = ring * cell_km              # every POI not yet visited is at least this far
+            if max_km is not None and reach >= max_km:
+                break
+            if found >= k and reach > 0:
+                kth = np.partition(np.concatenate(distances), k - 1)[k - 1]
+                if kth <= reach:
+                    break
+            ring += 1
+
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        positions = np.concatenate(positions)
+        distances = np.concatenate(distances)
+        if max_km is not None:
+            inside = distances <= max_km
+            positions, distances = positions[inside], distances[inside]
+        if len(distances) > k:
+            nearest = np.argpartition(distances, k - 1)[:k]
+            positions, distances = positions[nearest], distances[nearest]
+        ranked = np.argsort(distances, kind='stable')
+        return self.order[positions[ranked]], distances[ranked]
+
+    def brute_force(self, lat, lon, k, max_km=None):
+        # reference scan over every POI
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        distances = haversine_km(math.radians(lat), math.radians(lon), self.lats, self.lons, self.cos_lats)
+        positions = np.arange(self.size) if max_km is None else np.flatnonzero(distances <= max_km)
+        if len(positions) > k:
+            positions = positions[np.argpartition(distances[positions], k - 1)[:k]]
+        positions = positions[np.argsort(distances[positions], kind='stable')]
+        return self.order[positions], distances[positions]
+
+
+class Location_Service:
+    def __init__(self, pois, k=NEAREST_COUNT, max_km=None, logger=None, reuse=True):
+        """pois: list of dicts with id, category, latitude, longitude (and optionally name)."""
+        self.k = k
+        self.max_km = max_km
+        self.logger = logger
+        self.reuse = reuse
+        self.search_km = None if max_km is None else max_km + SEARCH_MARGIN_KM
+        self.categories = {}        # category -> (POI_Index, POIs, latitudes and longitudes in radians, their cosines)
+        for category in sorted({poi['category'] for poi in pois}):
+            members = [poi for poi in pois if poi['category'] == category]
+            latitudes = np.array([poi['latitude'] for poi in members], dtype=np.float64)
+            longitudes = np.array([poi['longitude'] for poi in members], dtype=np.float64)
+            self.categories[category] = (POI_Index(latitudes, longitudes), members,
+                                         np.radians(latitudes), np.radians(longitudes), np.cos(np.radians(latitudes)))
+        self.previous = {}          # category -> (lat, lon, indexes, slack km)
+        self.stats = {'queries': 0, 'reused': 0}
+        self.reported = time.monotonic()
+
+    @staticmethod
+    def load(path, k=NEAREST_COUNT, max_km=None, logger=None):
+        # CSV with a header: id, category, latitude, longitude[, name]
+        with open(path, 'r', newline='', encoding='utf-8') as file:
+            pois = [{'id': row['id'], 'category': row['category'], 'name': row.get('name', ''),
+                     'latitude': float(row['latitude']), 'longitude': float(row['longitude'])} for row in csv.DictReader(file)]
+        service = Location_Service(pois, k, max_km, logger)
+        if logger is not None:
+            logger.message("INFO", "location", f"Loaded {len(pois)} POIs from {path}: " +
+                           ", ".join(f"{category}: {entry[0].size}" for category, entry in service.categories.items()))
+        return service
+
+    def nearest_indexes(self, category, index, lat, lon):
+        previous = self.previous.get(category)
+        if previous is not None and distance_km(previous[0], previous[1], lat, lon) <= previous[3]:
+            # no other POI can have become one of the nearest; only their order may have changed
+            self.stats['reused'] += 1
+            return previous[2]
+
+        # one more than needed: the gap to the next POI bounds how far the vehicle may move before the answer changes
+        indexes, distances = index.query(lat, lon, self.k + 1, self.search_km)
+        inside = len(distances) if self.max_km is None else int(np.searchsorted(distances, self.max_km, side='right'))
+        count = min(inside, self.k)
+        farthest = float(distances[count - 1]) if count else 0.0
+        if count < len(distances):
+            next_km = float(distances[count])
+        else:
+            next_km = math.inf if self.search_km is None else self.search_km
+        if count == self.k:
+            slack = (next_km - farthest) / 2.0
+        else:
+            slack = next_km - self.max_km if self.max_km is not None else math.inf
+        if self.max_km is not None and count:
+            slack = min(slack, self.max_km - farthest)
+        if self.reuse:
+            self.previous[category] = (lat, lon, indexes[:count], max(slack, 0.0))
+        return indexes[:count]
+
+    def nearest(self, lat, lon, categories=None):
+        """{category: [(id, name, distance in m), ...]} nearest first."""
+        self.stats['queries'] += 1
+        result = {}
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        for category in categories or self.categories:
+            index, members, lats, lons, cos_lats = self.categories[category]
+            indexes = self.nearest_indexes(category, index, lat, lon)
+            # rank the few POIs with their current distances
+            distances = haversine_km(lat_r, lon_r, lats[indexes], lons[indexes], cos_lats[indexes])
+            result[category] = [(members[indexes[i]]['id'], members[indexes[i]].get('name', ''), round(float(distances[i]) * 1000.0))
+                                for i in np.argsort(distances, kind='stable')]
+        now = time.monotonic()
+        if self.logger is not None and now - self.reported >= STATS_INTERVAL:
+            self.reported = now
+            self.logger.message("INFO", "location", f"queries: {self.stats['queries']}, reused: {self.stats['reused']}")
+        return result
+
+
+# Benchmark: queries/s of the grid index and the incremental re-query against a brute-force scan ====================================================
+def synthetic_pois(count, seed=7):
+    # POIs clustered around city centres in a Korea-sized box, as car washes and repair shops are
+    rng = np.random.default_rng(seed)
+    centres = np.column_stack((rng.uniform(34.5, 38.3, 40), rng.uniform(126.2, 129.5, 40)))
+    cluster = rng.integers(0, len(centres), count)
+    latitudes = centres[cluster, 0] + rng.normal(0, 0.08, count)
+    longitudes = centres[cluster, 1] + rng.normal(0, 0.10, count)
+    return latitudes, longitudes, centres
+
+
+def benchmark(count, queries, k, max_km):
+    latitudes, longitudes, centres = synthetic_pois(count)
+    build_start = time.perf_counter_ns()
+    index = POI_Index(latitudes, longitudes)
+    print(f"{count} POIs, grid {index.rows}x{index.cols} ({index.cell_km:.2f} km cells) built in "
+          f"{(time.perf_counter_ns() - build_start) / 1e6:.0f} ms; k={k}, max_km={max_km}")
+
+    # a vehicle driving between cities, one position update per second at 60 km/h (about 17 m per update)
+    rng = np.random.default_rng(11)
+    path = []
+    lat, lon = centres[0]
+    heading = rng.uniform(0, 2 * math.pi)
+    for _ in range(queries):
+        heading += rng.normal(0, 0.05)
+        lat += 0.017 / 111.0 * math.cos(heading)
+        lon += 0.017 / (111.0 * math.cos(math.radians(lat))) * math.sin(heading)
+        path.append((lat, lon))
+
+    results = {}
+    for label, method in (('brute force', index.brute_force), ('grid index', index.query)):
+        start = time.perf_counter_ns()
+        results[label] = [method(lat, lon, k, max_km) for lat, lon in path]
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        print(f"{label:<22} {queries / elapsed:10,.0f} queries/s")
+    mismatches = sum(not np.allclose(a[1], b[1]) for a, b in zip(results['brute force'], results['grid index']))
+
+    # Location_Service answers with ids and distances in m; with and without reusing the previous answer
+    pois = [{'id': i, 'category': 'car_wash', 'latitude': float(latitudes[i]), 'longitude': float(longitudes[i])} for i in range(count)]
+    wrong = 0
+    for label, reuse in (('service', False), ('service + incremental', True)):
+        service = Location_Service(pois, k, max_km, reuse=reuse)
+        start = time.perf_counter_ns()
+        answers = [service.nearest(lat, lon)['car_wash'] for lat, lon in path]
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        wrong += sum([poi[0] for poi in answer] != results['brute force'][i][0].tolist() for i, answer in enumerate(answers))
+        print(f"{label:<22} {queries / elapsed:10,.0f} queries/s ({service.stats['reused'] * 100 / queries:.0f}% reused)")
+    print(f"grid vs brute force: {mismatches} distance mismatches; service vs brute force: {wrong} different answers")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Nearest POI search benchmark')
+    parser.add_argument('--count', default=200000, type=int, help='POIs')
+    parser.add_argument('--queries', default=5000, type=int, help='Position updates')
+    parser.add_argument('--k', default=NEAREST_COUNT, type=int, help='POIs per query')
+    parser.add_argument('--max_km', default=None, type=float, help='Search radius in km (default: unlimited)')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.queries, args.k, args.max_km)
+
+# python3 poiIndex.py --count 200000 --queries 5000 --k 5
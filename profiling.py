@@ -0,0 +1,335 @@
+# profiling.py
+# The profiling.py file contains the Profile_Control class: profilers that are switched on and off in a running role.
+# - stages: sampled perf_counter_ns spans around the receive path stages (recv, validate, deliver, unpack, enum
+#   resolution, Logger.message, send). The stage functions are wrapped only while stages are on; when off the
+#   original functions are restored, so a disabled profiler costs nothing on the hot path.
+# - cprofile: cProfile of the packet deliveries (UDP_Control.udp_deliver and everything it calls), per server thread
+# - tracemalloc: allocation sites, with the top sites logged periodically and when it is stopped
+# Toggled with SIGUSR1 (all on/off) or by commands on a Unix datagram socket, see `python3 profiling.py --help`.
+# The class contains the following attributes:
+# - stages: Stage -> [calls, sampled, total ns, max ns] of the sampled spans (times are inclusive of nested stages)
+# - active: The profilers currently on
+# - control_path: Unix socket path for commands ('stages on', 'cprofile off', 'tracemalloc on', 'dump', ...)
+
+import argparse
+import cProfile
+import enum
+import inspect
+import io
+import os
+import pstats
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from logger import Logger
+from packetValidator import Packet_Validator
+from udpControl import UDP_Control
+from packet import *
+
+SAMPLE_EVERY = 64           # one span timed per SAMPLE_EVERY calls of a stage
+DUMP_INTERVAL = 10.0        # seconds between top-stage/allocation dumps while a profiler is on
+TOP_COUNT = 10              # stages/functions/allocation sites per dump
+TRACEMALLOC_FRAMES = 4
+PROFILERS = ('stages', 'cprofile', 'tracemalloc')
+
+# Stage name -> (owner, attribute) wrapped while stages are on. Every one is looked up on its class at each call,
+# so wrapping the class attribute reaches running loops too.
+STAGES = {
+    'recv': (socket.socket, 'recvmsg'),         # the roles' receive (Socket_Tuning drop accounting)
+    'validate': (Packet_Validator, 'validate'),
+    'deliver': (UDP_Control, 'udp_deliver'),    # validate + log + handler (process_message)
+    'unpack': (ProtocolPacket, 'unpack'),
+    'enum': (enum.EnumMeta, '__call__'),        # SourceDestID(x), ServiceID(x), IFTID(x), ...
+    'log': (Logger, 'message'),
+    'send': (UDP_Control, 'udp_client'),
+}
+
+
+def control_path(pid):
+    return os.path.join(tempfile.gettempdir(), f"ivi-profile-{pid}.sock")
+
+
+class Profile_Control:
+    def __init__(self, system, logger, sample_every=SAMPLE_EVERY, interval=DUMP_INTERVAL, output_dir=None):
+        self.system = system
+        self.logger = logger
+        self.sample_every = sample_every
+        self.interval = interval
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.active = set()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.originals = {}         # (owner, attribute) -> (own attribute or None, attribute as found on the MRO)
+        self.layers = {}            # (owner, attribute) -> profiler -> wrapper factory
+        self.profiles = []
+        self.profile_local = threading.local()
+        self.dump_thread = None
+        self.control_path = control_path(os.getpid())
+
+    # Set Stage spans =============================================================================================================================
+    def wrap_stage(self, stage, function):
+        entry = self.stages.setdefault(stage, [0, 0, 0, 0])
+        every = self.sample_every
+        clock = time.perf_counter_ns
+
+        def span(*args, **kwargs):
+            entry[0] += 1
+            if entry[0] % every:
+                return function(*args, **kwargs)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                entry[1] += 1
+                entry[2] += elapsed
+                if elapsed > entry[3]:
+                    entry[3] = elapsed
+        span.__wrapped__ = function
+        return span
+
+    def patch(self, profiler, owner, name, wrapper):
+        key = (owner, name)
+        if key not in self.originals:
+            self.originals[key] = (owner.__dict__.get(name), inspect.getattr_static(owner, name))
+        self.layers.setdefault(key, {})[profiler] = wrapper
+        self.apply(key)
+
+    def unpatch(self, profiler, owner, name):
+        self.layers.get((owner, name), {}).pop(profiler, None)
+        self.apply((owner, name))
+
+    def apply(self, key):
+        # rebuilt from the original on every change, so profilers can be switched off in any order
+        owner, name = key
+        own, found = self.originals[key]
+        layers = self.layers.get(key)
+        if not layers:
+            if own is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, own)
+            del self.originals[key]
+            self.layers.pop(key, None)
+            return
+        function = found.__func__ if isinstance(found, staticmethod) else found
+        for profiler in PROFILERS:      # stage spans innermost
+            if profiler in layers:
+                function = layers[profiler](function)
+        setattr(owner, name, staticmethod(function) if isinstance(found, staticmethod) else function)
+
+    def start_stages(self):
+        self.stages = {}
+        for stage, (owner, name) in STAGES.items():
+            self.patch('stages', owner, name, lambda function, stage=stage: self.wrap_stage(stage, function))
+
+    def stop_stages(self):
+        for owner, name in STAGES.values():
+            self.unpatch('stages', owner, name)
+        self.dump_stages()
+
+    def dump_stages(self):
+        ranked = sorted(((entry[2] * entry[0] / entry[1] if entry[1] else 0, stage, entry) for stage, entry in self.stages.items()), reverse=True)
+        lines = [f"{stage}: {entry[0]} calls, {entry[2] / entry[1] / 1000:.1f} us avg, {entry[3] / 1000:.1f} us max, "
+                 f"~{estimate / 1e9:.3f} s total" for estimate, stage, entry in ranked[:TOP_COUNT] if entry[1]]
+        self.logger.message("WARNING", "profile", f"top stages (1/{self.sample_every} sampled, inclusive): " + ("; ".join(lines) or "no calls"))
+
+    # Set cProfile ================================================================================================================================
+    def wrap_cprofile(self, function):
+        local = self.profile_local
+        profiles = self.profiles
+
+        def profiled(*args, **kwargs):
+            # cProfile only sees the thread that enabled it: each server thread gets its own profile
+            profile = getattr(local, 'profile', None)
+            if profile is None:
+                profile = local.profile = cProfile.Profile()
+                profiles.append(profile)
+            profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+        profiled.__wrapped__ = function
+        return profiled
+
+    def start_cprofile(self):
+        self.profiles = []
+        self.profile_local = threading.local()
+        self.patch('cprofile', UDP_Control, 'udp_deliver', self.wrap_cprofile)
+
+    def stop_cprofile(self):
+        self.unpatch('cprofile', UDP_Control, 'udp_deliver')
+        self.dump_cprofile(final=True)
+
+    def dump_cprofile(self, final=False):
+        profiles = list(self.profiles)
+        if not profiles:
+            self.logger.message("WARNING", "profile", "cProfile: no packets delivered")
+            return
+        stream = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TOP_COUNT)
+        self.logger.message("WARNING", "profile", f"cProfile top {TOP_COUNT} by cumulative time:\n{stream.getvalue()}")
+        if final:
+            path = os.path.join(self.output_dir, f"{self.system}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            stats.dump_stats(path)
+            self.logger.message("WARNING", "profile", f"cProfile written to {path} (python3 -m pstats {path})")
+
+    # Set tracemalloc =============================================================================================================================
+    def start_tracemalloc(self):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stop_tracemalloc(self):
+        self.dump_tracemalloc()
+        tracemalloc.stop()
+
+    def dump_tracemalloc(self):
+        if not tracemalloc.is_tracing():
+            return
+        # the profilers' own allocations are not what we are looking for
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, module.__file__)
+                                                              for module in (tracemalloc, cProfile, pstats, sys.modules[__name__])])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}: {stat.size / 1024:.1f} KiB in {stat.count} blocks"
+                 for stat in snapshot.statistics('lineno')[:TOP_COUNT]]
+        self.logger.message("WARNING", "profile", f"tracemalloc {current / 1024:.0f} KiB traced (peak {peak / 1024:.0f} KiB), top sites: " + "; ".join(lines))
+
+    # Set Toggles =================================================================================================================================
+    def set(self, profiler, on):
+        """Switch one profiler on or off; returns False if it already was."""
+        with self.lock:
+            if profiler not in PROFILERS or (profiler in self.active) == on:
+                return False
+            getattr(self, ('start_' if on else 'stop_') + profiler)()
+            if on:
+                self.active.add(profiler)
+            else:
+                self.active.discard(profiler)
+            self.logger.message("WARNING", "profile", f"{profiler} {'on' if on else 'off'}, active: {sorted(self.active) or 'none'}")
+            if self.active and (self.dump_thread is None or not self.dump_thread.is_alive()):
+                self.dump_thread = threading.Thread(target=self.dump_loop, daemon=True)
+                self.dump_thread.start()
+            return True
+
+    def toggle_all(self):
+        on = not self.active
+        for profiler in PROFILERS:
+            self.set(profiler, on)
+
+    def dump(self):
+        with self.lock:
+            if 'stages' in self.active:
+                self.dump_stages()
+            if 'cprofile' in self.active:
+                self.dump_cprofile()
+            if 'tracemalloc' in self.active:
+                self.dump_tracemalloc()
+
+    def dump_loop(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.active:
+                return
+            self.dump()
+
+    def command(self, text):
+        words = text.split()
+        if words == ['dump']:
+            self.dump()
+        elif len(words) == 2 and words[1] in ('on', 'off') and words[0] in PROFILERS + ('all',):
+            for profiler in (PROFILERS if words[0] == 'all' else (words[0],)):
+                self.set(profiler, words[1] == 'on')
+        else:
+            self.logger.message("WARNING", "profile", f"Unknown command: {text!r}")
+
+    def control_loop(self, sock):
+        while True:
+            try:
+                self.command(sock.recv(256).decode('utf-8', 'replace'))
+            except Exception as e:
+                self.logger.message("ERROR", "profile", f"Command failed: {e!r}")
+
+    def install(self, profilers=()):
+        # Signal handlers run on the main thread; do the patching off it
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=self.toggle_all, daemon=True).start())
+        try:
+            if os.path.exists(self.control_path):
+                os.unlink(self.control_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.control_path)
+            threading.Thread(target=self.control_loop, args=(sock,), daemon=True).start()
+        except OSError as e:
+            self.logger.message("WARNING", "profile", f"Control socket {self.control_path} not available: {e}")
+        self.logger.message("INFO", "profile", f"Profilers toggled on SIGUSR1 or with: python3 profiling.py --pid {os.getpid()} <profiler> on|off")
+        for profiler in profilers:
+            self.set(profiler, True)
+
+    def close(self):
+        if os.path.exists(self.control_path):
+            os.unlink(self.control_path)
+
+
+def send_command(pid, text):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(text.encode('utf-8'), control_path(pid))
+    finally:
+        sock.close()
+
+
+# Benchmark: cost per delivered packet with each profiler on ========================================================================================
+def benchmark(count):
+    logger = Logger('ERROR', 'BENCH', 'UDP')
+    udpControl = UDP_Control('BENCH', '127.0.0.1', 0, logger)
+    packet = ProtocolPacket(SourceDestID.D_IVI.value, SourceDestID.CCU.value, ServiceID.D_IVI_CONTROL.value,
+                            D_IVI_CONTROL_MESSAGE_TYPES.D_IVI_CONTROL_REQUEST.value, IFTID.IFT_12_03.value,
+                            IFT_12_03_Type.TYPE_0002.value)
+    packet.add_payload_data(b'0123456789' * 4)
+    data = packet.pack()
+
+    def process_message(received_data):
+        # the decode and logging work of a role's process_message
+        unpacked = ProtocolPacket.unpack(received_data)
+        logger.message("INFO", "process", f"SRC:{SourceDestID(unpacked.source_id)}:DEST:{SourceDestID(unpacked.dest_id)}:SID:{ServiceID(unpacked.service_id)}")
+        logger.message("INFO", "process", f"service_ift_id : {IFTID(unpacked.ift_id)}")
+        logger.message("INFO", "process", f"service_payload_data : {unpacked.payload_data}")
+
+    profiling = Profile_Control('BENCH', Logger('ERROR', 'BENCH', 'UDP'), output_dir=tempfile.mkdtemp())
+    for _ in range(count):      # warm-up
+        udpControl.udp_deliver(data, '127.0.0.1', process_message)
+    baseline = None
+    for label, profilers in (('disabled', ()), ('stages 1/64', ('stages',)), ('cprofile', ('cprofile',)),
+                             ('tracemalloc', ('tracemalloc',)), ('disabled again', ())):
+        for profiler in profilers:
+            profiling.set(profiler, True)
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            udpControl.udp_deliver(data, '127.0.0.1', process_message)
+        per_packet = (time.perf_counter_ns() - start) / count
+        for profiler in profilers:
+            profiling.set(profiler, False)
+        baseline = baseline or per_packet
+        print(f"{label:<15} {per_packet / 1000:7.2f} us/packet ({(per_packet / baseline - 1) * 100:+6.1f}%)")
+    stages = sorted(profiling.stages.items(), key=lambda item: -item[1][2])
+    print("stage spans: " + ", ".join(f"{stage} {entry[2] / entry[1] / 1000:.2f} us" for stage, entry in stages if entry[1]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Toggle the profilers of a running role, or benchmark their cost')
+    parser.add_argument('--pid', default=None, type=int, help='Process ID of the role')
+    parser.add_argument('command', nargs='*', help="'stages|cprofile|tracemalloc|all on|off' or 'dump'")
+    parser.add_argument('--count', default=100000, type=int, help='Benchmark: packets per profiler')
+
+    args = parser.parse_args()
+    if args.pid is not None:
+        send_command(args.pid, " ".join(args.command))
+    else:
+        benchmark(args.count)
+
+# python3 profiling.py --pid 1234 cprofile on
+# python3 profiling.py --count 200000
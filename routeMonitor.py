@@ -0,0 +1,364 @@
+# routeMonitor.py
+# The routeMonitor.py file contains the route deviation analysis behind the Cloud driving info service (IFT_13_03
+# TYPE_0007): the positions of the driving info group 1 records (TYPE_0002) are matched against a planned route,
+# raising alerts when a vehicle leaves or rejoins the route and when a delivery stop is not reached by its deadline.
+# Segments are projected onto a local plane (longitudes scaled by the cosine of the segment's latitude) and their
+# bounding boxes, grown by the deviation threshold, are bucketed into a uniform lat/lon grid: only the segments of
+# the grid cell of a point can be within the threshold. Each vehicle is tracked on its current segment, so a point is
+# first matched against a short window of segments ahead, a batch of points at once with NumPy; the grid is only
+# consulted for points outside the window (a detour, a skipped stretch, the first point). Longitude wrap-around
+# (antimeridian) is not handled.
+# The classes contain the following attributes:
+# - Route: polyline segments, distance along the route per vertex, delivery stops, grid of segment bounding boxes
+# - Route_Tracker: current segment, on/off route state and next delivery stop of one vehicle
+# - Route_Monitor: one tracker per vehicle fed from ProtocolPackets; stats: points, window matches, grid fallbacks,
+#   off-route points, alerts
+
+import argparse
+import csv
+import math
+import time
+from collections import OrderedDict
+import numpy as np
+from packet import *
+from payloadSchema import SCHEMA_REGISTRY
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.radians(1.0) * EARTH_RADIUS_KM
+DEVIATION_M = 100.0         # distance from the route at which a vehicle is off the route
+WINDOW = 16                 # segments ahead of the current one matched before the grid is consulted
+CHUNK = 64                  # points matched against one window at a time
+SEGMENTS_PER_CELL = 4       # average segments per occupied grid cell the cell size aims for
+MAX_CELLS = 1 << 22         # grid size cap (cell offsets are 4 bytes each)
+STOP_RADIUS_M = 200.0       # a delivery stop is reached within this distance along the route
+MAX_VEHICLES = 100000       # trackers kept (least recently active evicted)
+STATS_INTERVAL = 10.0       # seconds between stats log lines
+
+
+class Route:
+    def __init__(self, latitudes, longitudes, stops=(), deviation_m=DEVIATION_M):
+        """stops: (vertex index, name, deadline in ms since the epoch or None), in route order."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if len(latitudes) < 2:
+            raise ValueError("a route needs at least two points")
+        self.threshold_km = deviation_m / 1000.0
+        self.size = len(latitudes) - 1     # segments
+
+        # segment i runs from vertex i to i + 1; x is scaled by the cosine at its start vertex
+        self.scale = np.cos(np.radians(latitudes[:-1])) * KM_PER_DEGREE
+        self.ax = longitudes[:-1] * self.scale
+        self.ay = latitudes[:-1] * KM_PER_DEGREE
+        self.dx = longitudes[1:] * self.scale - self.ax
+        self.dy = latitudes[1:] * KM_PER_DEGREE - self.ay
+        lengths2 = self.dx * self.dx + self.dy * self.dy
+        self.inv_lengths2 = np.divide(1.0, lengths2, out=np.zeros_like(lengths2), where=lengths2 > 0)
+        self.along = np.concatenate(([0.0], np.cumsum(np.sqrt(lengths2))))     # km along the route per vertex
+        self.stops = [(float(self.along[vertex]), name, deadline) for vertex, name, deadline in stops]
+        self.build_grid(latitudes, longitudes)
+
+    def build_grid(self, latitudes, longitudes):
+        # bounding box of every segment, grown by the threshold in degrees
+        grow_lat = self.threshold_km / KM_PER_DEGREE
+        grow_lon = grow_lat / np.maximum(np.cos(np.radians(np.maximum(np.abs(latitudes[:-1]), np.abs(latitudes[1:])))), 1e-3)
+        lat_min = np.minimum(latitudes[:-1], latitudes[1:]) - grow_lat
+        lat_max = np.maximum(latitudes[:-1], latitudes[1:]) + grow_lat
+        lon_min = np.minimum(longitudes[:-1], longitudes[1:]) - grow_lon
+        lon_max = np.maximum(longitudes[:-1], longitudes[1:]) + grow_lon
+
+        # square-ish cells holding a few segments each on average
+        self.lat0, self.lon0 = float(lat_min.min()), float(lon_min.min())
+        aspect = max(math.cos(math.radians(float(np.abs(latitudes).max()))), 1e-3)
+        extent = float(np.median(np.maximum(lat_max - lat_min, (lon_max - lon_min) * aspect)))
+        lat_span = float(lat_max.max()) - self.lat0
+        lon_span = float(lon_max.max()) - self.lon0
+        self.cell_lat = max(extent * math.sqrt(SEGMENTS_PER_CELL), math.sqrt(lat_span * lon_span * aspect / MAX_CELLS), 1e-5)
+        self.cell_lon = self.cell_lat / aspect
+        self.rows = int(lat_span / self.cell_lat) + 1
+        self.cols = int(lon_span / self.cell_lon) + 1
+
+        row0 = ((lat_min - self.lat0) // self.cell_lat).astype(np.int64)
+        row1 = ((lat_max - self.lat0) // self.cell_lat).astype(np.int64)
+        col0 = ((lon_min - self.lon0) // self.cell_lon).astype(np.int64)
+        col1 = ((lon_max - self.lon0) // self.cell_lon).astype(np.int64)
+        cells, segments = [], []
+        for segment in range(self.size):
+            rows = np.arange(row0[segment], row1[segment] + 1)
+            cols = np.arange(col0[segment], col1[segment] + 1)
+            covered = (rows[:, None] * self.cols + cols[None, :]).ravel()
+            cells.append(covered)
+            segments.append(np.full(len(covered), segment, dtype=np.int32))
+        cells = np.concatenate(cells)
+        segments = np.concatenate(segments)
+        # CSR layout: segments sorted by cell, one offset per cell
+        order = np.argsort(cells, kind='stable')
+        self.cell_segments = segments[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.rows * self.cols + 1)).astype(np.int32)
+
+    @staticmethod
+    def load(path, deviation_m=DEVIATION_M):
+        # CSV with a header: latitude, longitude[, stop, deadline_ms]; a named row is a delivery stop
+        latitudes, longitudes, stops = [], [], []
+        with open(path, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                if row.get('stop'):
+                    stops.append((len(latitudes), row['stop'], int(row['deadline_ms']) if row.get('deadline_ms') else None))
+                latitudes.append(float(row['latitude']))
+                longitudes.append(float(row['longitude']))
+        return Route(latitudes, longitudes, stops, deviation_m)
+
+    # Set Matching ================================================================================================================================
+    def distances(self, latitudes, longitudes, segments):
+        """Distances in km of points (rows) to segments (columns) and the position along each segment (0..1)."""
+        scale = self.scale[segments]
+        px = longitudes[:, None] * scale - self.ax[segments]
+        py = latitudes[:, None] * KM_PER_DEGREE - self.ay[segments]
+        dx, dy = self.dx[segments], self.dy[segments]
+        t = np.clip((px * dx + py * dy) * self.inv_lengths2[segments], 0.0, 1.0)
+        ex = px - t * dx
+        ey = py - t * dy
+        return np.sqrt(ex * ex + ey * ey), t
+
+    def candidates(self, lat, lon):
+        """Segments whose grown bounding box holds the point: the only ones that can be within the threshold."""
+        row = int((lat - self.lat0) // self.cell_lat)
+        col = int((lon - self.lon0) // self.cell_lon)
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return self.cell_segments[:0]
+        cell = row * self.cols + col
+        return self.cell_segments[self.starts[cell]:self.starts[cell + 1]]
+
+    def nearest(self, lat, lon):
+        """(segment, distance km, t) of the nearest segment within the threshold, or None."""
+        segments = self.candidates(lat, lon)
+        if len(segments) == 0:
+            return None
+        distances, t = self.distances(np.array([lat]), np.array([lon]), segments)
+        best = int(distances[0].argmin())
+        if distances[0, best] > self.threshold_km:
+            return None
+        return int(segments[best]), float(distances[0, best]), float(t[0, best])
+
+    def brute_force(self, lat, lon):
+        # reference: every segment
+        distances, t = self.distances(np.array([lat]), np.array([lon]), np.arange(self.size))
+        best = int(distances[0].argmin())
+        return best, float(distances[0, best]), float(t[0, best])
+
+    def progress_km(self, segment, t):
+        return float(self.along[segment] + t * (self.along[segment + 1] - self.along[segment]))
+
+
+class Route_Tracker:
+    __slots__ = ('vehicle', 'segment', 'on_route', 'off_km', 'next_stop', 'progress_km')
+
+    def __init__(self, vehicle):
+        self.vehicle = vehicle
+        self.segment = None     # current segment, None until the vehicle is first on the route
+        self.on_route = None
+        self.off_km = 0.0       # distance to the window when the vehicle left the route
+        self.next_stop = 0
+        self.progress_km = 0.0
+
+
+class Route_Monitor:
+    def __init__(self, route, logger=None, window=WINDOW, max_vehicles=MAX_VEHICLES):
+        self.route = route
+        self.logger = logger
+        self.window = window
+        self.max_vehicles = max_vehicles
+        self.trackers = OrderedDict()       # vehicle -> Route_Tracker, least recently active first
+        self.stats = {'points': 0, 'window': 0, 'grid': 0, 'off_route': 0, 'alerts': 0}
+        self.reported = time.monotonic()
+
+    def tracker(self, vehicle):
+        tracker = self.trackers.get(vehicle)
+        if tracker is None:
+            tracker = self.trackers[vehicle] = Route_Tracker(vehicle)
+            if len(self.trackers) > self.max_vehicles:
+                self.trackers.popitem(last=False)
+        else:
+            self.trackers.move_to_end(vehicle)
+        return tracker
+
+    # Set Update ==================================================================================================================================
+    def update(self, vehicle, latitudes, longitudes, timestamps_ms=None):
+        """Match a vehicle's positions in order; returns the matched segment per point (-1 off the route)."""
+        route = self.route
+        tracker = self.tracker(vehicle)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        count = len(latitudes)
+        matched = np.full(count, -1, dtype=np.int64)
+        self.stats['points'] += count
+        threshold = route.threshold_km
+        index = 0
+        while index < count:
+            if tracker.segment is not None:
+                # the current segment, the one before it and the window ahead, for a chunk of points at once
+                first = max(tracker.segment - 1, 0)
+                segments = np.arange(first, min(tracker.segment + self.window, route.size))
+                end = min(index + CHUNK, count)
+                distances, t = route.distances(latitudes[index:end], longitudes[index:end], segments)
+                best = distances.argmin(axis=1)
+                best_km = distances[np.arange(end - index), best]
+                inside = best_km <= threshold
+                run = end - index if inside.all() else int(inside.argmin())
+                if run:
+                    matched[index:index + run] = first + best[:run]
+                    self.stats['window'] += run
+                    if tracker.on_route is not True:
+                        tracker.progress_km = route.progress_km(int(first + best[0]), float(t[0, best[0]]))
+                        self.transition(tracker, True, timestamps_ms, index)
+                    tracker.segment = int(first + best[run - 1])
+                    tracker.progress_km = route.progress_km(tracker.segment, float(t[run - 1, best[run - 1]]))
+                    index += run
+                    self.check_stops(tracker, timestamps_ms, index - 1)
+                    continue
+                off_km = float(best_km[0])
+            else:
+                off_km = None
+
+            # outside the window: any segment of the route near the point
+            self.stats['grid'] += 1
+            nearest = route.nearest(latitudes[index], longitudes[index])
+            if nearest is not None:
+                matched[index] = nearest[0]
+                tracker.segment = nearest[0]
+                tracker.progress_km = route.progress_km(nearest[0], nearest[2])
+                self.transition(tracker, True, timestamps_ms, index)
+            else:
+                self.stats['off_route'] += 1
+                if off_km is not None:
+                    tracker.off_km = off_km
+                self.transition(tracker, False, timestamps_ms, index)
+            self.check_stops(tracker, timestamps_ms, index)
+            index += 1
+
+        self.report_if_due()
+        return matched
+
+    def transition(self, tracker, on_route, timestamps_ms, index):
+        if tracker.on_route == on_route:
+            return
+        previous, tracker.on_route = tracker.on_route, on_route
+        if previous is None:
+            return
+        at = "" if timestamps_ms is None else f" at {int(timestamps_ms[index])} ms"
+        if on_route:
+            self.alert("INFO", tracker, f"back on route at {tracker.progress_km:.2f} km{at}")
+        else:
+            away = f", {tracker.off_km * 1000:.0f} m from the route" if tracker.off_km else ""
+            self.alert("WARNING", tracker, f"left the route after {tracker.progress_km:.2f} km{away}{at}")
+
+    def check_stops(self, tracker, timestamps_ms, index):
+        stops = self.route.stops
+        now_ms = None if timestamps_ms is None else int(timestamps_ms[index])
+        while tracker.next_stop < len(stops):
+            along_km, name, deadline = stops[tracker.next_stop]
+            if tracker.progress_km >= along_km - STOP_RADIUS_M / 1000.0:
+                late = now_ms is not None and deadline is not None and now_ms > deadline
+                self.alert("WARNING" if late else "INFO", tracker, f"reached delivery stop {name}" +
+                           (f" {(now_ms - deadline) / 1000:.0f} s late" if late else ""))
+                tracker.next_stop += 1
+            elif now_ms is not None and deadline is not None and now_ms > deadline:
+                self.alert("WARNING", tracker, f"missed the delivery time of stop {name}, "
+                                               f"{along_km - tracker.progress_km:.2f} km to go")
+                tracker.next_stop += 1
+            else:
+                break
+
+    def alert(self, debug, tracker, text):
+        self.stats['alerts'] += 1
+        if self.logger is not None:
+            self.logger.message(debug, "route", f"[{tracker.vehicle}] {text}")
+
+    def add_packets(self, records):
+        """Match the positions of driving info group 1 (IFT_13_03 TYPE_0002) among (vehicle, time, ProtocolPacket)."""
+        ift_id = IFTID.IFT_13_03.value
+        ift_type = IFT_13_03_Type.TYPE_0002.value
+        positions = {}
+        for vehicle, _, packet in records:
+            if packet.ift_id != ift_id or packet.ift_type != ift_type:
+                continue
+            record = SCHEMA_REGISTRY.decode(ift_id, ift_type, packet.payload_data)
+            if record is not None:
+                positions.setdefault(vehicle, []).append((record['latitude'], record['longitude'], record['timestamp_ms']))
+        for vehicle, points in positions.items():
+            latitudes, longitudes, timestamps = zip(*points)
+            self.update(vehicle, latitudes, longitudes, timestamps)
+
+    def report_if_due(self):
+        now = time.monotonic()
+        if self.logger is not None and now - self.reported >= STATS_INTERVAL:
+            self.reported = now
+            self.logger.message("INFO", "route", f"vehicles: {len(self.trackers)}, " +
+                                ", ".join(f"{name}: {count}" for name, count in self.stats.items()))
+
+
+# Benchmark: points/s matched against long routes ===================================================================================================
+def synthetic_route(segments, seed=3):
+    # a long delivery route wandering from central Korea, 50-500 m between vertices
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.3, segments))
+    step_km = rng.uniform(0.05, 0.5, segments)
+    lat = 36.0 + np.concatenate(([0.0], np.cumsum(step_km * np.cos(heading)))) / KM_PER_DEGREE
+    lon = 127.5 + np.concatenate(([0.0], np.cumsum(step_km * np.sin(heading) / np.cos(np.radians(36.0))))) / KM_PER_DEGREE
+    return lat, lon
+
+
+def synthetic_drive(route_lat, route_lon, points, seed=4):
+    # one GPS fix per second at about 60 km/h along the route with 10 m noise, and a 2 km detour every 5000 points
+    rng = np.random.default_rng(seed)
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(route_lat) * KM_PER_DEGREE,
+                                                      np.diff(route_lon) * KM_PER_DEGREE * np.cos(np.radians(route_lat[:-1]))))))
+    position = (np.arange(points) * 0.017) % along[-1]
+    lat = np.interp(position, along, route_lat) + rng.normal(0, 0.01 / KM_PER_DEGREE, points)
+    lon = np.interp(position, along, route_lon) + rng.normal(0, 0.01 / KM_PER_DEGREE, points)
+    detour = (np.arange(points) % 5000) >= 4880
+    lat[detour] += 2.0 / KM_PER_DEGREE
+    return lat, lon
+
+
+def benchmark(segments, points, batch):
+    route_lat, route_lon = synthetic_route(segments)
+    start = time.perf_counter_ns()
+    route = Route(route_lat, route_lon)
+    print(f"route: {segments} segments, {route.along[-1]:.0f} km, grid {route.rows}x{route.cols} built in "
+          f"{(time.perf_counter_ns() - start) / 1e6:.0f} ms; {points} points, {DEVIATION_M:.0f} m threshold")
+    lat, lon = synthetic_drive(route_lat, route_lon, points)
+
+    # naive: every point against every segment, on a sample spread over the drive (detours included)
+    sample = np.arange(0, points, max(points // 2000, 1))
+    start = time.perf_counter_ns()
+    reference = np.array([route.brute_force(lat[i], lon[i])[1] <= route.threshold_km for i in sample])
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    print(f"{'brute force':<26} {len(sample) / elapsed:10,.0f} points/s")
+
+    start = time.perf_counter_ns()
+    grid = np.array([route.nearest(lat[i], lon[i]) is not None for i in range(points)])
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    print(f"{'grid per point':<26} {points / elapsed:10,.0f} points/s")
+
+    for label, size in (('tracked, 1 point', 1), (f"tracked, batches of {batch}", batch)):
+        monitor = Route_Monitor(route)
+        start = time.perf_counter_ns()
+        on_route = np.concatenate([monitor.update('vehicle', lat[i:i + size], lon[i:i + size]) >= 0 for i in range(0, points, size)])
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        print(f"{label:<26} {points / elapsed:10,.0f} points/s ({monitor.stats['window'] * 100 / points:.1f}% in the window, "
+              f"{monitor.stats['off_route']} off route, {monitor.stats['alerts']} alerts), "
+              f"{int((on_route != grid).sum())} differ from the grid")
+    print(f"grid vs brute force: {int((grid[sample] != reference).sum())} of {len(sample)} on/off route decisions differ "
+          f"({int((~reference).sum())} off route)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Route deviation matching benchmark')
+    parser.add_argument('--segments', default=50000, type=int, help='Route segments')
+    parser.add_argument('--points', default=50000, type=int, help='GPS points')
+    parser.add_argument('--batch', default=32, type=int, help='Points per batch (a vehicle\'s records in one uplink batch)')
+
+    args = parser.parse_args()
+    benchmark(args.segments, args.points, args.batch)
+
+# python3 routeMonitor.py --segments 50000 --points 50000 --batch 32
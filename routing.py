@@ -0,0 +1,75 @@
+# routing.py
+# The routing.py file contains the Routing_Table class that maps a SourceDestID to its transport endpoint.
+# The table is loaded from a YAML file (routes.yaml) into a lookup array indexed by the 1-byte SourceDestID,
+# and is reloaded atomically on SIGHUP.
+# The class contains the following attributes:
+# - routes_file: The YAML file the routes are loaded from
+# - routes: (endpoint array, group dict) swapped as one reference on reload
+
+import os
+import signal
+import threading
+import yaml
+from packet import *
+
+ROUTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routes.yaml')
+ROUTE_TABLE_LEN = 256   # SourceDestID is 1 byte
+SOURCE_DEST_LABEL_MAP = {member.label: member.value for member in SourceDestID}
+
+
+class Routing_Table:
+    def __init__(self, logger, routes_file=ROUTES_FILE):
+        self.logger = logger
+        self.routes_file = routes_file
+        self.routes = ([None] * ROUTE_TABLE_LEN, {})
+        self.reload_lock = threading.Lock()
+
+        if not self.reload():
+            raise ValueError(f"Unable to load routes from {self.routes_file}")
+
+    @staticmethod
+    def label_to_id(label):
+        if label not in SOURCE_DEST_LABEL_MAP:
+            raise ValueError(f"No matching SourceDestID for label: {label}")
+        return SOURCE_DEST_LABEL_MAP[label]
+
+    @staticmethod
+    def load(routes_file):
+        with open(routes_file, 'r') as file:
+            config = yaml.safe_load(file) or {}
+
+        table = [None] * ROUTE_TABLE_LEN
+        for label, endpoint in (config.get('endpoints') or {}).items():
+            table[Routing_Table.label_to_id(label)] = (endpoint['ip_addr'], int(endpoint['port']))
+
+        groups = {}
+        for label, endpoint in (config.get('groups') or {}).items():
+            groups[Routing_Table.label_to_id(label)] = (endpoint['ip_addr'], int(endpoint['port']))
+
+        return table, groups
+
+    def reload(self):
+        # Build the new table completely before publishing it; senders keep using the old one until the swap
+        with self.reload_lock:
+            try:
+                routes = self.load(self.routes_file)
+            except Exception as e:
+                self.logger.message("ERROR", "routing", f"Reload of {self.routes_file} failed, keeping current routes: {e}")
+                return False
+
+            self.routes = routes
+            self.logger.message("INFO", "routing", f"Loaded {sum(x is not None for x in routes[0])} endpoints, {len(routes[1])} groups from {self.routes_file}")
+            return True
+
+    def resolve(self, dest_id):
+        """Return the (ip, port) endpoint for a SourceDestID value, or None."""
+        return self.routes[0][dest_id]
+
+    def group(self, group_id):
+        """Return the (ip, port) multicast group for a fan-out group ID, or None."""
+        return self.routes[1].get(group_id)
+
+    def install_sighup(self):
+        # Signal handlers run on the main thread; do the file I/O off it
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=self.reload, daemon=True).start())
+        self.logger.message("INFO", "routing", "Reload on SIGHUP enabled")
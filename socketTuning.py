@@ -0,0 +1,201 @@
+# socketTuning.py
+# The socketTuning.py file contains the Socket_Tuning class applied to the receive socket of a role: SO_RCVBUF and
+# SO_SNDBUF sizes, SO_BUSY_POLL, and SO_RXQ_OVFL so each recvmsg carries the kernel's count of datagrams dropped on
+# the socket (receive buffer full). Without SO_RXQ_OVFL the same counter is read from /proc/net/udp.
+# The class contains the following attributes:
+# - rcvbuf/sndbuf/busy_poll: Requested values (None: kernel default)
+# - effective: Values read back after setsockopt (the kernel doubles buffer sizes and caps them at rmem_max/wmem_max)
+# - stats: received datagrams and kernel drops, logged when the drop count grows
+
+import argparse
+import os
+import socket
+import struct
+import time
+from packet import *
+
+# Linux option numbers; the socket module does not export them
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+SO_SNDBUFFORCE = getattr(socket, 'SO_SNDBUFFORCE', 32)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)
+DROPS = struct.Struct('=I')
+CMSG_SPACE = socket.CMSG_SPACE(DROPS.size)
+STATS_INTERVAL = 10.0       # seconds between drop log lines
+DROP_POLL_INTERVAL = 1.0    # seconds between /proc/net/udp reads of a receive loop without SO_RXQ_OVFL
+PROC_NET_UDP = ('/proc/net/udp', '/proc/net/udp6')
+
+
+def read_sysctl(name):
+    try:
+        with open('/proc/sys/' + name.replace('.', '/'), 'r') as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError):
+        return None
+
+
+def proc_udp_drops(sock):
+    """Kernel drop counter of a UDP socket from /proc/net/udp (matched by inode), or None."""
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for path in PROC_NET_UDP:
+        try:
+            with open(path, 'r') as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 13 and fields[9] == inode:
+                        return int(fields[12])
+        except OSError:
+            continue
+    return None
+
+
+class Socket_Tuning:
+    def __init__(self, rcvbuf=None, sndbuf=None, busy_poll=None, rxq_ovfl=True, logger=None):
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.busy_poll = busy_poll
+        self.rxq_ovfl = rxq_ovfl
+        self.logger = logger
+        self.effective = {}
+        self.stats = {'received': 0, 'drops': 0}
+        self.reported_drops = 0
+        self.reported = time.monotonic()
+
+    def log(self, level, text):
+        if self.logger is not None:
+            self.logger.message(level, "socket", text)
+
+    def set_buffer(self, sock, option, force_option, size, limit_sysctl):
+        # above the sysctl limit only the privileged *FORCE option gets the full size
+        limit = read_sysctl(limit_sysctl)
+        if limit is not None and size > limit:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, force_option, size)
+                return
+            except OSError:
+                self.log("WARNING", f"{size} bytes exceeds {limit_sysctl}={limit}; raise it or run with CAP_NET_ADMIN")
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+
+    def apply(self, sock):
+        """Set the requested options on a socket; returns the effective values."""
+        if self.rcvbuf:
+            self.set_buffer(sock, socket.SO_RCVBUF, SO_RCVBUFFORCE, self.rcvbuf, 'net.core.rmem_max')
+        if self.sndbuf:
+            self.set_buffer(sock, socket.SO_SNDBUF, SO_SNDBUFFORCE, self.sndbuf, 'net.core.wmem_max')
+        if self.busy_poll:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, self.busy_poll)
+            except OSError as e:
+                self.log("WARNING", f"SO_BUSY_POLL {self.busy_poll} us not set: {e.strerror}")
+        if self.rxq_ovfl and sock.type == socket.SOCK_DGRAM:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            except OSError as e:
+                self.rxq_ovfl = False
+                self.log("WARNING", f"SO_RXQ_OVFL not available ({e.strerror}); drops are read from /proc/net/udp")
+
+        self.effective = {'rcvbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                          'sndbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)}
+        try:
+            self.effective['busy_poll'] = sock.getsockopt(socket.SOL_SOCKET, SO_BUSY_POLL)
+        except OSError:
+            pass
+        self.log("INFO", ", ".join(f"{name}: {value}" for name, value in self.effective.items()) +
+                 f", drop accounting: {'SO_RXQ_OVFL' if self.rxq_ovfl else '/proc/net/udp'}")
+        return self.effective
+
+    # Set Receive =================================================================================================================================
+    def receiver(self, sock):
+        """recvfrom-compatible function for the receive loop; with SO_RXQ_OVFL it also tracks the drop counter."""
+        if not self.rxq_ovfl:
+            # no drop count on the datagrams: read it from /proc/net/udp, at most once per DROP_POLL_INTERVAL
+            polled = [time.monotonic()]
+
+            def receive(size, flags=0):
+                result = sock.recvfrom(size, flags)
+                self.stats['received'] += 1
+                now = time.monotonic()
+                if now - polled[0] >= DROP_POLL_INTERVAL:
+                    polled[0] = now
+                    self.poll_drops(sock)
+                return result
+            return receive
+
+        def receive(size, flags=0):
+            data, ancdata, _, addr = sock.recvmsg(size, CMSG_SPACE, flags)
+            self.stats['received'] += 1
+            for level, kind, value in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(value) >= DROPS.size:
+                    drops = DROPS.unpack_from(value)[0]
+                    if drops != self.stats['drops']:
+                        self.stats['drops'] = drops
+                        self.report_drops()
+            return data, addr
+        return receive
+
+    def poll_drops(self, sock):
+        # for receivers without SO_RXQ_OVFL and sockets not read through receiver() (asyncio transports)
+        drops = proc_udp_drops(sock)
+        if drops is not None and drops != self.stats['drops']:
+            self.stats['drops'] = drops
+            self.report_drops()
+        return self.stats['drops']
+
+    def report_drops(self):
+        now = time.monotonic()
+        if now - self.reported < STATS_INTERVAL:
+            return
+        self.log("WARNING", f"kernel drops: {self.stats['drops']} (+{self.stats['drops'] - self.reported_drops} in {now - self.reported:.0f} s), "
+                            f"received: {self.stats['received']}, rcvbuf: {self.effective.get('rcvbuf')}")
+        self.reported = now
+        self.reported_drops = self.stats['drops']
+
+
+# Benchmark: datagrams dropped by a burst against the receive buffer size ==========================================================================
+def benchmark(burst, size, buffers):
+    payload = b'\0' * max(size - 12, 0)
+    packet = struct.pack('!BBHHHHH', SourceDestID.D_IVI.value, SourceDestID.CCU.value, ServiceID.D_IVI_CONTROL.value,
+                         0, 1, 1, len(payload)) + payload
+    print(f"burst of {burst} x {len(packet)} B datagrams, receiver not reading during the burst "
+          f"(rmem_max {read_sysctl('net.core.rmem_max')})")
+    print(f"{'requested':>10} {'effective':>10} {'received':>9} {'drops':>7} {'/proc':>7} {'loss':>7}")
+    for rcvbuf in buffers:
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        tuning = Socket_Tuning(rcvbuf=rcvbuf or None)
+        effective = tuning.apply(receiver)['rcvbuf']
+        receiver.bind(('127.0.0.1', 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for _ in range(burst):
+            sender.sendto(packet, receiver.getsockname())
+        proc_drops = proc_udp_drops(receiver)
+
+        receiver.setblocking(False)
+        receive = tuning.receiver(receiver)
+        while True:
+            try:
+                receive(65535)
+            except BlockingIOError:
+                break
+        received = tuning.stats['received']
+        # a datagram carries the drop count at its enqueue time: the first one after the burst reports the burst's drops
+        sender.sendto(packet, receiver.getsockname())
+        receiver.setblocking(True)
+        receive(65535)
+        print(f"{rcvbuf or 'default':>10} {effective:10d} {received:9d} {tuning.stats['drops']:7d} {proc_drops if proc_drops is not None else '-':>7} "
+              f"{(burst - received) * 100 / burst:6.1f}%")
+        sender.close()
+        receiver.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Receive buffer sizing: drops of a datagram burst per SO_RCVBUF')
+    parser.add_argument('--burst', default=20000, type=int, help='Datagrams per burst')
+    parser.add_argument('--size', default=200, type=int, help='Datagram size in bytes')
+    parser.add_argument('--buffers', default='0,65536,262144,1048576,4194304,16777216',
+                        help='Comma separated SO_RCVBUF sizes to try (0: kernel default)')
+
+    args = parser.parse_args()
+    benchmark(args.burst, args.size, [int(value) for value in args.buffers.split(',')])
+
+# python3 socketTuning.py --burst 20000 --size 200
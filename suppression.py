@@ -0,0 +1,119 @@
+# suppression.py
+# The suppression.py file contains the Send_Suppressor class, the duplicate suppression stage of the UDP_Control
+# send path. DMS logic re-emits the same driver state warning every frame while the driver stays drowsy; only
+# the first packet, state changes and periodic keepalives need to reach the link.
+# Only the DMS streams are suppressed (WARNING_STREAMS, DUPLICATE_STREAMS); everything else, request/response
+# traffic in particular, is always sent: a P-IVI asking twice gets two answers.
+# The class contains the following attributes:
+# - recent: Bounded TTL cache of (header, payload hash) -> last forward time for DUPLICATE_STREAMS
+# - states: Per-stream warning state machine (raised/cleared) for the DMS warning streams
+# - stats: Forwarded and suppressed counters
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+from packet import *
+from payloadSchema import SCHEMA_REGISTRY
+
+KEEPALIVE_INTERVAL = 1.0    # seconds between forwarded repeats of an unchanged message
+MAX_ENTRIES = 4096          # cache entries (duplicates and warning streams each)
+STATS_INTERVAL = 10.0       # seconds between stats log lines while suppressing
+
+HEADER = struct.Struct('!BBHHHHH')
+
+# Warning streams: IFT ID -> {IFT type: warning state}; raise and clear share one stream
+WARNING_STREAMS = {
+    IFTID.IFT_12_03.value: {IFT_12_03_Type.TYPE_0002.value: 'raised', IFT_12_03_Type.TYPE_0004.value: 'cleared'},
+    IFTID.IFT_12_04.value: {IFT_12_04_Type.TYPE_0002.value: 'raised', IFT_12_04_Type.TYPE_0004.value: 'cleared'},
+}
+# Per-frame DMS recognition results: IFT ID -> IFT types; identical packets are sent once per keepalive
+DUPLICATE_STREAMS = {
+    IFTID.IFT_12_03.value: {IFT_12_03_Type.TYPE_0001.value},
+    IFTID.IFT_12_04.value: {IFT_12_04_Type.TYPE_0001.value},
+}
+
+
+class Send_Suppressor:
+    def __init__(self, logger=None, keepalive=KEEPALIVE_INTERVAL, max_entries=MAX_ENTRIES):
+        self.logger = logger
+        self.keepalive = keepalive
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.recent = OrderedDict()     # (header, payload hash) -> forwarded time, oldest first
+        self.states = OrderedDict()     # (source, dest, service, IFT ID) -> (state, forwarded time)
+        self.stats = {'forwarded': 0, 'suppressed': 0, 'state_changes': 0, 'keepalives': 0, 'evicted': 0}
+        self.reported = time.monotonic()
+
+    # Set Filter ==================================================================================================================================
+    def check(self, data):
+        """True if data should be sent, False if it repeats what the link already has."""
+        if data is None or len(data) < HEADER.size:
+            return True
+        source_id, dest_id, service_id, message_type, ift_id, ift_type, _ = HEADER.unpack_from(data, 0)
+        warning = WARNING_STREAMS.get(ift_id)
+        warning_state = warning.get(ift_type) if warning is not None else None
+        if warning_state is None and ift_type not in DUPLICATE_STREAMS.get(ift_id, ()):
+            return True
+        now = time.monotonic()
+
+        with self.lock:
+            if warning_state is not None:
+                forward = self.check_state((source_id, dest_id, service_id, ift_id), warning_state,
+                                           ift_id, ift_type, data, now)
+            else:
+                forward = self.check_duplicate((bytes(data[:HEADER.size]), hash(bytes(data[HEADER.size:]))), now)
+            self.stats['forwarded' if forward else 'suppressed'] += 1
+            report = self.stats['suppressed'] and now - self.reported >= STATS_INTERVAL
+            if report:
+                self.reported = now
+
+        if report:
+            self.report()
+        return forward
+
+    def check_duplicate(self, key, now):
+        # entries are kept in forward order, so expired ones are always at the front
+        while self.recent:
+            oldest_key, forwarded = next(iter(self.recent.items()))
+            if now - forwarded < self.keepalive:
+                break
+            del self.recent[oldest_key]
+
+        if key in self.recent:
+            return False
+        self.recent[key] = now
+        if len(self.recent) > self.max_entries:
+            self.recent.popitem(last=False)
+            self.stats['evicted'] += 1
+        return True
+
+    def check_state(self, stream, warning_state, ift_id, ift_type, data, now):
+        # state: raised/cleared plus the driver state and level when the payload has a schema
+        state = (warning_state,)
+        record = SCHEMA_REGISTRY.decode(ift_id, ift_type, data[HEADER.size:])
+        if record is not None:
+            state += (record['driver_state'], record['warning_level'])
+
+        previous = self.states.get(stream)
+        if previous is not None and previous[0] == state:
+            if now - previous[1] < self.keepalive:
+                return False
+            self.stats['keepalives'] += 1
+        else:
+            self.stats['state_changes'] += 1
+            if self.logger:
+                self.logger.message("INFO", "suppress", f"Warning {warning_state} IFT {ift_id}:{ift_type} {stream[0]}->{stream[1]}")
+
+        self.states[stream] = (state, now)
+        self.states.move_to_end(stream)
+        if len(self.states) > self.max_entries:
+            self.states.popitem(last=False)
+            self.stats['evicted'] += 1
+        return True
+
+    # Set Stats ===================================================================================================================================
+    def report(self):
+        if self.logger:
+            stats = dict(self.stats)
+            self.logger.message("INFO", "suppress", ", ".join(f"{name}: {count}" for name, count in stats.items()))
@@ -2,12 +2,13 @@
 # The tcp.py file contains a class called TCP that is used to send and receive TCP messages.
 
 import socket
+import select
 import struct
+import threading
 import argparse
 import time
 from time import sleep
-import netifaces
-import netaddr
+from packetValidator import Packet_Validator
 from packet import *
 
 class TCP_Control:
@@ -16,6 +17,14 @@ class TCP_Control:
         self.src_ip_addr = src_ip_addr
         self.src_port = src_port
         self.logger = logger
+        # Optional receive-path stage (admission.Admission_Control); over-budget connections are closed unread
+        self.admission = None
+        # Optional restart/shutdown control (lifecycle.Lifecycle): the listening socket is handed to a successor process
+        self.lifecycle = None
+        self.stopping = threading.Event()
+        self.stopped = threading.Event()
+        # Validating decode stage: malformed packets are counted and quarantined instead of reaching the handler
+        self.validator = Packet_Validator(self.logger)
 
         self.logger.message("INFO", "TCP", f"Source IP Address: {self.src_ip_addr}")
         self.logger.message("INFO", "TCP", f"Source Port: {self.src_port}")
@@ -24,6 +33,8 @@ class TCP_Control:
         self.logger.message("ERROR", "error", f"Error: {error_msg}")
 
     def get_default_interface(self):
+        import netifaces    # only needed here; keep it off the startup path
+
         routes = netifaces.gateways()
         
         if 'default' in routes and netifaces.AF_INET in routes['default']:
@@ -32,6 +43,8 @@ class TCP_Control:
         return None
 
     def get_interface_ip(self, interface_name):
+        import netifaces
+
         addresses = netifaces.ifaddresses(interface_name)
         if netifaces.AF_INET in addresses:
             for link in addresses[netifaces.AF_INET]:
@@ -45,21 +58,39 @@ class TCP_Control:
             host = self.src_ip_addr
             port = self.src_port
 
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            tcp_sock.bind((host, port))
-            tcp_sock.listen(1)
-
-            self.logger.message("INFO", "server", f"{self.system}: {host}:{port}")
+            # a successor of a restart accepts on the socket its predecessor listens on; pending connections are kept
+            key = f"tcp:{host}:{port}"
+            tcp_sock = self.lifecycle.adopt(key) if self.lifecycle is not None else None
+            adopted = tcp_sock is not None
+            if not adopted:
+                tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                tcp_sock.bind((host, port))
+                tcp_sock.listen(1)
+            if self.lifecycle is not None:
+                self.lifecycle.register(key, tcp_sock, self.stop)
+
+            self.logger.message("INFO", "server", f"{self.system}: {host}:{port}" + (" (inherited)" if adopted else ""))
             
-            while True:
+            while not self.stopping.is_set():
+                if self.lifecycle is not None and not select.select([tcp_sock], [], [], 0.05)[0]:
+                    continue
                 conn, addr = tcp_sock.accept()
                 received_data = conn.recv(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
                 tcp_client_ip = addr[0]
+                if self.admission is not None and not self.admission.admit(received_data, tcp_client_ip, defer=False):
+                    conn.close()
+                    continue
+                if not self.validator.validate(received_data, tcp_client_ip):
+                    conn.close()
+                    continue
                 self.logger.message("INFO", "Received", f"TCP client({tcp_client_ip}): {received_data}")
 
                 if message_handler:
-                    message_handler(received_data)
+                    try:
+                        message_handler(received_data)
+                    except Exception as e:
+                        self.validator.handler_error(received_data, tcp_client_ip, e)
                 elif message_handler is None:
                     self.logger.message("INFO", "Received", "No message handler provided.")
 
@@ -67,6 +98,13 @@ class TCP_Control:
             print(f"Connection to {self.src_ip_addr}:{self.src_port} refused.")
         except Exception as e:
             print(f"An error occurred while sending the TCP message: {e}")
+        finally:
+            self.stopped.set()
+
+    def stop(self, timeout=None):
+        # Ends the accept loop after the connection being handled; the listening socket stays open for a successor
+        self.stopping.set()
+        return self.stopped.wait(timeout)
 
     # Set TCP Client ===========================================================================================================================
     def tcp_client(self, dest_ip_addr, dest_port, data):
@@ -0,0 +1,413 @@
+# timeSeriesStore.py
+# The timeSeriesStore.py file contains the fixed-memory history of vehicle signals behind the Cloud vehicle status
+# services: start-up diagnostics (IFT_13_05, TYPE_0008 status history) and in-drive warning lights (IFT_13_06).
+# Each signal owns a slot in preallocated NumPy ring buffers: raw samples, 1 s and 1 min buckets (min/max/sum/count).
+# Appending a batch of samples writes the raw ring and folds the samples into the open bucket of each tier; a bucket
+# is written to its ring once a later sample closes it. Old data falls out of each ring; the coarser tiers reach
+# further back. The rings can live in .npy files mapped into memory (the directory persists across restarts).
+# A range query reads the coarsest tier that is no coarser than the requested resolution and still holds the start of
+# the range, and aggregates it further to the resolution.
+# The class contains the following attributes:
+# - slots: Signal name -> slot; names are '<vehicle>/<signal>', e.g. '9f3c0a1d22e4b870/battery_v' (the CCU's uplink
+#   epoch) or '10.0.0.7:5/light.3.state' (address and source ID of a role sending single packets).
+#   A vehicle takes 2 + 2 x lights slots (signal_slots sizes a store for a fleet). Once every slot is taken, a new
+#   signal takes over the slot written least recently (by sample time), so vehicles that left the fleet free their
+#   slots, also in a store reopened after a restart. signals.json is rewritten once per batch of new signals
+# - arrays: The ring buffers and per-slot state by name (raw_t, raw_v, 1s_t, 1s_min, ..., head, open_*, last_t)
+# - stats: samples stored, late samples dropped, signals evicted to make room for new ones
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from packet import *
+from payloadSchema import SCHEMA_REGISTRY
+
+TIERS = (('raw', 0), ('1s', 1000), ('1min', 60000))     # name, bucket size in ms
+RAW_POINTS = 4096           # raw samples kept per signal
+SECOND_POINTS = 3600        # 1 s buckets kept per signal (1 hour)
+MINUTE_POINTS = 1440        # 1 min buckets kept per signal (1 day)
+LIGHTS_PER_VEHICLE = 16     # warning lights an IFT_13_06 record reports
+SIGNALS_PER_VEHICLE = 2 + 2 * LIGHTS_PER_VEHICLE    # battery_v, dtc_count, state and value per light
+MAX_SIGNALS = 256           # slots of a new store; memory is fixed at about 240 KiB per slot
+SIGNALS_FILE = 'signals.json'
+NO_TIME = np.iinfo(np.int64).min
+STATS_INTERVAL = 10.0       # seconds between stats log lines
+
+BUCKET_FIELDS = (('t', np.int64), ('min', np.float64), ('max', np.float64), ('sum', np.float64), ('count', np.int64))
+
+
+def reduce_buckets(times, mins, maxs, sums, counts, bucket_ms):
+    """Aggregate time-ordered samples or buckets into buckets of bucket_ms: (start, min, max, sum, count) arrays."""
+    starts = times // bucket_ms * bucket_ms
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+    return (starts[first], np.minimum.reduceat(mins, first), np.maximum.reduceat(maxs, first),
+            np.add.reduceat(sums, first), np.add.reduceat(counts, first))
+
+
+def signal_slots(vehicles, lights=LIGHTS_PER_VEHICLE):
+    """Slots holding every signal of a fleet of vehicles (about 240 KiB each)."""
+    return vehicles * (2 + 2 * lights)
+
+
+def vehicle_name(vehicle):
+    """Signal name prefix of a Cloud sink record's vehicle: (address, uplink epoch) of a CCU batch or (address,
+    source ID) of a single packet. The epoch is persisted by the CCU, so it names the vehicle across restarts and
+    address changes, and apart from other vehicles behind the same NAT."""
+    if not isinstance(vehicle, tuple):
+        return str(vehicle)
+    address, key = vehicle
+    # source IDs are one byte, epochs 64 random bits
+    return f"{key:016x}" if key > 0xFF else f"{address}:{key}"
+
+
+class Time_Series_Store:
+    def __init__(self, max_signals=MAX_SIGNALS, directory=None, raw_points=RAW_POINTS, second_points=SECOND_POINTS,
+                 minute_points=MINUTE_POINTS, logger=None):
+        self.max_signals = max_signals
+        self.directory = directory
+        self.capacities = (raw_points, second_points, minute_points)
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.stats = {'samples': 0, 'late': 0, 'signals_evicted': 0}
+        self.reported = time.monotonic()
+
+        shapes = {'raw_t': ((max_signals, raw_points), np.int64, NO_TIME), 'raw_v': ((max_signals, raw_points), np.float64, 0)}
+        for tier, (name, _) in enumerate(TIERS[1:], 1):
+            for field, dtype in BUCKET_FIELDS:
+                shapes[f"{name}_{field}"] = ((max_signals, self.capacities[tier]), dtype, NO_TIME if field == 't' else 0)
+        # samples (raw) or buckets (1s, 1min) written per slot and tier, and the open bucket per slot and tier
+        shapes['head'] = ((max_signals, len(TIERS)), np.int64, 0)
+        shapes['last_t'] = ((max_signals,), np.int64, NO_TIME)
+        for field, dtype in BUCKET_FIELDS:
+            shapes[f"open_{field}"] = ((max_signals, len(TIERS)), dtype, 0)
+
+        self.slots = {}
+        self.slots_changed = False      # slots not yet in signals.json
+        self.arrays = {}
+        self.fills = {name: fill for name, (_, _, fill) in shapes.items()}
+        if directory is None:
+            for name, (shape, dtype, fill) in shapes.items():
+                self.arrays[name] = np.full(shape, fill, dtype=dtype)
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SIGNALS_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.slots = json.load(f)
+        for name, (shape, dtype, fill) in shapes.items():
+            file_path = os.path.join(directory, name + '.npy')
+            if os.path.exists(file_path):
+                array = np.lib.format.open_memmap(file_path, mode='r+')
+                if array.shape != shape or array.dtype != dtype:
+                    raise ValueError(f"{file_path} holds {array.dtype}{array.shape}, expected {np.dtype(dtype)}{shape}")
+            else:
+                array = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=shape)
+                if fill:
+                    array[...] = fill
+            self.arrays[name] = array
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            if len(self.slots) < self.max_signals:
+                slot = len(self.slots)
+            else:
+                slot = int(np.argmin(self.arrays['last_t']))
+                del self.slots[next(signal for signal, index in self.slots.items() if index == slot)]
+                for array_name, array in self.arrays.items():
+                    array[slot] = self.fills[array_name]
+                self.stats['signals_evicted'] += 1
+            self.slots[name] = slot
+            self.slots_changed = True
+        return slot
+
+    def save_slots(self):
+        # caller holds the lock
+        if self.directory is None or not self.slots_changed:
+            return
+        path = os.path.join(self.directory, SIGNALS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.slots, f)
+        os.replace(path + '.tmp', path)
+        self.slots_changed = False
+
+    # Set Writer ==================================================================================================================================
+    def append(self, name, time_ms, value):
+        return self.append_many(name, (time_ms,), (value,))
+
+    def append_many(self, name, times_ms, values, save=True):
+        """Add samples of one signal (ms since the epoch); samples not after the signal's last one are dropped.
+        save=False leaves a new signal's slot out of signals.json until save_slots (add_packets: once per batch)."""
+        times = np.asarray(times_ms, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(times) == 0:
+            return 0
+        with self.lock:
+            slot = self.slot(name)
+            if save:
+                self.save_slots()
+            if len(times) > 1 and not (times[1:] > times[:-1]).all():
+                order = np.argsort(times, kind='stable')
+                times, values = times[order], values[order]
+            keep = times > self.arrays['last_t'][slot]
+            keep[1:] &= times[1:] > times[:-1]
+            if not keep.all():
+                self.stats['late'] += int(len(keep) - keep.sum())
+                times, values = times[keep], values[keep]
+                if len(times) == 0:
+                    return 0
+            self.arrays['last_t'][slot] = times[-1]
+            self.ring_write(slot, 0, (('raw_t', times), ('raw_v', values)))
+            counts = np.ones(len(times), dtype=np.int64)
+            for tier in range(1, len(TIERS)):
+                self.fold(slot, tier, times, values, values, values, counts)
+            self.stats['samples'] += len(times)
+        self.report_if_due()
+        return len(times)
+
+    def ring_write(self, slot, tier, columns):
+        capacity = self.capacities[tier]
+        head = int(self.arrays['head'][slot, tier])
+        count = len(columns[0][1])
+        if count > capacity:
+            # only the newest capacity entries survive
+            columns = [(name, values[count - capacity:]) for name, values in columns]
+            head += count - capacity
+            count = capacity
+        position = head % capacity
+        first = min(capacity - position, count)
+        for name, values in columns:
+            array = self.arrays[name]
+            array[slot, position:position + first] = values[:first]
+            array[slot, :count - first] = values[first:]
+        self.arrays['head'][slot, tier] = head + count
+
+    def fold(self, slot, tier, times, mins, maxs, sums, counts):
+        arrays = self.arrays
+        name, bucket_ms = TIERS[tier]
+        starts, mins, maxs, sums, counts = reduce_buckets(times, mins, maxs, sums, counts, bucket_ms)
+        if arrays['open_count'][slot, tier]:
+            if starts[0] == arrays['open_t'][slot, tier]:
+                mins[0] = min(mins[0], arrays['open_min'][slot, tier])
+                maxs[0] = max(maxs[0], arrays['open_max'][slot, tier])
+                sums[0] += arrays['open_sum'][slot, tier]
+                counts[0] += arrays['open_count'][slot, tier]
+            else:
+                starts, mins, maxs, sums, counts = (np.concatenate(([arrays[f"open_{field}"][slot, tier]], values))
+                                                    for (field, _), values in zip(BUCKET_FIELDS, (starts, mins, maxs, sums, counts)))
+        # every bucket but the last is closed by a later sample
+        if len(starts) > 1:
+            self.ring_write(slot, tier, [(f"{name}_{field}", values[:-1])
+                                         for (field, _), values in zip(BUCKET_FIELDS, (starts, mins, maxs, sums, counts))])
+        for (field, _), values in zip(BUCKET_FIELDS, (starts, mins, maxs, sums, counts)):
+            arrays[f"open_{field}"][slot, tier] = values[-1]
+
+    def flush(self):
+        with self.lock:
+            self.save_slots()
+            for array in self.arrays.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+
+    def close(self):
+        self.flush()
+
+    # Set Query ===================================================================================================================================
+    def covers(self, slot, tier, start_ms):
+        # True if the tier has not yet dropped anything at or after start_ms
+        head = int(self.arrays['head'][slot, tier])
+        capacity = self.capacities[tier]
+        if head <= capacity:
+            return True
+        return self.arrays[f"{TIERS[tier][0]}_t"][slot, head % capacity] <= start_ms
+
+    def pick_tier(self, slot, start_ms, resolution_ms):
+        """The coarsest tier no coarser than the resolution, or a coarser one if it no longer holds start_ms."""
+        tier = max(index for index, (_, bucket_ms) in enumerate(TIERS) if bucket_ms <= resolution_ms)
+        while tier < len(TIERS) - 1 and not self.covers(slot, tier, start_ms):
+            tier += 1
+        return tier
+
+    def ring_range(self, slot, tier, fields, start_ms, end_ms):
+        # the ring holds time-ordered entries rotated by head: search the older and the newer part
+        name = TIERS[tier][0]
+        head = int(self.arrays['head'][slot, tier])
+        capacity = self.capacities[tier]
+        position = head % capacity
+        parts = ((0, head),) if head <= capacity else ((position, capacity), (0, position))
+        times = self.arrays[f"{name}_t"][slot]
+        ranges = []
+        for low, high in parts:
+            first = low + int(np.searchsorted(times[low:high], start_ms, 'left'))
+            last = low + int(np.searchsorted(times[low:high], end_ms, 'left'))
+            if last > first:
+                ranges.append((first, last))
+        return [np.concatenate([self.arrays[f"{name}_{field}"][slot, first:last] for first, last in ranges])
+                if ranges else np.empty(0, dtype=self.arrays[f"{name}_{field}"].dtype) for field in fields]
+
+    def query(self, name, start_ms=None, end_ms=None, resolution_ms=None, tier=None):
+        """Buckets of one signal in [start_ms, end_ms) at resolution_ms (None: the finest stored).
+        Returns {'tier', 'resolution_ms', 't', 'min', 'max', 'mean', 'count'} or None for an unknown signal."""
+        slot = self.slots.get(name)
+        if slot is None:
+            return None
+        start_ms = NO_TIME if start_ms is None else start_ms
+        end_ms = np.iinfo(np.int64).max if end_ms is None else end_ms
+        with self.lock:
+            if tier is None:
+                tier = self.pick_tier(slot, start_ms, resolution_ms or 0)
+            if tier == 0:
+                times, values = self.ring_range(slot, 0, ('t', 'v'), start_ms, end_ms)
+                mins = maxs = sums = values
+                counts = np.ones(len(times), dtype=np.int64)
+            else:
+                times, mins, maxs, sums, counts = self.ring_range(slot, tier, [field for field, _ in BUCKET_FIELDS], start_ms, end_ms)
+                open_t = self.arrays['open_t'][slot, tier]
+                if self.arrays['open_count'][slot, tier] and start_ms <= open_t < end_ms:
+                    times, mins, maxs, sums, counts = (np.append(values, self.arrays[f"open_{field}"][slot, tier])
+                                                       for (field, _), values in zip(BUCKET_FIELDS, (times, mins, maxs, sums, counts)))
+        bucket_ms = TIERS[tier][1]
+        if resolution_ms and resolution_ms > bucket_ms and len(times):
+            times, mins, maxs, sums, counts = reduce_buckets(times, mins, maxs, sums, counts, resolution_ms)
+            bucket_ms = resolution_ms
+        return {'tier': TIERS[tier][0], 'resolution_ms': bucket_ms, 't': times, 'min': mins, 'max': maxs,
+                'mean': sums / np.maximum(counts, 1), 'count': counts}
+
+    # Set Ingest ==================================================================================================================================
+    def add_packets(self, records):
+        """Store the signals of diagnostics (IFT_13_05) and warning light (IFT_13_06) records among (vehicle, time, ProtocolPacket).
+        Signals are named by vehicle_name."""
+        diagnostics = IFTID.IFT_13_05.value
+        lights = IFTID.IFT_13_06.value
+        samples = {}
+
+        def add(name, time_ms, value):
+            entry = samples.get(name)
+            if entry is None:
+                entry = samples[name] = ([], [])
+            entry[0].append(time_ms)
+            entry[1].append(value)
+
+        for vehicle, _, packet in records:
+            if packet.ift_id != diagnostics and packet.ift_id != lights:
+                continue
+            record = SCHEMA_REGISTRY.decode(packet.ift_id, packet.ift_type, packet.payload_data)
+            if record is None:
+                continue
+            prefix = vehicle_name(vehicle)
+            time_ms = record['timestamp_ms']
+            if packet.ift_id == diagnostics:
+                add(f"{prefix}/battery_v", time_ms, record['battery_v'])
+                add(f"{prefix}/dtc_count", time_ms, len(record['dtcs']))
+            else:
+                for light in record['lights']:
+                    add(f"{prefix}/light.{light['light_id']}.state", time_ms, light['state'])
+                    add(f"{prefix}/light.{light['light_id']}.value", time_ms, light['value'])
+        for name, (times, values) in samples.items():
+            self.append_many(name, times, values, save=False)
+        if samples:
+            with self.lock:
+                self.save_slots()
+
+    def report_if_due(self):
+        now = time.monotonic()
+        if self.logger is not None and now - self.reported >= STATS_INTERVAL:
+            self.reported = now
+            self.logger.message("INFO", "history", f"signals: {len(self.slots)}/{self.max_signals}, " +
+                                ", ".join(f"{name}: {count}" for name, count in self.stats.items()))
+
+
+# Benchmark: ingest rate and query latency per tier ==================================================================================================
+def benchmark(count, signals, interval_ms):
+    start_ms = 1_700_000_000_000
+    per_signal = count // signals
+    rng = np.random.default_rng(9)
+    values = 12.6 + np.cumsum(rng.normal(0, 0.01, per_signal))
+    times = start_ms + np.arange(per_signal, dtype=np.int64) * interval_ms
+    directory = os.path.join('/tmp', f"time-series-store-{os.getpid()}")
+    print(f"{signals} signals x {per_signal} samples every {interval_ms} ms ({per_signal * interval_ms / 3.6e6:.1f} h)")
+
+    try:
+        for label, store_directory, batch in (('memory, 1 sample', None, 1), ('memory, batches of 32', None, 32),
+                                              ('memory, batches of 1024', None, 1024), ('mmap, batches of 32', directory, 32)):
+            store = Time_Series_Store(max(signals, 1), store_directory)
+            samples = per_signal if batch > 1 else min(per_signal, 20000)
+            start = time.perf_counter_ns()
+            for first in range(0, samples, batch):
+                for signal in range(signals):
+                    store.append_many(f"vehicle/signal.{signal}", times[first:first + batch], values[first:first + batch])
+            store.flush()
+            elapsed = (time.perf_counter_ns() - start) / 1e9
+            print(f"ingest {label:<24} {samples * signals / elapsed:12,.0f} samples/s")
+
+        # the mmap store reopened: queries read what the previous instance wrote
+        store = Time_Series_Store(max(signals, 1), directory)
+        end_ms = int(times[-1]) + 1
+        queries = (('last 5 min, finest', 300_000, None), ('last 1 h at 10 s', 3_600_000, 10_000),
+                   ('last 1 h at 1 min', 3_600_000, 60_000), ('last 6 h at 5 min', 21_600_000, 300_000))
+        print(f"{'query':<20} {'tier':>5} {'points':>7} {'latency us':>11} {'from finest holding it':>24}")
+        for label, span_ms, resolution_ms in queries:
+            result = store.query('vehicle/signal.0', end_ms - span_ms, end_ms, resolution_ms)
+            start = time.perf_counter_ns()
+            for _ in range(200):
+                store.query('vehicle/signal.0', end_ms - span_ms, end_ms, resolution_ms)
+            latency = (time.perf_counter_ns() - start) / 200 / 1000
+            # the same query forced onto the finest tier that still holds its start
+            slot = store.slots['vehicle/signal.0']
+            finest = store.pick_tier(slot, end_ms - span_ms, 0)
+            start = time.perf_counter_ns()
+            for _ in range(200):
+                store.query('vehicle/signal.0', end_ms - span_ms, end_ms, resolution_ms, tier=finest)
+            finest_latency = (time.perf_counter_ns() - start) / 200 / 1000
+            print(f"{label:<20} {result['tier']:>5} {len(result['t']):7d} {latency:11.1f} "
+                  f"{finest_latency:14.1f} ({TIERS[finest][0]})")
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"mmap store: {size / 2**20:.1f} MiB for {signals} slots")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark, args.signals, args.interval_ms)
+        return
+
+    # an existing store keeps the slot count it was created with
+    path = os.path.join(args.directory, 'raw_t.npy')
+    max_signals = np.load(path, mmap_mode='r').shape[0] if os.path.exists(path) else args.max_signals
+    store = Time_Series_Store(max_signals, args.directory)
+    if args.signal is None:
+        for name in sorted(store.slots):
+            print(name)
+        return
+    result = store.query(args.signal, args.start_ms, args.end_ms, args.resolution_ms)
+    if result is None:
+        print(f"No signal {args.signal}")
+        return
+    print(f"tier {result['tier']}, resolution {result['resolution_ms']} ms")
+    for row in zip(result['t'].tolist(), result['min'].tolist(), result['max'].tolist(), result['mean'].tolist(), result['count'].tolist()):
+        print(f"{row[0]} min {row[1]:.3f} max {row[2]:.3f} mean {row[3]:.3f} count {row[4]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the signal history store')
+    parser.add_argument('directory', nargs='?', default='history', help='Store directory')
+    parser.add_argument('--max_signals', default=MAX_SIGNALS, type=int, help='Slots of a new store')
+    parser.add_argument('--signal', default=None, help="Signal to query, e.g. '9f3c0a1d22e4b870/battery_v' (default: list the signals)")
+    parser.add_argument('--start_ms', default=None, type=int, help='From (epoch ms)')
+    parser.add_argument('--end_ms', default=None, type=int, help='Until (epoch ms, exclusive)')
+    parser.add_argument('--resolution_ms', default=None, type=int, help='Bucket size in ms (default: the finest stored)')
+    parser.add_argument('--benchmark', default=0, type=int, help='Ingest N samples and measure query latency')
+    parser.add_argument('--signals', default=16, type=int, help='Benchmark: signals')
+    parser.add_argument('--interval_ms', default=200, type=int, help='Benchmark: ms between samples of a signal')
+
+    args = parser.parse_args()
+    main(args)
+
+# python3 timeSeriesStore.py --benchmark 2000000 --signals 16 --interval_ms 200
+# python3 timeSeriesStore.py history --signal 9f3c0a1d22e4b870/battery_v --resolution_ms 60000
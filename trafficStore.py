@@ -0,0 +1,299 @@
+# trafficStore.py
+# The trafficStore.py file contains the columnar store for decoded packet headers, queried instead of grepping
+# Logger output. Rows are buffered per column and written as chunks: one .npy file per column, plus a per-chunk
+# min/max index on timestamp, service ID and IFT ID so a query opens (mmap) only the chunks that can match.
+# The classes contain the following attributes:
+# - Traffic_Store: append-only writer and query API (counts, rates per time bucket)
+# - Traffic_Sink: Cloud ingest sink writing into a Traffic_Store (Cloud.py --sink trafficStore:Traffic_Sink:DIR)
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from array import array
+import numpy as np
+from packet import *
+
+CHUNK_ROWS = 65536
+INDEX_FILE = 'index.jsonl'
+HEADER = struct.Struct('!BBHHHHH')
+
+# column -> (array typecode of the write buffer, NumPy dtype on disk)
+COLUMNS = {
+    'timestamp_ns': ('Q', np.uint64),
+    'source_id': ('B', np.uint8),
+    'dest_id': ('B', np.uint8),
+    'service_id': ('H', np.uint16),
+    'message_type': ('H', np.uint16),
+    'ift_id': ('H', np.uint16),
+    'ift_type': ('H', np.uint16),
+    'data_length': ('H', np.uint16),
+}
+HEADER_COLUMNS = tuple(COLUMNS)[1:]
+INDEXED_COLUMNS = ('timestamp_ns', 'service_id', 'ift_id')
+
+
+def filter_values(value):
+    # None (any), an int or enum member, or a collection of them
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [getattr(item, 'value', item) for item in value]
+    return [getattr(value, 'value', value)]
+
+
+class Traffic_Store:
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS, logger=None):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.buffers = {name: array(typecode) for name, (typecode, _) in COLUMNS.items()}
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.load_index()
+        self.next_chunk = None      # set by the first flush, after recover_chunks
+
+    def load_index(self):
+        index = []
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        index.append(json.loads(line))
+        return index
+
+    def recover_chunks(self):
+        # a crash between the chunk rename and its index line leaves an unindexed chunk (only ever the last one):
+        # index it before its id is reused, or drop it if its columns do not load
+        indexed = {entry['name'] for entry in self.index}
+        chunk_ids = [entry['chunk'] for entry in self.index]
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.startswith('chunk-') or name in indexed or not os.path.isdir(path):
+                continue
+            if name.endswith('.tmp'):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                columns = {column: np.load(os.path.join(path, column + '.npy')) for column in COLUMNS}
+            except (OSError, ValueError) as e:
+                shutil.rmtree(path, ignore_errors=True)
+                if self.logger:
+                    self.logger.message("WARNING", "traffic", f"Removed unreadable unindexed {name}: {e}")
+                continue
+            self.write_index(int(name[len('chunk-'):]), name, columns)
+            chunk_ids.append(int(name[len('chunk-'):]))
+            if self.logger:
+                self.logger.message("INFO", "traffic", f"Indexed {name} ({len(columns['timestamp_ns'])} rows) left by a crash")
+        self.next_chunk = max(chunk_ids) + 1 if chunk_ids else 0
+
+    # Set Writer ==================================================================================================================================
+    def append(self, packet_data, timestamp_ns=None):
+        """Add the header of one packet (bytes as sent on the wire)."""
+        header = HEADER.unpack_from(packet_data, 0)
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        with self.lock:
+            self.buffers['timestamp_ns'].append(timestamp_ns)
+            for name, value in zip(HEADER_COLUMNS, header):
+                self.buffers[name].append(value)
+            if len(self.buffers['timestamp_ns']) >= self.chunk_rows:
+                self.flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        rows = len(self.buffers['timestamp_ns'])
+        if rows == 0:
+            return
+        columns = self.buffer_columns()
+        if self.next_chunk is None:
+            self.recover_chunks()
+        chunk_id = self.next_chunk
+        name = f"chunk-{chunk_id:08d}"
+
+        # columns go to a temporary directory renamed into place, then the index line makes the chunk visible
+        temp_path = os.path.join(self.directory, name + '.tmp')
+        os.makedirs(temp_path, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(temp_path, column + '.npy'), values)
+        os.replace(temp_path, os.path.join(self.directory, name))
+
+        self.write_index(chunk_id, name, columns)
+        self.next_chunk = chunk_id + 1
+        self.buffers = {column: array(typecode) for column, (typecode, _) in COLUMNS.items()}
+
+    def write_index(self, chunk_id, name, columns):
+        entry = {'chunk': chunk_id, 'name': name, 'rows': len(columns['timestamp_ns'])}
+        for column in INDEXED_COLUMNS:
+            entry[column] = [int(columns[column].min()), int(columns[column].max())]
+        with open(os.path.join(self.directory, INDEX_FILE), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.index.append(entry)
+
+    def buffer_columns(self):
+        return {column: np.frombuffer(self.buffers[column], dtype=dtype).copy() for column, (_, dtype) in COLUMNS.items()}
+
+    def close(self):
+        self.flush()
+
+    # Set Query ===================================================================================================================================
+    def chunk_matches(self, entry, start_ns, end_ns, service_ids, ift_ids):
+        low, high = entry['timestamp_ns']
+        if (start_ns is not None and high < start_ns) or (end_ns is not None and low >= end_ns):
+            return False
+        for column, values in (('service_id', service_ids), ('ift_id', ift_ids)):
+            if values is not None:
+                low, high = entry[column]
+                if not any(low <= value <= high for value in values):
+                    return False
+        return True
+
+    def scan(self, start_ns=None, end_ns=None, source_id=None, dest_id=None, service_id=None, ift_id=None, ift_type=None,
+             columns=('timestamp_ns',)):
+        """Yield {column: matching values} per chunk, opening only chunks the index cannot rule out."""
+        filters = {'source_id': filter_values(source_id), 'dest_id': filter_values(dest_id),
+                   'service_id': filter_values(service_id), 'ift_id': filter_values(ift_id), 'ift_type': filter_values(ift_type)}
+        needed = set(columns) | {'timestamp_ns'} | {column for column, values in filters.items() if values is not None}
+
+        with self.lock:
+            index = list(self.index)
+            pending = self.buffer_columns() if len(self.buffers['timestamp_ns']) else None
+
+        chunks = [entry for entry in index if self.chunk_matches(entry, start_ns, end_ns, filters['service_id'], filters['ift_id'])]
+        sources = [(entry, None) for entry in chunks]
+        if pending is not None:
+            sources.append((None, pending))
+
+        for entry, data in sources:
+            if data is None:
+                path = os.path.join(self.directory, entry['name'])
+                data = {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r') for column in needed}
+            mask = np.ones(len(data['timestamp_ns']), dtype=bool)
+            if start_ns is not None:
+                mask &= data['timestamp_ns'] >= start_ns
+            if end_ns is not None:
+                mask &= data['timestamp_ns'] < end_ns
+            for column, values in filters.items():
+                if values is not None:
+                    mask &= np.isin(data[column], values)
+            if mask.any():
+                yield {column: np.asarray(data[column][mask]) for column in columns}
+
+    def count(self, **filters):
+        return sum(len(chunk['timestamp_ns']) for chunk in self.scan(**filters))
+
+    def aggregate(self, bucket_s=1.0, group_by=None, **filters):
+        """Counts and rates (packets/s) per time bucket, optionally per value of a column.
+        Returns {group value or None: {'buckets': bucket start ns, 'counts': ..., 'rates': ...}}."""
+        bucket_ns = int(bucket_s * 1e9)
+        columns = ('timestamp_ns',) + ((group_by,) if group_by else ())
+        counts = {}
+        for chunk in self.scan(columns=columns, **filters):
+            buckets = chunk['timestamp_ns'] // bucket_ns
+            if group_by:
+                keys = chunk[group_by].astype(np.uint64) << np.uint64(48) | buckets
+            else:
+                keys = buckets
+            unique, unique_counts = np.unique(keys, return_counts=True)
+            for key, key_count in zip(unique.tolist(), unique_counts.tolist()):
+                counts[key] = counts.get(key, 0) + key_count
+
+        result = {}
+        for key in sorted(counts):
+            group = key >> 48 if group_by else None
+            bucket = key & ((1 << 48) - 1) if group_by else key
+            entry = result.setdefault(group, {'buckets': [], 'counts': []})
+            entry['buckets'].append(bucket * bucket_ns)
+            entry['counts'].append(counts[key])
+        for entry in result.values():
+            entry['buckets'] = np.array(entry['buckets'], dtype=np.uint64)
+            entry['counts'] = np.array(entry['counts'], dtype=np.int64)
+            entry['rates'] = entry['counts'] / bucket_s
+        return result
+
+
+class Traffic_Sink:
+    # Cloud ingest sink: Cloud.py --sink trafficStore:Traffic_Sink:DIR
+    def __init__(self, directory='traffic'):
+        self.store = Traffic_Store(directory)
+
+    def write(self, records):
+        for vehicle, received, packet in records:
+            self.store.append(packet.pack(), received)
+
+    def close(self):
+        self.store.close()
+
+
+# Benchmark: indexed chunk reads vs a full scan ==================================================================================================
+def benchmark(rows):
+    directory = os.path.join('/tmp', f"traffic-store-{os.getpid()}")
+    store = Traffic_Store(directory)
+    start_ns = 1_700_000_000 * 10**9
+    services = [service.value for service in ServiceID]
+    try:
+        write_start = time.perf_counter_ns()
+        for row in range(rows):
+            # services come in phases, as a vehicle moves between use cases
+            service_id = services[(row * len(services)) // rows]
+            packet = HEADER.pack(SourceDestID.D_IVI.value, SourceDestID.CLOUD.value, service_id, 0, 1 + row % 12, 1, 0)
+            store.append(packet, start_ns + row * 1_000_000)
+        store.flush()
+        write_s = (time.perf_counter_ns() - write_start) / 1e9
+        print(f"{rows} rows in {len(store.index)} chunks, append {rows / write_s:,.0f} rows/s")
+
+        for label, filters in (('all rows', {}),
+                               ('1 service', {'service_id': ServiceID.OTT_CONTROL}),
+                               ('10 s window', {'start_ns': start_ns + rows * 500_000, 'end_ns': start_ns + rows * 500_000 + 10 * 10**9})):
+            query_start = time.perf_counter_ns()
+            result = store.aggregate(1.0, **filters)
+            query_ms = (time.perf_counter_ns() - query_start) / 1e6
+            total = sum(int(entry['counts'].sum()) for entry in result.values())
+            opened = sum(1 for entry in store.index if store.chunk_matches(entry, filters.get('start_ns'), filters.get('end_ns'),
+                                                                             filter_values(filters.get('service_id')), None))
+            print(f"{label:<12} {total:9d} rows, {opened}/{len(store.index)} chunks read, {query_ms:8.1f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    store = Traffic_Store(args.directory)
+    filters = {'start_ns': args.start_ns, 'end_ns': args.end_ns, 'source_id': args.source_id, 'dest_id': args.dest_id,
+               'service_id': args.service_id, 'ift_id': args.ift_id, 'ift_type': args.ift_type}
+    result = store.aggregate(args.bucket, args.group_by, **filters)
+    for group, entry in result.items():
+        for bucket, count, rate in zip(entry['buckets'].tolist(), entry['counts'].tolist(), entry['rates'].tolist()):
+            prefix = f"{args.group_by}={group} " if args.group_by else ''
+            print(f"{prefix}{bucket} {count} {rate:.1f}/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the traffic store')
+    parser.add_argument('directory', nargs='?', default='traffic', help='Store directory')
+    parser.add_argument('--start_ns', default=None, type=int, help='From (epoch ns)')
+    parser.add_argument('--end_ns', default=None, type=int, help='Until (epoch ns, exclusive)')
+    parser.add_argument('--source_id', default=None, type=lambda value: int(value, 0), help='SourceDestID of the sender')
+    parser.add_argument('--dest_id', default=None, type=lambda value: int(value, 0), help='SourceDestID of the receiver')
+    parser.add_argument('--service_id', default=None, type=lambda value: int(value, 0), help='Service ID')
+    parser.add_argument('--ift_id', default=None, type=lambda value: int(value, 0), help='IFT ID')
+    parser.add_argument('--ift_type', default=None, type=lambda value: int(value, 0), help='IFT Type')
+    parser.add_argument('--bucket', default=1.0, type=float, help='Bucket size in seconds')
+    parser.add_argument('--group_by', default=None, choices=list(HEADER_COLUMNS), help='Count per value of this column')
+    parser.add_argument('--benchmark', default=0, type=int, help='Write N rows and compare indexed and full reads')
+
+    args = parser.parse_args()
+    main(args)
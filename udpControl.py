@@ -2,15 +2,25 @@
 # The udp.py file contains a class called UDP that is used to send and receive UDP messages. 
 
 import socket
+import select
 import struct
 import argparse
 import threading
 import time
 from time import sleep
-import netifaces
-import netaddr
+import queue
+from packetValidator import Packet_Validator
 from packet import *
 
+# In-process delivery (ivi-node): endpoints served by a role in this process -> its receive queue.
+# Packets sent to a local endpoint skip the socket and are handed over as the same bytes object.
+LOCAL_DELIVERY = False
+LOCAL_ENDPOINTS = {}
+
+def enable_local_delivery():
+    global LOCAL_DELIVERY
+    LOCAL_DELIVERY = True
+
 class UDP_Control:
     def __init__(self, system, src_ip_addr, src_port, logger):
         self.system = system
@@ -18,6 +28,24 @@ class UDP_Control:
         self.src_port = src_port
         self.logger = logger
         self.previous_time = time.time()
+        # Optional send-path stage (suppression.Send_Suppressor) dropping repeated messages
+        self.suppressor = None
+        # Optional payload encryption (payloadCrypto.Packet_Crypto) of packets to its dest_ids
+        self.crypto = None
+        # Optional receive-path stage (admission.Admission_Control) dropping packets over budget before any work
+        self.admission = None
+        # Optional socket options and kernel drop accounting (socketTuning.Socket_Tuning) of the server socket
+        self.socket_tuning = None
+        # Optional restart/shutdown control (lifecycle.Lifecycle): the server socket is handed to a successor process
+        self.lifecycle = None
+        self.stopping = threading.Event()
+        self.stopped = threading.Event()
+        # Server socket once bound: sends from it are answered to the server
+        self.sock = None
+        # (ip, port) of the datagram the calling thread is handling (received.addr), for replies to the sending socket
+        self.received = threading.local()
+        # Validating decode stage: malformed packets are counted and quarantined instead of reaching the handler
+        self.validator = Packet_Validator(self.logger)
 
         self.logger.message("INFO", "UDP", f"Source IP Address: {self.src_ip_addr}")
         self.logger.message("INFO", "UDP", f"Source Port: {self.src_port}")
@@ -26,6 +54,8 @@ class UDP_Control:
         self.logger.message("ERROR", "error", f"Error: {error_msg}")
 
     def get_default_interface(self):
+        import netifaces    # only needed here; keep it off the startup path
+
         routes = netifaces.gateways()
         
         if 'default' in routes and netifaces.AF_INET in routes['default']:
@@ -34,6 +64,8 @@ class UDP_Control:
         return None
 
     def get_interface_ip(interface_name):
+        import netifaces
+
         addresses = netifaces.ifaddresses(interface_name)
         if netifaces.AF_INET in addresses:
             for link in addresses[netifaces.AF_INET]:
@@ -47,14 +79,52 @@ class UDP_Control:
             host = self.src_ip_addr
             port = self.src_port
 
-            udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            udp_sock.bind((host, port))
-
-            self.logger.message("INFO", "server", f"{self.system}: {host}:{port}")
+            # a successor of a restart serves the socket its predecessor bound; datagrams queued meanwhile are kept
+            key = f"udp:{host}:{port}"
+            udp_sock = self.lifecycle.adopt(key) if self.lifecycle is not None else None
+            adopted = udp_sock is not None
+            if not adopted:
+                udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            receive = udp_sock.recvfrom
+            if self.socket_tuning is not None:
+                self.socket_tuning.apply(udp_sock)
+                receive = self.socket_tuning.receiver(udp_sock)
+            if not adopted:
+                udp_sock.bind((host, port))
+            if self.lifecycle is not None:
+                self.lifecycle.register(key, udp_sock, self.stop)
+            self.sock = udp_sock
+
+            self.logger.message("INFO", "server", f"{self.system}: {host}:{port}" + (" (inherited)" if adopted else ""))
+
+            if LOCAL_DELIVERY:
+                local_queue = queue.SimpleQueue()
+                local_thread = threading.Thread(target=self.udp_local_server, args=(local_queue, message_handler))
+                local_thread.start()
+                LOCAL_ENDPOINTS[(host, int(port))] = local_queue
             
-            while True:
-                received_data, addr = udp_sock.recvfrom(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
+            admission = self.admission
+            # wake up to deliver deferred packets or to stop when nothing arrives; the socket itself stays blocking,
+            # a timeout would set O_NONBLOCK on the file description shared with a successor
+            poll_interval = 0.01 if admission is not None else 0.05
+            polling = admission is not None or self.lifecycle is not None
+
+            while not self.stopping.is_set():
+                if polling:
+                    if admission is not None:
+                        for received_data, udp_client_ip in admission.release():
+                            self.udp_deliver(received_data, udp_client_ip, message_handler, None)
+                    if not select.select([udp_sock], [], [], poll_interval)[0]:
+                        continue
+                    try:
+                        received_data, addr = receive(PROTOCOL_LEN + MAX_PAYLOAD_LEN, socket.MSG_DONTWAIT)
+                    except BlockingIOError:
+                        continue    # taken by the other process sharing the socket
+                    if admission is not None and not admission.admit(received_data, addr[0]):
+                        continue
+                else:
+                    received_data, addr = receive(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
                 udp_client_ip = addr[0]
                 
                 # current_time = time.time()
@@ -62,32 +132,99 @@ class UDP_Control:
                 # self.previous_time = current_time
                 #self.logger.message("INFO", "Received", f"[{self.previous_time:.6f}:{elapsed_time:.6f}] ({udp_client_ip}): {received_data}")
                 #self.logger.message("INFO", "Received", f"[E:{elapsed_time:.6f}:{udp_client_ip}] {received_data}")
-                self.logger.message("INFO", "Received", f"[{udp_client_ip}] {received_data}")
-
-                if message_handler:
-                    message_handler(received_data)
-                elif message_handler is None:
-                    self.logger.message("INFO", "Received", "No message handler provided.")
+                self.udp_deliver(received_data, udp_client_ip, message_handler, addr)
 
         except ConnectionRefusedError:
             print(f"Connection to {host}:{port} refused.")
         except Exception as e:
             print(f"An error occurred while receiving the UDP message: {e}")
+        finally:
+            self.stopped.set()
+
+    def stop(self, timeout=None):
+        # Ends the receive loop after the packet being handled; the socket stays open for a successor
+        self.stopping.set()
+        return self.stopped.wait(timeout)
 
+    def udp_deliver(self, received_data, udp_client_ip, message_handler=None, addr=None):
+        # Malformed packets are quarantined before logging; a raising handler must not end the receive loop
+        if not self.validator.validate(received_data, udp_client_ip):
+            return
+        self.received.addr = addr
+        self.logger.message("INFO", "Received", f"[{udp_client_ip}] {received_data}")
+
+        if message_handler:
+            try:
+                message_handler(received_data)
+            except Exception as e:
+                self.validator.handler_error(received_data, udp_client_ip, e)
+        elif message_handler is None:
+            self.logger.message("INFO", "Received", "No message handler provided.")
+
+    # Set UDP Local Server =====================================================================================================================
+    def udp_local_server(self, local_queue, message_handler=None):
+        while True:
+            received_data = local_queue.get()
+            self.udp_deliver(received_data, "local", message_handler)
+
+    # Set UDP Multicast Server =================================================================================================================
+    def udp_multicast_server(self, group_ip_addr, group_port, message_handler=None):
+        try:
+            udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            udp_sock.bind(('', group_port))
+            membership = struct.pack('4s4s', socket.inet_aton(group_ip_addr), socket.inet_aton(self.src_ip_addr))
+            udp_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+            self.logger.message("INFO", "server", f"{self.system}: group {group_ip_addr}:{group_port}")
+
+            while True:
+                received_data, addr = udp_sock.recvfrom(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
+                self.udp_deliver(received_data, f"{addr[0]}:GROUP", message_handler)
+
+        except Exception as e:
+            print(f"An error occurred while receiving the UDP multicast message: {e}")
 
     # Set UDP Client ===========================================================================================================================
-    def udp_client(self, dest_ip_addr, dest_port, data=None):
+    def udp_client(self, dest_ip_addr, dest_port, data=None, sock=None):
+        # Roles also call this unbound with themselves as self, so the suppressor may be theirs.
+        # sock: send from this (bound) socket, so replies come back to it; default a new socket per send.
+        # Returns False if the packet was suppressed or could not be sent.
+        suppressor = getattr(self, 'suppressor', None)
+        if suppressor is not None and not suppressor.check(data):
+            self.logger.message("DEBUG", "send", f"[suppressed:{dest_ip_addr}:{dest_port}] {data}")
+            return False
+        crypto = getattr(self, 'crypto', None)
+        if crypto is not None:
+            data = crypto.seal(data)
+
+        local_queue = LOCAL_ENDPOINTS.get((dest_ip_addr, int(dest_port)))
+        if local_queue is not None:
+            self.logger.message("INFO", "send", f"[local:{dest_ip_addr}:{dest_port}] {data}")
+            local_queue.put(data)
+            return True
+
+        udp_sock = None
         try:
             self.logger.message("INFO", "send", f"[{dest_ip_addr}:{dest_port}] {data}")
 
+            if sock is not None:
+                sock.sendto(data, (dest_ip_addr, dest_port))
+                return True
             udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            socket_tuning = getattr(self, 'socket_tuning', None)
+            if socket_tuning is not None and socket_tuning.sndbuf:
+                udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_tuning.sndbuf)
             udp_sock.sendto(data, (dest_ip_addr, dest_port))
+            return True
         except ConnectionRefusedError:
             print(f"Connection to {dest_ip_addr}:{dest_port} refused.")
         except Exception as e:
             print(f"An error occurred while sending the UDP message: {e}")
         finally:
-            udp_sock.close()
+            if udp_sock is not None:
+                udp_sock.close()
+        return False
 
     # Set UDP Sender ===========================================================================================================================
     def udp_sender(self, dest_ip_addr, dest_port, send_data, send_count):
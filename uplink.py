@@ -0,0 +1,482 @@
+# uplink.py
+# The uplink.py file contains the store-and-forward uplink for Cloud-bound messages (IFT_13_xx, IFT_23_xx).
+# Packets are appended to a segmented on-disk queue first and flushed to the Cloud in large batches while the
+# link is up; a packet is dropped from disk only after the Cloud acknowledged it (at-least-once delivery).
+# The classes contain the following attributes:
+# - Uplink_Queue: append-only segment files with batched fsync, persisted ack position, oldest-first eviction
+# - Uplink_Control: sender thread draining the queue to the Cloud endpoint, one batch in flight
+# - Cloud_Receiver: local stand-in for the Cloud endpoint, acks batches and counts duplicates
+
+import argparse
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from logger import Logger
+from packet import *
+
+UPLINK_DIR = 'uplink'
+SEGMENT_BYTES = 4 * 1024 * 1024     # segment file size before rolling to a new one
+MAX_DISK_BYTES = 64 * 1024 * 1024   # queue size on disk; oldest segments are evicted beyond this
+FSYNC_INTERVAL = 0.05               # seconds between fsyncs of the active segment (batched)
+BATCH_BYTES = 60000                 # records (with their length fields) per batch datagram, below the UDP datagram limit
+ACK_TIMEOUT = 0.5                   # seconds to wait for a batch ack
+RETRY_MAX = 5.0                     # longest backoff between sends while the link is down
+
+# On disk, per record: seq: 8byte, length: 4byte, crc32: 4byte, packet
+RECORD_HEADER = struct.Struct('!QII')
+# Batch datagram: magic, epoch: 8byte, first seq: 8byte, count: 2byte, then per record length: 2byte, packet
+BATCH_HEADER = struct.Struct('!4sQQH')
+BATCH_RECORD = struct.Struct('!H')
+# Ack datagram: magic, epoch: 8byte, last seq received: 8byte
+ACK = struct.Struct('!4sQQ')
+BATCH_MAGIC = b'UPLB'
+ACK_MAGIC = b'UPLA'
+
+SEGMENT_SUFFIX = '.seg'
+ACK_FILE = 'acked'
+EPOCH_FILE = 'epoch'
+
+
+class Uplink_Queue:
+    def __init__(self, logger, directory=UPLINK_DIR, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_DISK_BYTES,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.logger = logger
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Condition()
+        # [first seq, last seq, size, path], oldest first; the last one is the active segment
+        self.segments = []
+        self.active = None
+        self.dirty = False
+        self.cursor = None      # (seq, path, offset) where the next read_batch continues
+        self.stats = {'appended': 0, 'acked': 0, 'evicted': 0, 'fsyncs': 0, 'recovered': 0, 'truncated': 0}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.epoch = self.load_epoch()
+        self.acked = self.load_acked()
+        self.recover()
+
+        self.running = True
+        self.sync_thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self.sync_thread.start()
+
+    # Set Recovery ================================================================================================================================
+    def load_epoch(self):
+        # identifies this queue's sequence numbers to the Cloud across restarts
+        path = os.path.join(self.directory, EPOCH_FILE)
+        try:
+            with open(path, 'rb') as f:
+                return struct.unpack('!Q', f.read(8))[0]
+        except (OSError, struct.error):
+            epoch = struct.unpack('!Q', os.urandom(8))[0]
+            self.write_atomic(path, struct.pack('!Q', epoch))
+            return epoch
+
+    def load_acked(self):
+        try:
+            with open(os.path.join(self.directory, ACK_FILE), 'rb') as f:
+                return struct.unpack('!Q', f.read(8))[0]
+        except (OSError, struct.error):
+            return 0
+
+    def write_atomic(self, path, data):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def recover(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            first_seq = int(name[:-len(SEGMENT_SUFFIX)])
+            last_seq, size, count = first_seq - 1, 0, 0
+            with open(path, 'rb') as f:
+                data = f.read()
+            # scan up to the first torn or corrupt record (crash during append) and cut the file there
+            while size + RECORD_HEADER.size <= len(data):
+                seq, length, crc = RECORD_HEADER.unpack_from(data, size)
+                end = size + RECORD_HEADER.size + length
+                if end > len(data) or zlib.crc32(data[size + RECORD_HEADER.size:end]) != crc:
+                    break
+                last_seq, size, count = seq, end, count + 1
+            if size < len(data):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+                self.stats['truncated'] += 1
+                self.logger.message("WARNING", "uplink", f"Truncated {len(data) - size} bytes at the end of {name}")
+            if last_seq <= self.acked:
+                os.remove(path)
+                continue
+            self.segments.append([first_seq, last_seq, size, path])
+            self.stats['recovered'] += count
+
+        next_seq = self.segments[-1][1] + 1 if self.segments else self.acked + 1
+        if self.segments and self.segments[-1][2] < self.segment_bytes:
+            self.active = open(self.segments[-1][3], 'ab')
+        else:
+            self.roll(next_seq)
+        self.next_seq = next_seq
+        if self.stats['recovered']:
+            self.logger.message("INFO", "uplink", f"Recovered {self.stats['recovered']} records, {self.pending()} unacked")
+
+    # Set Writer ==================================================================================================================================
+    def roll(self, first_seq):
+        if self.active is not None:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.active.close()
+        path = os.path.join(self.directory, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+        self.active = open(path, 'ab')
+        self.segments.append([first_seq, first_seq - 1, 0, path])
+
+    def append(self, packet_data):
+        """Queue one packet; durable after the next fsync (within fsync_interval). Returns its seq."""
+        with self.lock:
+            seq = self.next_seq
+            segment = self.segments[-1]
+            if segment[2] >= self.segment_bytes:
+                self.roll(seq)
+                segment = self.segments[-1]
+            self.active.write(RECORD_HEADER.pack(seq, len(packet_data), zlib.crc32(packet_data)))
+            self.active.write(packet_data)
+            segment[1] = seq
+            segment[2] += RECORD_HEADER.size + len(packet_data)
+            self.next_seq = seq + 1
+            self.dirty = True
+            self.stats['appended'] += 1
+            self.evict()
+            self.lock.notify_all()
+        return seq
+
+    def evict(self):
+        # bounded disk: drop the oldest segments, acked or not
+        while len(self.segments) > 1 and sum(segment[2] for segment in self.segments) > self.max_bytes:
+            first_seq, last_seq, _, path = self.segments.pop(0)
+            lost = last_seq - max(first_seq - 1, self.acked)
+            if lost > 0:
+                self.stats['evicted'] += lost
+                self.logger.message("WARNING", "uplink", f"Disk limit reached, dropped {lost} unsent records up to seq {last_seq}")
+            if last_seq > self.acked:
+                self.acked = last_seq
+                self.write_atomic(os.path.join(self.directory, ACK_FILE), struct.pack('!Q', last_seq))
+            os.remove(path)
+
+    def sync(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.dirty = False
+            self.stats['fsyncs'] += 1
+
+    def sync_loop(self):
+        while self.running:
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    # Set Reader ==================================================================================================================================
+    def pending(self):
+        return self.next_seq - 1 - self.acked
+
+    def wait(self, timeout):
+        """Block until there are unacked records or timeout. Returns True if there are."""
+        with self.lock:
+            return self.lock.wait_for(lambda: self.pending() > 0, timeout)
+
+    def read_batch(self, max_bytes=BATCH_BYTES):
+        """(first seq, [packet, ...]) of the oldest unacked records, up to max_bytes of packets and length fields."""
+        while True:
+            try:
+                return self.read_records(max_bytes)
+            except FileNotFoundError:
+                # files are read outside the lock: ack() or evict() removed a segment meanwhile, start over
+                self.cursor = None
+
+    def read_records(self, max_bytes):
+        with self.lock:
+            first_seq = self.acked + 1
+            if first_seq >= self.next_seq:
+                return first_seq, []
+            if self.dirty:
+                self.active.flush()
+            segments = [list(segment) for segment in self.segments if segment[1] >= first_seq]
+            cursor = self.cursor
+
+        records, total, seq = [], 0, first_seq
+        for _, _, size, path in segments:
+            offset = cursor[2] if cursor is not None and cursor[0] == seq and cursor[1] == path else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while offset + RECORD_HEADER.size <= size:
+                    record_seq, length, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    if record_seq < seq:
+                        f.seek(length, os.SEEK_CUR)
+                    elif records and total + BATCH_RECORD.size + length > max_bytes:
+                        self.cursor = (record_seq, path, offset)
+                        return first_seq, records
+                    else:
+                        records.append(f.read(length))
+                        total += BATCH_RECORD.size + length
+                        seq = record_seq + 1
+                    offset += RECORD_HEADER.size + length
+        self.cursor = None
+        return first_seq, records
+
+    def ack(self, last_seq):
+        """Cloud has every record up to last_seq: persist the position and delete fully acked segments."""
+        with self.lock:
+            if last_seq <= self.acked:
+                return
+            last_seq = min(last_seq, self.next_seq - 1)
+            self.stats['acked'] += last_seq - self.acked
+            self.acked = last_seq
+            self.write_atomic(os.path.join(self.directory, ACK_FILE), struct.pack('!Q', last_seq))
+            while len(self.segments) > 1 and self.segments[0][1] <= last_seq:
+                os.remove(self.segments.pop(0)[3])
+
+    def close(self):
+        self.running = False
+        self.sync()
+        with self.lock:
+            self.active.close()
+
+
+def pack_batch(epoch, first_seq, records):
+    parts = [BATCH_HEADER.pack(BATCH_MAGIC, epoch, first_seq, len(records))]
+    for record in records:
+        parts.append(BATCH_RECORD.pack(len(record)))
+        parts.append(record)
+    return b''.join(parts)
+
+
+def unpack_batch(data):
+    magic, epoch, first_seq, count = BATCH_HEADER.unpack_from(data, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError("Not an uplink batch")
+    records, offset = [], BATCH_HEADER.size
+    for _ in range(count):
+        length = BATCH_RECORD.unpack_from(data, offset)[0]
+        offset += BATCH_RECORD.size
+        records.append(data[offset:offset + length])
+        offset += length
+    return epoch, first_seq, records
+
+
+class Uplink_Control:
+    def __init__(self, system, logger, routing, queue, batch_bytes=BATCH_BYTES, ack_timeout=ACK_TIMEOUT):
+        self.system = system
+        self.logger = logger
+        self.routing = routing
+        self.queue = queue
+        self.batch_bytes = batch_bytes
+        self.ack_timeout = ack_timeout
+        self.link_up = None
+        self.stats = {'batches': 0, 'records_sent': 0, 'retries': 0, 'outages': 0, 'oversize': 0, 'errors': 0}
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        self.running = True
+        self.sender_thread = threading.Thread(target=self.sender_loop, daemon=True)
+        self.sender_thread.start()
+
+    def enqueue(self, packet_data):
+        """Queue a Cloud-bound packet. Returns its seq, or None for a packet too large for a batch datagram."""
+        if BATCH_RECORD.size + len(packet_data) > self.batch_bytes:
+            self.stats['oversize'] += 1
+            self.logger.message("ERROR", "uplink", f"Dropped a {len(packet_data)}-byte packet, larger than a {self.batch_bytes}-byte batch")
+            return None
+        return self.queue.append(packet_data)
+
+    # Set Sender ==================================================================================================================================
+    def sender_loop(self):
+        backoff = self.ack_timeout
+        while self.running:
+            try:
+                backoff = self.send_next(backoff)
+            except Exception as e:
+                # a failed read or send must not stop the uplink: the batch stays on disk and is retried
+                self.stats['errors'] += 1
+                self.logger.message("ERROR", "uplink", f"Sender error: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RETRY_MAX)
+
+    def send_next(self, backoff):
+        """Send the next batch and wait for its ack. Returns the backoff for the next one."""
+        if not self.queue.wait(1.0):
+            return backoff
+        endpoint = self.routing.resolve(SourceDestID.CLOUD.value)
+        first_seq, records = self.queue.read_batch(self.batch_bytes)
+        if endpoint is None or not records:
+            time.sleep(backoff)
+            return backoff
+        if len(records) == 1 and BATCH_RECORD.size + len(records[0]) > self.batch_bytes:
+            # queued before the size check (or with a larger batch_bytes): it can never be sent
+            self.stats['oversize'] += 1
+            self.logger.message("ERROR", "uplink", f"Dropped queued seq {first_seq} of {len(records[0])} bytes, larger than a batch")
+            self.queue.ack(first_seq)
+            return backoff
+
+        last_seq = first_seq + len(records) - 1
+        if self.send_batch(endpoint, first_seq, records, last_seq):
+            self.queue.ack(last_seq)
+            self.stats['batches'] += 1
+            self.stats['records_sent'] += len(records)
+            self.set_link(True)
+            return self.ack_timeout
+        # link down: keep everything on disk and retry the same batch with backoff
+        self.stats['retries'] += 1
+        self.set_link(False)
+        time.sleep(backoff)
+        return min(backoff * 2, RETRY_MAX)
+
+    def send_batch(self, endpoint, first_seq, records, last_seq):
+        try:
+            self.sock.sendto(pack_batch(self.queue.epoch, first_seq, records), endpoint)
+            deadline = time.monotonic() + self.ack_timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.sock.settimeout(remaining)
+                data = self.sock.recv(ACK.size)
+                if len(data) != ACK.size:
+                    continue
+                magic, epoch, acked_seq = ACK.unpack(data)
+                # acks for earlier batches can arrive late after a retry
+                if magic == ACK_MAGIC and epoch == self.queue.epoch and acked_seq >= last_seq:
+                    return True
+        except OSError:
+            return False
+
+    def set_link(self, up):
+        if up != self.link_up:
+            if not up:
+                self.stats['outages'] += 1
+            self.logger.message("INFO" if up else "WARNING", "uplink",
+                                f"Cloud link {'up' if up else 'down'}, {self.queue.pending()} records queued")
+            self.link_up = up
+
+    def close(self):
+        self.running = False
+        self.sender_thread.join(timeout=2 * RETRY_MAX)
+        self.sock.close()
+        self.queue.close()
+
+
+class Cloud_Receiver:
+    """Local stand-in for the Cloud endpoint: acks every batch, delivers each seq once per epoch."""
+    def __init__(self, ip_addr, port, message_handler=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind((ip_addr, port))
+        self.message_handler = message_handler
+        self.online = True          # False: drop batches without acking (link down)
+        self.delivered = {}         # epoch -> highest seq delivered
+        self.stats = {'received': 0, 'duplicates': 0}
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            if not self.online:
+                continue
+            try:
+                epoch, first_seq, records = unpack_batch(data)
+            except (ValueError, struct.error):
+                continue
+            high = self.delivered.get(epoch, 0)
+            for seq, record in enumerate(records, first_seq):
+                if seq <= high:
+                    self.stats['duplicates'] += 1
+                    continue
+                self.stats['received'] += 1
+                if self.message_handler:
+                    self.message_handler(record)
+            last_seq = first_seq + len(records) - 1
+            self.delivered[epoch] = max(high, last_seq)
+            self.sock.sendto(ACK.pack(ACK_MAGIC, epoch, last_seq), addr)
+
+    def close(self):
+        self.sock.close()
+
+
+# Benchmark: throughput and recovery time against a local stand-in Cloud ========================================================================
+class Static_Route:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def resolve(self, dest_id):
+        return self.endpoint
+
+
+def benchmark(count, size, outage):
+    logger = Logger('WARNING', 'UPLINK', 'UDP', log_console=True)
+    directory = tempfile.mkdtemp(prefix='uplink-')
+    receiver = Cloud_Receiver('127.0.0.1', 0)
+    uplink = Uplink_Control('UPLINK', logger, Static_Route(receiver.sock.getsockname()), Uplink_Queue(logger, directory))
+    packet = ProtocolPacket(SourceDestID.D_IVI.value, SourceDestID.CLOUD.value, ServiceID.D_IVI_CONTROL.value, 0,
+                            IFTID.IFT_13_03.value, IFT_13_03_Type.TYPE_0002.value)
+    packet.add_payload_data(bytes(size))
+    packet_data = packet.pack()
+
+    def drained(target, timeout=60.0):
+        deadline = time.perf_counter() + timeout
+        while receiver.stats['received'] < target and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        return receiver.stats['received'] >= target
+
+    try:
+        # append rate with batched fsync
+        start_ns = time.perf_counter_ns()
+        for _ in range(count):
+            uplink.enqueue(packet_data)
+        append_s = (time.perf_counter_ns() - start_ns) / 1e9
+        drained(count)
+        total_s = (time.perf_counter_ns() - start_ns) / 1e9
+        print(f"{count} x {len(packet_data)}-byte packets: append {count / append_s:,.0f}/s, "
+              f"delivered {count / total_s:,.0f}/s ({count * len(packet_data) / total_s / 1e6:.1f} MB/s), "
+              f"{uplink.stats['batches']} batches, {uplink.queue.stats['fsyncs']} fsyncs")
+
+        # outage: Cloud unreachable while the vehicle keeps producing, then the link comes back
+        receiver.online = False
+        time.sleep(0.1)
+        start_ns = time.perf_counter_ns()
+        while (time.perf_counter_ns() - start_ns) / 1e9 < outage:
+            uplink.enqueue(packet_data)
+            time.sleep(0.0005)
+        backlog = uplink.queue.pending()
+        receiver.online = True
+        restored_ns = time.perf_counter_ns()
+        drained(uplink.queue.stats['appended'])
+        recovery_ms = (time.perf_counter_ns() - restored_ns) / 1e6
+        print(f"outage {outage:.1f} s, backlog {backlog} records: drained {recovery_ms:.0f} ms after the link came back "
+              f"(includes retry backoff), duplicates {receiver.stats['duplicates']}")
+    finally:
+        uplink.close()
+        receiver.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Uplink store-and-forward benchmark')
+    parser.add_argument('--count', default=50000, type=int, help='Packets sent with the link up')
+    parser.add_argument('--size', default=128, type=int, help='Payload bytes per packet')
+    parser.add_argument('--outage', default=3.0, type=float, help='Seconds the Cloud stays unreachable')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.size, args.outage)
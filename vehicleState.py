@@ -0,0 +1,199 @@
+# vehicleState.py
+# The vehicleState.py file contains the Vehicle_State class: the CCU's versioned in-memory store of the latest
+# vehicle information, served for VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION without new upstream traffic.
+# The class contains the following attributes:
+# - current: (global version, read-only {(ift_id, ift_type): (field version, payload)}); replaced as one
+#            reference on every update and never modified (copy-on-write), so readers take no lock
+# - subscribers: Callbacks receiving only the fields changed since the version they last saw; changes are queued
+#                per subscriber under the write lock and delivered from that queue, so always in version order
+
+import argparse
+import collections
+import socket
+import struct
+import threading
+import time
+from types import MappingProxyType
+from packet import *
+
+# LAST_VEHICLE_INFORMATION payload
+# Request: [since version: 8byte] (optional, 0 or missing = full state)
+# Response: version: 8byte, field count: 2byte, then per field
+#           IFT ID: 2byte, IFT Type: 2byte, field version: 8byte, length: 2byte, data
+STATE_HEADER = struct.Struct('!QH')
+STATE_FIELD = struct.Struct('!HHQH')
+SINCE_VERSION = struct.Struct('!Q')
+
+
+def encode_state(version, fields):
+    parts = [STATE_HEADER.pack(version, len(fields))]
+    for (ift_id, ift_type), (field_version, data) in fields.items():
+        parts.append(STATE_FIELD.pack(ift_id, ift_type, field_version, len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def decode_state(payload):
+    version, count = STATE_HEADER.unpack_from(payload, 0)
+    offset = STATE_HEADER.size
+    fields = {}
+    for _ in range(count):
+        ift_id, ift_type, field_version, length = STATE_FIELD.unpack_from(payload, offset)
+        offset += STATE_FIELD.size
+        fields[(ift_id, ift_type)] = (field_version, bytes(payload[offset:offset + length]))
+        offset += length
+    return version, fields
+
+
+class Vehicle_State:
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.current = (0, MappingProxyType({}))
+        self.write_lock = threading.Lock()
+        self.subscribers = []
+        self.encoded = (0, encode_state(0, {}))     # full-state response, rebuilt once per version
+
+    # Set Update ==================================================================================================================================
+    def update(self, ift_id, ift_type, data):
+        """Store one field; unchanged values keep their version. Returns the new global version."""
+        key = (ift_id, ift_type)
+        with self.write_lock:
+            version, snapshot = self.current
+            field = snapshot.get(key)
+            if field is not None and field[1] == data:
+                return version
+
+            version += 1
+            fields = dict(snapshot)
+            fields[key] = (version, bytes(data))
+            self.current = (version, MappingProxyType(fields))
+            subscribers = list(self.subscribers)
+            delta = {key: fields[key]}
+            for subscriber in subscribers:
+                subscriber['pending'].append((version, delta))
+
+        for subscriber in subscribers:
+            self.notify(subscriber)
+        return version
+
+    # Set Read API ================================================================================================================================
+    def get(self, since_version=0):
+        """Return (version, fields) from the cache; only fields changed after since_version."""
+        version, snapshot = self.current
+        if since_version <= 0:
+            return version, snapshot
+        return version, {key: field for key, field in snapshot.items() if field[0] > since_version}
+
+    @property
+    def version(self):
+        return self.current[0]
+
+    def field(self, ift_id, ift_type):
+        return self.current[1].get((ift_id, ift_type))
+
+    # Set Subscriptions ===========================================================================================================================
+    def subscribe(self, callback, since_version=0):
+        """callback(version, delta) gets the fields changed since since_version now, then every later change."""
+        subscriber = {'callback': callback, 'version': since_version, 'pending': collections.deque(), 'lock': threading.Lock()}
+        with self.write_lock:
+            self.subscribers.append(subscriber)
+            version, delta = self.get(since_version)
+            if delta:
+                subscriber['pending'].append((version, delta))
+        self.notify(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.write_lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def notify(self, subscriber):
+        # one thread at a time drains the subscriber's queue; a change queued meanwhile is sent by this loop or the next caller
+        with subscriber['lock']:
+            while subscriber['pending']:
+                version, delta = subscriber['pending'].popleft()
+                delta = {key: field for key, field in delta.items() if field[0] > subscriber['version']}
+                if not delta:
+                    continue
+                subscriber['version'] = max(subscriber['version'], version)
+                try:
+                    subscriber['callback'](version, delta)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.message("ERROR", "state", f"Subscriber failed: {e}")
+
+    # Set Protocol ================================================================================================================================
+    def answer(self, request_payload):
+        """Build the LAST_VEHICLE_INFORMATION response payload for a request payload."""
+        since_version = 0
+        if request_payload and len(request_payload) >= SINCE_VERSION.size:
+            since_version = SINCE_VERSION.unpack_from(request_payload, 0)[0]
+        if since_version <= 0:
+            encoded = self.encoded
+            version, fields = self.current
+            if encoded[0] != version:
+                encoded = self.encoded = (version, encode_state(version, fields))
+            return encoded[1]
+        version, fields = self.get(since_version)
+        return encode_state(version, fields)
+
+
+# Benchmark: cached read vs a request/response round trip ========================================================================================
+def benchmark(count, field_count):
+    state = Vehicle_State()
+    for index in range(field_count):
+        ift_id = IFTID.IFT_13_01.value + index // 16
+        state.update(ift_id, index % 16 + 1, bytes(32))
+
+    # cached read
+    start_ns = time.perf_counter_ns()
+    for _ in range(count):
+        state.get()
+    read_ns = (time.perf_counter_ns() - start_ns) / count
+
+    # full-state response payload, as served to a remote consumer
+    start_ns = time.perf_counter_ns()
+    for _ in range(count):
+        state.answer(b'')
+    answer_ns = (time.perf_counter_ns() - start_ns) / count
+
+    # round trip over loopback UDP to a responder holding the same state
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+
+    def responder():
+        for _ in range(count):
+            received_data, addr = server.recvfrom(PROTOCOL_LEN + MAX_PAYLOAD_LEN)
+            request = ProtocolPacket.unpack(received_data)
+            response = ProtocolPacket(SourceDestID.CCU.value, request.source_id, request.service_id, request.message_type)
+            response.add_payload_data(state.answer(request.payload_data))
+            server.sendto(response.pack(), addr)
+
+    responder_thread = threading.Thread(target=responder, daemon=True)
+    responder_thread.start()
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    request = ProtocolPacket(SourceDestID.P_IVI_1.value, SourceDestID.CCU.value, ServiceID.VEHICLE_INFORMATION.value,
+                             VEHICLE_MESSAGE_TYPES.LAST_VEHICLE_INFORMATION.value).pack()
+    start_ns = time.perf_counter_ns()
+    for _ in range(count):
+        client.sendto(request, server.getsockname())
+        decode_state(ProtocolPacket.unpack(client.recv(PROTOCOL_LEN + MAX_PAYLOAD_LEN)).payload_data)
+    round_trip_ns = (time.perf_counter_ns() - start_ns) / count
+    client.close()
+    server.close()
+
+    print(f"{field_count} fields, {count} reads")
+    print(f"cached read:          {read_ns / 1000:8.2f} us")
+    print(f"cached response:      {answer_ns / 1000:8.2f} us")
+    print(f"UDP round trip:       {round_trip_ns / 1000:8.2f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Vehicle state cache benchmark')
+    parser.add_argument('--count', default=10000, type=int, help='Reads per measurement')
+    parser.add_argument('--fields', default=64, type=int, help='Cached fields')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.fields)